@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+
+from testreport.models import Launch
+from testreport.rollups import update_rollups
+
+from datetime import timedelta
+from optparse import make_option
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Calculates daily rollups for launches with test results in DB'
+    option_list = BaseCommand.option_list + (
+        make_option('--test-plan-id',
+                    default=None,
+                    help='Calculate rollups only for this test plan'),
+        make_option('--days',
+                    default=settings.STORE_TESTRESULTS_IN_DAYS,
+                    help='Calculate rollups for last N days'),
+    )
+
+    def handle(self, *args, **options):
+        launches = Launch.objects.filter(
+            created__gte=timezone.now() - timedelta(days=int(options['days'])),
+            archive__isnull=True)
+        if options['test_plan_id'] is not None:
+            launches = launches.filter(test_plan_id=options['test_plan_id'])
+
+        days = set()
+        for test_plan_id, created in launches.values_list('test_plan_id',
+                                                          'created'):
+            days.add((test_plan_id, timezone.localtime(created).date()))
+
+        for test_plan_id, date in sorted(days):
+            log.info('Calculating rollups for test plan {} on {}'.format(
+                test_plan_id, date))
+            update_rollups(test_plan_id, date)
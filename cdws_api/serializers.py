@@ -8,6 +8,7 @@ from testreport.models import Build
 from testreport.models import TestResult
 from testreport.models import LaunchItem
 from testreport.models import Bug
+from testreport.models import DailyRollup
 from stages.models import Stage
 from metrics.models import Metric, MetricValue
 
@@ -110,6 +111,13 @@ class TestResultSerializer(serializers.ModelSerializer):
         model = TestResult
 
 
+class DailyRollupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyRollup
+        fields = ('date', 'launch_item_id', 'launches', 'passed', 'failed',
+                  'skipped', 'blocked', 'total', 'duration')
+
+
 class LaunchItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = LaunchItem
@@ -5,32 +5,51 @@ from django.contrib.auth.models import User, Permission, ContentType
 from common.models import Project, Settings
 from testreport.models import TestPlan
 from testreport.models import Launch
+from testreport.models import LaunchItem
 from testreport.models import Build
 from testreport.models import Bug
+from testreport.models import TestResult
+from testreport.models import DailyRollup
 from testreport.models import INIT_SCRIPT, ASYNC_CALL
 from testreport.models import PASSED, FAILED, SKIPPED, BLOCKED
-from testreport.models import STOPPED
+from testreport.models import STOPPED, FINISHED, INITIALIZED, IN_PROGRESS
 
 from stages.models import Stage
 
 from metrics.models import Metric, MetricValue
 
-from djcelery.models import PeriodicTask, CrontabSchedule
+from djcelery.models import PeriodicTask, CrontabSchedule, TaskMeta
 
 from testreport.tasks import update_bugs
+from testreport.tasks import parse_xml
+from testreport.tasks import refresh_issue_fields
+from testreport.models import get_issue_fields_from_bts
 from testreport.tasks import cleanup_database
+from testreport.tasks import finalize_launch
+from testreport.archive import archive_launch
+from common.results import offload_result
+from common.output import OutputCollector, get_log_names
+from common.storage import get_blob
+from cdws_api.views import create_launch
 
 from django.test.utils import override_settings
 
+from celery.utils import uuid
+from django.core.management import call_command
+from django.core.cache import cache
+
 from django.utils import timezone
 from datetime import timedelta
 from datetime import datetime
 
 import requests_mock
+from unittest import mock
 import json
 import random
 import os
+import tempfile
 import base64
+import io
 
 
 class AbstractEntityApiTestCase(TestCase):
@@ -294,6 +313,95 @@ class TestPlanApiTestCase(AbstractEntityApiTestCase):
         self.assertFalse(launch['build']['hash'])
         self.assertFalse(launch['build']['branch'])
 
+    def test_bulk_execute(self):
+        project = Project.objects.get(name='DummyTestProject')
+        test_plans = [TestPlan.objects.get(name='DummyTestPlan'),
+                      TestPlan.objects.create(name='SecondTestPlan',
+                                              project=project)]
+        for test_plan in test_plans:
+            for item_type in [INIT_SCRIPT, ASYNC_CALL]:
+                self._create_launch_item({
+                    'test_plan': test_plan.id,
+                    'command': 'touch file',
+                    'type': item_type,
+                    'timeout': 10,
+                })
+
+        output = self._call_rest(
+            'post', 'testplans/bulk_execute/',
+            {'test_plans': [test_plan.id for test_plan in test_plans],
+             'options': {'started_by': 'http://2gis.local/', 'hash': '123'},
+             'env': {'VAR': 'value'}})
+        self.assertEqual(2, len(output['launches']))
+        for test_plan in test_plans:
+            launch = Launch.objects.get(
+                id=output['launches'][str(test_plan.id)])
+            self.assertEqual(test_plan.id, launch.test_plan_id)
+            self.assertEqual(2, len(launch.get_tasks()))
+            self.assertEqual('123', launch.build.hash)
+            self.assertEqual({'VAR': 'value'}, launch.get_parameters()['env'])
+
+    def test_bulk_execute_failure(self):
+        project = Project.objects.get(name='DummyTestProject')
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'touch init_file',
+            'type': INIT_SCRIPT,
+            'timeout': 10,
+        })
+        # test plan without init script
+        empty_test_plan = TestPlan.objects.create(name='EmptyTestPlan',
+                                                  project=project)
+
+        output = self._call_rest(
+            'post', 'testplans/bulk_execute/',
+            {'test_plans': [test_plan.id, empty_test_plan.id],
+             'options': {'started_by': 'http://2gis.local/'}})
+        self.assertIn('Initial script for test plan "EmptyTestPlan"',
+                      output['message'])
+        self.assertEqual(0, Launch.objects.count())
+
+        output = self._call_rest(
+            'post', 'testplans/bulk_execute/',
+            {'test_plans': [test_plan.id, 1000],
+             'options': {'started_by': 'http://2gis.local/'}})
+        self.assertEqual('Test plans [1000] do not exist', output['message'])
+
+    def test_execute_unknown_priority(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'touch init_file',
+            'type': INIT_SCRIPT,
+            'timeout': 10,
+        })
+        output = self._tp_execute(
+            test_plan.id, {'options': {'started_by': 'http://2gis.local/',
+                                       'priority': 5}})
+        self.assertEqual('Unknown priority "5"', output['message'])
+        self.assertEqual(0, Launch.objects.count())
+        output = self._tp_execute(
+            test_plan.id, {'options': {'started_by': 'http://2gis.local/',
+                                       'priority': None}})
+        self.assertEqual('Unknown priority "None"', output['message'])
+        self.assertEqual(0, Launch.objects.count())
+
+    def test_execute_invalid_shards(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'touch init_file',
+            'type': INIT_SCRIPT,
+            'timeout': 10,
+        })
+        output = self._tp_execute(
+            test_plan.id, {'options': {'started_by': 'http://2gis.local/',
+                                       'shards': 'abc'}})
+        self.assertEqual('Number of shards "abc" is not integer',
+                         output['message'])
+        self.assertEqual(0, Launch.objects.count())
+
     def test_execute_with_incorrect_items(self):
         test_plan = TestPlan.objects.get(name='DummyTestPlan')
 
@@ -368,6 +476,75 @@ class TestPlanApiTestCase(AbstractEntityApiTestCase):
         self.assertEqual(launch['build']['hash'], '123')
         self.assertEqual(launch['build']['branch'], '123')
 
+    def test_execute_shards(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'touch init_file',
+            'type': INIT_SCRIPT,
+            'timeout': 10,
+        })
+        item = self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'run_tests ${SHARD_TESTS}',
+            'type': ASYNC_CALL,
+            'timeout': 10,
+        })
+        new_item = self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'run_new_tests',
+            'type': ASYNC_CALL,
+            'timeout': 10,
+        })
+        launch = Launch.objects.create(test_plan=test_plan, state=FINISHED)
+        for name, duration in [('a', 5), ('b', 4), ('c', 3), ('d', 3)]:
+            TestResult.objects.create(launch=launch, suite='suite', name=name,
+                                      duration=duration, state=PASSED,
+                                      launch_item_id=item['id'])
+
+        output = self._tp_execute(
+            test_plan.id, {'options': {'started_by': 'http://2gis.local/',
+                                       'shards': 2}})
+        tasks = Launch.objects.get(pk=output['launch_id']).get_tasks()
+        self.assertEqual(4, len(tasks))
+        self.assertEqual(2, list(tasks.values()).count(item['id']))
+        self.assertEqual(1, list(tasks.values()).count(new_item['id']))
+
+    def test_shards_run_tests_without_history(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'touch init_file',
+            'type': INIT_SCRIPT,
+            'timeout': 10,
+        })
+        item = self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'run_tests ${SHARD_TESTS}',
+            'type': ASYNC_CALL,
+            'timeout': 10,
+        })
+        launch = Launch.objects.create(test_plan=test_plan, state=FINISHED)
+        for name, duration in [('a', 5), ('b', 4), ('c', 3)]:
+            TestResult.objects.create(launch=launch, suite='suite', name=name,
+                                      duration=duration, state=PASSED,
+                                      launch_item_id=item['id'])
+
+        launch, chain = create_launch(
+            test_plan, LaunchItem.objects.filter(test_plan=test_plan),
+            {'started_by': 'http://2gis.local/', 'shards': 2})
+        files = chain.tasks[0].args[2]
+        envs = [task.kwargs['env'] for task in chain.tasks[2].tasks]
+        self.assertEqual(2, len(envs))
+        self.assertNotIn('SHARD_SKIP_TESTS', envs[0])
+        # the last shard runs all tests except tests of other shards
+        skip_file = os.path.relpath(envs[1]['SHARD_SKIP_TESTS'],
+                                    envs[1]['WORKSPACE'])
+        self.assertEqual(files[skip_file],
+                         files[os.path.relpath(envs[0]['SHARD_TESTS'],
+                                               envs[0]['WORKSPACE'])])
+        self.assertEqual([{'suite': 'suite', 'name': 'a'}], files[skip_file])
+
     def test_deploy_script_duplication(self):
         test_plan = TestPlan.objects.get(name='DummyTestPlan')
         self._create_launch_item({
@@ -541,6 +718,82 @@ class TestPlanApiTestCase(AbstractEntityApiTestCase):
         self.assertEqual(data['variable_name'], 'BRANCH')
         self.assertEqual(data['variable_value_regexp'], '')
 
+    def _create_launch_with_results(self, test_plan, states):
+        launch = Launch.objects.create(test_plan=test_plan,
+                                       started_by='http://2gis.local/',
+                                       state=IN_PROGRESS)
+        for i, state in enumerate(states):
+            TestResult.objects.create(launch=launch, name='Test{}'.format(i),
+                                      suite='Suite', state=state,
+                                      duration=2, launch_item_id=i % 2 + 1)
+        return launch
+
+    def test_trends_after_cleanup(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        launch = self._create_launch_with_results(
+            test_plan, [PASSED, FAILED, FAILED, SKIPPED])
+        finalize_launch(launch.id)
+        self._create_launch_with_results(test_plan, [BLOCKED])
+        launch = self._create_launch_with_results(test_plan, [PASSED])
+        finalize_launch(launch.id)
+        TestResult.objects.all().delete()
+
+        trends = self._call_rest(
+            'get', 'testplans/{}/trends/'.format(test_plan.id))
+        self.assertEqual(1, len(trends))
+        self.assertEqual(3, trends[0]['launches'])
+        self.assertEqual(2, trends[0]['passed'])
+        self.assertEqual(2, trends[0]['failed'])
+        self.assertEqual(1, trends[0]['skipped'])
+        self.assertEqual(1, trends[0]['blocked'])
+        self.assertEqual(6, trends[0]['total'])
+        self.assertEqual(12, trends[0]['duration'])
+
+        trends = self._call_rest(
+            'get', 'testplans/{}/trends/?launch_item_id=2'.format(
+                test_plan.id))
+        self.assertEqual(1, len(trends))
+        self.assertEqual(1, trends[0]['launches'])
+        self.assertEqual(2, trends[0]['total'])
+
+        trends = self._call_rest(
+            'get', 'testplans/{}/trends/?days=0'.format(test_plan.id))
+        self.assertEqual(0, len(trends))
+
+    def test_test_order(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        launch = Launch.objects.create(test_plan=test_plan, state=FINISHED)
+        for name, state, duration in [('slow', FAILED, 10),
+                                      ('fast', FAILED, 1),
+                                      ('stable', PASSED, 1)]:
+            TestResult.objects.create(launch=launch, suite='suite', name=name,
+                                      state=state, duration=duration,
+                                      launch_item_id=1)
+
+        order = self._call_rest(
+            'get', 'testplans/{}/test_order/'.format(test_plan.id))
+        self.assertEqual(['fast', 'stable', 'slow'],
+                         [test['name'] for test in order])
+        self.assertAlmostEqual(2.0 / 3, order[0]['failure_rate'])
+
+        order = self._call_rest(
+            'get', 'testplans/{}/test_order/?launch_item_id=2'.format(
+                test_plan.id))
+        self.assertEqual([], order)
+
+    def test_backfill_rollups(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        self._create_launch_with_results(test_plan, [PASSED, FAILED])
+        self._create_launch_with_results(test_plan, [FAILED])
+        self.assertEqual(0, DailyRollup.objects.count())
+
+        call_command('backfill_rollups')
+        rollup = DailyRollup.objects.get(launch_item_id=None)
+        self.assertEqual(2, rollup.launches)
+        self.assertEqual(2, rollup.failed)
+        self.assertEqual(3, rollup.total)
+        self.assertEqual(3, DailyRollup.objects.count())
+
 
 class LaunchApiTestCase(AbstractEntityApiTestCase):
     def setUp(self):
@@ -585,11 +838,151 @@ class LaunchApiTestCase(AbstractEntityApiTestCase):
             'timeout': 1200,
         })
         launch = self._create_launch(test_plan.id)
+        Launch.objects.filter(id=launch['id']).update(state=INITIALIZED)
         output = self._terminate_launch(launch['id'])
         self.assertEqual(output['message'], 'Termination done.')
         actual_launch = self._get_launch(launch['id'])
         self.assertEqual(actual_launch['state'], STOPPED)
 
+        # finished launch is not finalized again
+        launch = self._create_launch(test_plan.id)
+        self._terminate_launch(launch['id'])
+        self.assertEqual(self._get_launch(launch['id'])['state'], FINISHED)
+
+    def test_rerun_failed(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        items = [self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'run_tests',
+            'type': item_type,
+            'timeout': 10,
+        }) for item_type in [INIT_SCRIPT, ASYNC_CALL, ASYNC_CALL]]
+        launch = Launch.objects.create(
+            test_plan=test_plan, started_by='http://2gis.local/')
+        launch.set_parameters({'options': {'started_by': 'http://2gis.local/',
+                                           'hash': '123'},
+                               'env': {'VAR': 'value'}, 'json_file': None})
+        launch.save()
+        for item, state in [(items[1], FAILED), (items[2], PASSED)]:
+            TestResult.objects.create(launch=launch, suite='suite',
+                                      name='test', state=state,
+                                      launch_item_id=item['id'])
+
+        output = self._call_rest(
+            'post', 'launches/{}/rerun_failed/'.format(launch.id),
+            {'only_tests': True})
+        rerun = Launch.objects.get(pk=output['launch_id'])
+        self.assertEqual(sorted([items[0]['id'], items[1]['id']]),
+                         sorted(rerun.get_tasks().values()))
+        parameters = rerun.get_parameters()
+        self.assertEqual(launch.id, parameters['options']['rerun_of'])
+        self.assertEqual('123', parameters['options']['hash'])
+        self.assertEqual({'VAR': 'value'}, parameters['env'])
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_rerun_failed_archived(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        items = [self._create_launch_item({
+            'test_plan': test_plan.id,
+            'command': 'run_tests',
+            'type': item_type,
+            'timeout': 10,
+        }) for item_type in [INIT_SCRIPT, ASYNC_CALL, ASYNC_CALL]]
+        launch = Launch.objects.create(
+            test_plan=test_plan, started_by='http://2gis.local/')
+        for item, state in [(items[1], FAILED), (items[2], PASSED)]:
+            TestResult.objects.create(launch=launch, suite='suite',
+                                      name='test', state=state,
+                                      launch_item_id=item['id'])
+        archive_launch(launch)
+
+        output = self._call_rest(
+            'post', 'launches/{}/rerun_failed/'.format(launch.id),
+            {'only_tests': True})
+        rerun = Launch.objects.get(pk=output['launch_id'])
+        self.assertEqual(sorted([items[0]['id'], items[1]['id']]),
+                         sorted(rerun.get_tasks().values()))
+        self.assertTrue(Launch.objects.get(pk=launch.id).is_archived())
+
+    def test_progress(self):
+        cache.clear()
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        tasks = [uuid(), uuid()]
+        launch = Launch(test_plan=test_plan, state=INITIALIZED)
+        launch.set_tasks(dict((task_id, 1) for task_id in tasks))
+        launch.save()
+        TaskMeta.objects.create(task_id=tasks[0], status='SUCCESS')
+
+        progress = self._call_rest(
+            'get', 'launches/{}/progress/'.format(launch.id))
+        self.assertEqual(50, progress['percent'])
+        self.assertEqual(1, progress['tasks']['finished'])
+
+        # progress is taken from cache
+        TaskMeta.objects.create(task_id=tasks[1], status='SUCCESS')
+        progress = self._call_rest(
+            'get', 'launches/{}/progress/'.format(launch.id))
+        self.assertEqual(50, progress['percent'])
+
+        cache.clear()
+        progress = self._call_rest(
+            'get', 'launches/{}/progress/'.format(launch.id))
+        self.assertEqual(100, progress['percent'])
+
+    def test_resources(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        task_id = uuid()
+        launch = Launch(test_plan=test_plan, state=INITIALIZED)
+        launch.set_tasks({task_id: 1})
+        launch.save()
+        TaskMeta.objects.create(
+            task_id=task_id, status='SUCCESS',
+            result={'delta': 1.0,
+                    'resources': {'cpu_time': 0.5, 'max_rss': 1024}})
+
+        resources = self._call_rest(
+            'get', 'launches/{}/resources/'.format(launch.id))
+        self.assertEqual(1, resources['1']['tasks'])
+        self.assertEqual(0.5, resources['1']['cpu_time'])
+        self.assertEqual(1024, resources['1']['max_rss'])
+
+    def test_rerun_without_failures(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        launch = self._create_launch(test_plan.id)
+        output = self._call_rest(
+            'post', 'launches/{}/rerun_failed/'.format(launch['id']))
+        self.assertEqual('There are no failed launch items in launch '
+                         'id={}'.format(launch['id']), output['message'])
+
+    def test_bulk_termination(self):
+        test_plan = TestPlan.objects.get(name='DummyTestPlan')
+        launches = []
+        for hash, state in [('123', INITIALIZED), ('123', INITIALIZED),
+                            ('123', FINISHED), ('456', INITIALIZED)]:
+            launch = Launch(test_plan=test_plan, state=state)
+            launch.set_tasks({uuid(): 1, uuid(): 1})
+            launch.save()
+            Build.objects.create(launch=launch, hash=hash)
+            launches.append(launch)
+        task_id = list(launches[0].get_tasks().keys())[0]
+        TaskMeta.objects.create(task_id=task_id, status='STARTED')
+
+        output = self._call_rest('post', 'launches/bulk_terminate/',
+                                 {'build_hash': '123'})
+        self.assertEqual('Termination done.', output['message'])
+        self.assertEqual(sorted([launches[0].id, launches[1].id]),
+                         sorted(output['launches']))
+        for launch, state in zip(launches, [STOPPED, STOPPED, FINISHED,
+                                            INITIALIZED]):
+            self.assertEqual(state, Launch.objects.get(id=launch.id).state)
+        self.assertEqual({task_id: 1},
+                         Launch.objects.get(id=launches[0].id).get_tasks())
+
+    def test_bulk_termination_without_filter(self):
+        output = self._call_rest('post', 'launches/bulk_terminate/', {})
+        self.assertEqual('At least one of build_hash, test_plan, '
+                         'started_by should be set', output['message'])
+
     def test_calculate_counts(self):
         test_plan = TestPlan.objects.get(name='DummyTestPlan')
         launch = self._create_launch(test_plan.id)
@@ -907,6 +1300,22 @@ class TestResultApiTestCase(AbstractEntityApiTestCase):
         cleanup_database()
         self.assertEqual(len(self._get_testresults()['results']), 0)
 
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_clean_logs_of_expired_launch(self):
+        task_id = uuid()
+        self.launch.set_tasks({task_id: 1})
+        self.launch.finished = timezone.now().date() - timedelta(days=31)
+        self.launch.save()
+        name = get_log_names(task_id)['stdout']
+        OutputCollector(io.BufferedReader(io.BytesIO(b'Hello world\n')),
+                        name, part_size=4).run()
+
+        cleanup_database()
+        self.assertIsNone(get_blob(name))
+        self.assertEqual([], os.listdir(os.path.join(
+            settings.LOCAL_STORAGE_DIR, 'logs')))
+        self.assertTrue(Launch.objects.get(id=self.launch.id).logs_deleted)
+
     def test_not_clean_actual_results(self):
         data = self._get_testresult_data(self.launch.id)
         self._create_testresult(data)
@@ -917,6 +1326,81 @@ class TestResultApiTestCase(AbstractEntityApiTestCase):
         cleanup_database()
         self.assertEqual(len(self._get_testresults()['results']), 2)
 
+    def _archive_launch(self, launch):
+        launch.finished = timezone.now().date() - timedelta(days=31)
+        launch.save()
+        with override_settings(ARCHIVE_TESTRESULTS=True):
+            cleanup_database()
+        return Launch.objects.get(id=launch.id)
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_archive_expired_results(self):
+        data = self._get_testresult_data(self.launch.id)
+        self._create_testresult(data)
+        launch = self._archive_launch(self.launch)
+
+        self.assertTrue(launch.is_archived())
+        self.assertEqual(0, TestResult.objects.count())
+        self.assertEqual(2, launch.counts['total'])
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_archive_only_launches_with_results(self):
+        launch = Launch.objects.create(test_plan=self.test_plan)
+        data = self._get_testresult_data(self.launch.id)
+        self._create_testresult(data)
+        Launch.objects.filter(id__in=[self.launch.id, launch.id]).update(
+            finished=timezone.now() - timedelta(days=31))
+
+        with mock.patch('testreport.tasks.archive_launch') as archive:
+            with override_settings(ARCHIVE_TESTRESULTS=True):
+                cleanup_database()
+        self.assertEqual([self.launch.id],
+                         [call[0][0].id for call in archive.call_args_list])
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_archived_results_read_only(self):
+        data = self._get_testresult_data(self.launch.id)
+        self._create_testresult(data)
+        ids = list(TestResult.objects.order_by('-id').values_list(
+            'id', flat=True))
+        self._archive_launch(self.launch)
+
+        response = self._call_rest(
+            'get', 'testresults/?launch={}&state={}'.format(
+                self.launch.id, FAILED))
+        self.assertEqual(1, response['count'])
+        self.assertEqual('Exception: Clear message about failure',
+                         response['results'][0]['failure_reason'])
+
+        response = self._call_rest(
+            'get', 'testresults/?launch={}&ordering=-id'.format(
+                self.launch.id))
+        self.assertEqual(ids, [r['id'] for r in response['results']])
+
+        response = self._call_rest(
+            'get', 'testresults/?launch={}&search=exception'.format(
+                self.launch.id))
+        self.assertEqual(1, response['count'])
+
+        # results are not restored to DB
+        self.assertTrue(Launch.objects.get(id=self.launch.id).is_archived())
+        self.assertEqual(0, TestResult.objects.count())
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_history_with_archived_launch(self):
+        launch = Launch.objects.create(test_plan=self.test_plan,
+                                       started_by='http://2gis.local/')
+        self._create_testresult(self._get_testresult_data(self.launch.id))
+        self._archive_launch(self.launch)
+        self._create_testresult(self._get_testresult_data(launch.id))
+        result = TestResult.objects.get(launch=launch, state=PASSED)
+
+        response = self._get_testresults('history={}'.format(result.id))
+        self.assertEqual(2, response['count'])
+        self.assertEqual([launch.id, self.launch.id],
+                         [r['launch'] for r in response['results']])
+        self.assertTrue(Launch.objects.get(id=self.launch.id).is_archived())
+
     def test_history(self):
         project = Project.objects.get(name='DummyTestProject')
         testplan1 = self.test_plan
@@ -990,6 +1474,163 @@ class TestResultApiTestCase(AbstractEntityApiTestCase):
                          response['results'][0]['name'])
 
 
+@override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+class TaskResultApiTestCase(AbstractEntityApiTestCase):
+    def _write_log(self, name, content):
+        # small parts to read log from several of them
+        OutputCollector(io.BufferedReader(io.BytesIO(content)), name,
+                        part_size=4).run()
+
+    def _create_task(self, logs, status='SUCCESS'):
+        task_id = uuid()
+        result = {'logs': logs}
+        if status == 'SUCCESS':
+            result.update({'stdout': b'', 'stderr': b'', 'return_code': 0})
+        TaskMeta.objects.create(task_id=task_id, status=status, result=result)
+        return task_id
+
+    def test_log_range(self):
+        name = 'logs/{}.stdout.log'.format(uuid())
+        self._write_log(name, b'Hello world\n')
+        task_id = self._create_task({'stdout': name, 'stderr': None})
+
+        response = self._call_rest(
+            'get', 'tasks/{}/log/?offset=6&limit=3'.format(task_id))
+        self.assertEqual('wor', response['data'])
+        self.assertEqual(9, response['next_offset'])
+        self.assertEqual(12, response['size'])
+
+        response = self._call_rest(
+            'get', 'tasks/{}/log/?offset=9'.format(task_id))
+        self.assertEqual('ld\n', response['data'])
+
+    def test_log_not_exist(self):
+        task_id = self._create_task({'stdout': None, 'stderr': None})
+        response = self._call_rest(
+            'get', 'tasks/{}/log/?stream=stderr'.format(task_id))
+        self.assertEqual('There is no log for task {}'.format(task_id),
+                         response['message'])
+
+        response = self._call_rest(
+            'get', 'tasks/{}/log/?stream=unknown'.format(task_id))
+        self.assertEqual('Unknown stream "unknown"', response['message'])
+
+    @override_settings(LAUNCH_RESULT_INLINE_LIMIT=10,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_offloaded_result(self):
+        task_id = uuid()
+        TaskMeta.objects.create(
+            task_id=task_id, status='SUCCESS',
+            result=offload_result({'cmd': 'echo "Hello world"', 'env': {},
+                                   'stdout': b'Hello world\n',
+                                   'stderr': b'', 'return_code': 0}))
+        self.assertIn('payload', TaskMeta.objects.get(task_id=task_id).result)
+
+        task = self._call_rest('get', 'tasks/{}/'.format(task_id))
+        self.assertEqual('Hello world\n', task['result']['stdout'])
+        self.assertEqual(0, task['result']['return_code'])
+        self.assertNotIn('payload', task['result'])
+
+    def test_result_fields(self):
+        task_id = uuid()
+        TaskMeta.objects.create(
+            task_id=task_id, status='SUCCESS',
+            result={'stdout': b'Hello world\n', 'stderr': b'Error\n',
+                    'return_code': 1, 'delta': 2.5})
+
+        task = self._call_rest(
+            'get', 'tasks/{}/?fields=return_code,delta'.format(task_id))
+        self.assertEqual({'return_code': 1, 'delta': 2.5}, task['result'])
+        self.assertEqual('SUCCESS', task['status'])
+
+        task = self._call_rest(
+            'get', 'tasks/{}/?fields=stderr&tail=3'.format(task_id))
+        self.assertEqual({'stderr': 'or\n'}, task['result'])
+
+        task = self._call_rest('get', 'tasks/{}/?head=5'.format(task_id))
+        self.assertEqual('Hello', task['result']['stdout'])
+        self.assertEqual('Error', task['result']['stderr'])
+
+        task = self._call_rest(
+            'get', 'tasks/{}/?offset=6&limit=3'.format(task_id))
+        self.assertEqual('wor', task['result']['stdout'])
+
+        task = self._call_rest('get', 'tasks/{}/?tail=x'.format(task_id))
+        self.assertIn('invalid literal', task['message'])
+
+    @override_settings(LAUNCH_RESULT_INLINE_LIMIT=10,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_offloaded_result_fields(self):
+        task_id = uuid()
+        TaskMeta.objects.create(
+            task_id=task_id, status='SUCCESS',
+            result=offload_result({'cmd': 'echo "Hello world"', 'env': {},
+                                   'stdout': b'Hello world\n',
+                                   'stderr': b'', 'return_code': 0}))
+        task = self._call_rest(
+            'get', 'tasks/{}/?fields=stdout&tail=6'.format(task_id))
+        self.assertEqual({'stdout': 'world\n'}, task['result'])
+
+    def test_queues(self):
+        for wait in [2, 4]:
+            TaskMeta.objects.create(
+                task_id=uuid(), status='SUCCESS',
+                result={'queue': 'launcher.high', 'wait': wait})
+        TaskMeta.objects.create(task_id=uuid(), status='SUCCESS',
+                                result={'queue': 'launcher', 'wait': None})
+
+        stats = self._call_rest('get', 'tasks/queues/')
+        self.assertEqual(2, stats['launcher.high']['priority'])
+        self.assertEqual(2, stats['launcher.high']['tasks'])
+        self.assertEqual(3, stats['launcher.high']['avg_wait'])
+        self.assertEqual(4, stats['launcher.high']['max_wait'])
+        self.assertEqual(0, stats['launcher']['tasks'])
+        self.assertIsNone(stats['launcher.low']['avg_wait'])
+
+    def test_tail_running_task(self):
+        name = 'logs/{}.stdout.log'.format(uuid())
+        self._write_log(name, b'Hello ')
+        task_id = self._create_task({'stdout': name, 'stderr': None},
+                                    status='STARTED')
+
+        response = self._call_rest(
+            'get', 'tasks/{}/tail/?offset=0'.format(task_id))
+        self.assertEqual('Hello ', response['data'])
+        self.assertEqual(6, response['next_offset'])
+        self.assertFalse(response['finished'])
+        # client requests the next part itself, response is not delayed
+        self.assertEqual(float(settings.LAUNCH_LOG_UPLOAD_INTERVAL),
+                         response['retry'])
+
+        response = self._call_rest(
+            'get', 'tasks/{}/tail/?offset=6'.format(task_id))
+        self.assertEqual('', response['data'])
+        self.assertEqual(6, response['next_offset'])
+        self.assertFalse(response['finished'])
+
+        self._write_log(name, b'Hello world\n')
+        response = self._call_rest(
+            'get', 'tasks/{}/tail/?offset=6'.format(task_id))
+        self.assertEqual('world\n', response['data'])
+        self.assertEqual(12, response['next_offset'])
+
+    def test_tail_finished_task(self):
+        name = 'logs/{}.stdout.log'.format(uuid())
+        self._write_log(name, b'Hello world\n')
+        task_id = self._create_task({'stdout': name, 'stderr': None})
+
+        response = self._call_rest(
+            'get', 'tasks/{}/tail/?offset=6&limit=3'.format(task_id))
+        self.assertEqual('wor', response['data'])
+        self.assertFalse(response['finished'])
+
+        response = self._call_rest(
+            'get', 'tasks/{}/tail/?offset=12'.format(task_id))
+        self.assertEqual('', response['data'])
+        self.assertEqual('SUCCESS', response['state'])
+        self.assertTrue(response['finished'])
+
+
 class CommentsApiTestCase(AbstractEntityApiTestCase):
     comment = 'Dummy comment text'
 
@@ -1016,6 +1657,7 @@ class CommentsApiTestCase(AbstractEntityApiTestCase):
 @override_settings(
     BUG_TRACKING_SYSTEM_HOST='jira.local',
     BUG_TRACKING_SYSTEM_BUG_PATH='/rest/api/latest/issue/{issue_id}',
+    TRACKING_SYSTEM_SEARCH_PATH='/rest/api/latest/search',
     BUG_STATE_EXPIRED=['Closed'])
 class BugsApiTestCase(AbstractEntityApiTestCase):
     issue_found = '{"key": "ISSUE-1","fields": ' \
@@ -1032,6 +1674,30 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
         return 'https://{}/rest/api/latest/issue/{}'.\
                format(settings.BUG_TRACKING_SYSTEM_HOST, externalId)
 
+    def setUp(self):
+        super(BugsApiTestCase, self).setUp()
+        cache.clear()
+
+    def search_request(self):
+        return 'https://{}/rest/api/latest/search'.format(
+            settings.BUG_TRACKING_SYSTEM_HOST)
+
+    def _mock_search(self, m, issues):
+        """
+        Fake Jira search, which returns issues with given statuses
+        for "key in (...)" query.
+        """
+        def search(request, context):
+            query = request.json()['jql']
+            keys = query[query.index('(') + 1:query.rindex(')')].split(',')
+            found = [{'key': key,
+                      'fields': {'status': {'name': issues[key]},
+                                 'summary': 'Issue Title'}}
+                     for key in keys if key in issues]
+            return {'startAt': 0, 'maxResults': len(keys),
+                    'total': len(found), 'issues': found}
+        m.post(self.search_request(), json=search)
+
     def _create_bug(self, issue_name='ISSUE-1'):
         data = {
             'externalId': issue_name,
@@ -1060,6 +1726,47 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
         self.assertEqual('Issue Title', issue['name'])
         self.assertEqual('Regexp', issue['regexp'])
 
+    @requests_mock.Mocker()
+    def test_bug_create_cached(self, m):
+        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._create_bug()
+        Bug.objects.all().delete()
+        response = self._create_bug()
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(1, m.call_count)
+        self.assertEqual('Closed', Bug.objects.get().state)
+
+    @requests_mock.Mocker()
+    def test_stale_bug_refreshed_by_task(self, m):
+        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._create_bug()
+        Bug.objects.all().delete()
+        m.get(self.issue_request('ISSUE-1'), text=self.issue_open_status)
+
+        # stale fields are returned, refresh is left to celery task
+        with override_settings(TIME_BEFORE_UPDATE_BUG_INFO=-1):
+            self._create_bug()
+        self.assertEqual(1, m.call_count)
+        self.assertEqual('Closed', Bug.objects.get().state)
+        self.assertTrue(cache.get('bug-fields-lock-ISSUE-1'))
+
+        refresh_issue_fields('ISSUE-1')
+        self.assertEqual(2, m.call_count)
+        self.assertIsNone(cache.get('bug-fields-lock-ISSUE-1'))
+        self.assertEqual('Open', get_issue_fields_from_bts(
+            'ISSUE-1')['status']['name'])
+
+    @requests_mock.Mocker()
+    def test_update_bugs_cached(self, m):
+        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._mock_search(m, {'ISSUE-1': 'Open'})
+        self._create_bug()
+
+        # closed bug is outdated, but its fields are fresh in cache
+        update_bugs()
+        self.assertEqual(1, m.call_count)
+        self.assertEqual('Closed', Bug.objects.get().state)
+
     @requests_mock.Mocker()
     def test_create_not_existent_bug(self, m):
         m.get(self.issue_request('ISSUE-1'), text=self.issue_not_found)
@@ -1075,8 +1782,7 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
     @requests_mock.Mocker()
     @override_settings(TIME_BEFORE_UPDATE_BUG_INFO=0)
     def test_update_bug_not_exist(self, m):
-        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
-        m.get(self.issue_request('ISSUE-2'), text=self.issue_not_found)
+        self._mock_search(m, {'ISSUE-1': 'Closed'})
 
         self._create_bug_db('ISSUE-1', 'regexp', 'Open', 'Issue Title')
         self._create_bug_db('ISSUE-2', 'regexp', 'Open', 'Issue Title')
@@ -1089,7 +1795,7 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
 
     @requests_mock.Mocker()
     def test_update_bug_recently(self, m):
-        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._mock_search(m, {'ISSUE-1': 'Closed'})
         self._create_bug_db('ISSUE-1', 'regexp', 'Open', 'Issue Title')
 
         update_bugs()
@@ -1098,7 +1804,7 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
 
     @requests_mock.Mocker()
     def test_bug_released_change_status(self, m):
-        m.get(self.issue_request('ISSUE-1'), text=self.issue_open_status)
+        self._mock_search(m, {'ISSUE-1': 'Open'})
         self._create_bug_db('ISSUE-1', 'regexp', 'Closed', 'Issue Title')
 
         update_bugs()
@@ -1107,7 +1813,7 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
 
     @requests_mock.Mocker()
     def test_bug_not_expired(self, m):
-        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._mock_search(m, {'ISSUE-1': 'Closed'})
         self._create_bug_db('ISSUE-1', 'regexp', 'Closed', 'Issue Title')
 
         update_bugs()
@@ -1117,13 +1823,27 @@ class BugsApiTestCase(AbstractEntityApiTestCase):
     @requests_mock.Mocker()
     @override_settings(BUG_TIME_EXPIRED=0)
     def test_bug_expired(self, m):
-        m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
+        self._mock_search(m, {'ISSUE-1': 'Closed'})
         self._create_bug_db('ISSUE-1', 'regexp', 'Closed', 'Issue Title')
 
         update_bugs()
         response = self._get_bugs()
         self.assertEqual(0, len(response['results']))
 
+    @requests_mock.Mocker()
+    @override_settings(TIME_BEFORE_UPDATE_BUG_INFO=0,
+                       BUG_TRACKING_SYSTEM_BATCH_SIZE=2)
+    def test_update_bugs_batched(self, m):
+        issues = dict(('ISSUE-{}'.format(i), 'Resolved') for i in range(5))
+        self._mock_search(m, issues)
+        for key in issues:
+            self._create_bug_db(key, 'regexp', 'Open', 'Issue Title')
+
+        update_bugs()
+        self.assertEqual(3, m.call_count)
+        self.assertEqual(
+            5, Bug.objects.filter(state='Resolved').count())
+
     @requests_mock.Mocker()
     def test_bug_custom_list(self, m):
         m.get(self.issue_request('ISSUE-1'), text=self.issue_found)
@@ -1526,6 +2246,31 @@ class ReportFileApiTestCase(AbstractEntityApiTestCase):
         self.assertEqual(1, passed['count'])
         self.assertEqual(0.4, launch['duration'])
 
+    def test_xml_parsed_after_launch_finished(self):
+        project = Project.objects.create(name='DummyTestProject')
+        testplan = TestPlan.objects.create(name='DummyTestPlan',
+                                           project=project)
+        launch = Launch.objects.create(test_plan=testplan, state=FINISHED)
+        launch.calculate_counts()
+        path = os.path.join(os.path.dirname(__file__),
+                            'testdata/junit-test-report.xml')
+        with open(path, 'rb') as f:
+            report = io.BytesIO(f.read())
+
+        # xml from storage is parsed after the last task finalized launch
+        with mock.patch('testreport.tasks.get_s3_connection'), \
+                mock.patch('testreport.tasks.get_file_from_storage',
+                           return_value=report), \
+                mock.patch('testreport.tasks.delete_file_from_storage'):
+            parse_xml('junit', launch.id, '{}', s3_conn=True,
+                      s3_key_name='junit.xml')
+        launch = Launch.objects.get(id=launch.id)
+        self.assertEqual(FINISHED, launch.state)
+        self.assertEqual(4, launch.counts['total'])
+        self.assertEqual(1, launch.counts['failed'])
+        self.assertEqual(4, DailyRollup.objects.get(
+            test_plan=testplan, launch_item_id=None).total)
+
     def test_upload_junit_file_notime(self):
         project = Project.objects.create(name='DummyTestProject')
         testplan = TestPlan.objects.create(name='DummyTestPlan',
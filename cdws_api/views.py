@@ -27,7 +27,9 @@ from rest_framework_bulk import ListBulkCreateAPIView
 from common.storage import get_s3_connection, get_or_create_bucket
 from common.models import Project, Settings
 from common.tasks import launch_process
-from testreport.tasks import create_environment
+from common.output import read_log
+from common.results import load_result, PAYLOAD_FIELDS
+from testreport.tasks import create_environment, ORDER_FILE
 
 from cdws_api.serializers import ProjectSerializer
 from cdws_api.serializers import LaunchSerializer
@@ -39,6 +41,7 @@ from cdws_api.serializers import CommentSerializer
 from cdws_api.serializers import BugSerializer
 from cdws_api.serializers import StageSerializer
 from cdws_api.serializers import MetricSerializer, MetricValueSerializer
+from cdws_api.serializers import DailyRollupSerializer
 
 from testreport.models import TestPlan
 from testreport.models import Launch
@@ -46,9 +49,15 @@ from testreport.models import Build
 from testreport.models import TestResult
 from testreport.models import LaunchItem
 from testreport.models import Bug
+from testreport.models import DailyRollup
 from testreport.models import INITIALIZED, ASYNC_CALL, INIT_SCRIPT, CONCLUSIVE
 from testreport.models import STOPPED, IN_PROGRESS, FINISHED
+from testreport.models import FAILED, BLOCKED
 from testreport.models import get_issue_fields_from_bts
+from testreport.archive import get_archived_results
+from testreport.history import get_test_durations, split_to_shards
+from testreport.history import get_test_order, get_adaptive_timeouts
+from testreport.progress import get_launch_progress
 
 from stages.models import Stage
 
@@ -56,11 +65,13 @@ from metrics.models import Metric, MetricValue
 from metrics.handlers import HANDLER_CHOICES
 from metrics.tasks import restore_metric_values
 
-from testreport.tasks import finalize_launch
+from testreport.tasks import finalize_launches
 from testreport.tasks import parse_xml
+from testreport.tasks import aggregate_resources, get_task_results
 
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
+from django.db import transaction
 from django.db.models import Q, Count
 
 from comments.models import Comment
@@ -77,6 +88,7 @@ import logging
 import celery
 import copy
 import os
+import re
 import socket
 
 
@@ -145,6 +157,232 @@ class ProjectViewSet(GetOrCreateViewSet):
         return Response(status=status.HTTP_200_OK, data={'message': 'ok'})
 
 
+class LaunchError(Exception):
+    pass
+
+
+def create_launch(test_plan, launch_items, options, env=None,
+                  json_file=None, tests=None):
+    """
+    Creates launch of test plan and returns it with chain of its tasks,
+    which is not sent yet. If tests are set
+    ({launch_item_id: [{'suite': ..., 'name': ...}]}), only these tests
+    are passed to launch items via RERUN_TESTS file.
+    """
+    workspace_path = os.path.join(
+        settings.CDWS_WORKING_DIR,
+        timezone.now().strftime('%Y-%m-%d-%H-%M-%f'))
+
+    # tasks are sent to queue by priority of launch or test plan
+    try:
+        queue = settings.LAUNCHER_PRIORITY_QUEUES[
+            int(options.get('priority', test_plan.priority))]
+    except (KeyError, ValueError, TypeError):
+        raise LaunchError('Unknown priority "{}"'.format(
+            options.get('priority')))
+    try:
+        shards = int(options.get('shards', 1))
+    except (ValueError, TypeError):
+        raise LaunchError('Number of shards "{}" is not integer'.format(
+            options.get('shards')))
+
+    # launch create
+    launch = Launch(test_plan=test_plan,
+                    started_by=options['started_by'],
+                    state=INITIALIZED)
+    launch.save()
+
+    build = Build(launch=launch,
+                  version=options.get('version'),
+                  branch=options.get('branch'),
+                  hash=options.get('hash'))
+    build.save()
+
+    # env create
+    launch_env = {'WORKSPACE':
+                  os.path.join(settings.CDWS_DEPLOY_DIR, workspace_path),
+                  'HOME':
+                  os.path.join(settings.CDWS_DEPLOY_DIR, workspace_path)}
+    if env is not None:
+        for key, value in iter(env.items()):
+            launch_env[key] = value
+    launch_env['REPORT_API_URL'] = 'http://{0}/{1}'.format(
+        settings.CDWS_API_HOSTNAME, settings.CDWS_API_PATH)
+    # environment values should be string for exec
+    launch_env['TESTPLAN_ID'] = str(test_plan.id)
+    launch_env['LAUNCH_ID'] = str(launch.id)
+    launch_env['WORKSPACE_URL'] = 'http://{}/{}/'.format(
+        settings.CELERY_HOST, workspace_path)
+
+    mapping = {}
+    init_task = None
+    async_tasks = []
+    conclusive_tasks = []
+    files = {}
+
+    # tests which fail more often and run faster are passed to runners
+    # first, if it is requested, order is written to workspace by worker
+    order = bool(options.get('order', False))
+    if order:
+        launch_env['TEST_ORDER'] = os.path.join(
+            launch_env['WORKSPACE'], ORDER_FILE)
+    if options.get('fail_fast'):
+        launch_env['FAIL_FAST'] = '1'
+
+    durations = {}
+    if shards > 1:
+        durations = get_test_durations(
+            test_plan.id, [launch_item.id for launch_item in launch_items
+                           if launch_item.type == ASYNC_CALL
+                           and (tests is None or launch_item.id not in tests)])
+
+    timeouts = get_adaptive_timeouts(
+        test_plan.id, [launch_item.id for launch_item in launch_items
+                       if launch_item.adaptive_timeout])
+
+    is_init_task_present = False
+    for launch_item in launch_items:
+        item_uuid = uuid()
+        timeout = timeouts.get(launch_item.id, launch_item.timeout)
+        # Write LAUNCH_ITEM_ID to environment of each process
+        item_env = copy.copy(launch_env)
+        item_env['LAUNCH_ITEM_ID'] = str(launch_item.id)
+        if tests is not None and launch_item.id in tests:
+            tests_file = os.path.join(
+                'rerun', '{}.json'.format(launch_item.id))
+            files[tests_file] = tests[launch_item.id]
+            item_env['RERUN_TESTS'] = os.path.join(
+                launch_env['WORKSPACE'], tests_file)
+        subtask = launch_process.subtask(
+            [launch_item.command, launch_item.type], {'env': item_env},
+            immutable=True,
+            soft_time_limit=timeout,
+            options={'task_id': item_uuid, 'queue': queue})
+
+        if launch_item.type == INIT_SCRIPT:
+            if not is_init_task_present:
+                is_init_task_present = True
+                init_task = subtask
+                mapping[item_uuid] = launch_item.id
+        elif launch_item.type == ASYNC_CALL and \
+                durations.get(launch_item.id):
+            # Each shard is separate task with its own list of tests,
+            # items without history are launched as is. Tests without
+            # history are unknown here, so the last shard runs all tests
+            # except tests of other shards listed in SHARD_SKIP_TESTS.
+            item_shards = split_to_shards(durations[launch_item.id], shards)
+            skip_file = os.path.join(
+                'shards', '{}-skip.json'.format(launch_item.id))
+            files[skip_file] = [{'suite': suite, 'name': name}
+                                for shard_tests in item_shards[:-1]
+                                for suite, name in shard_tests]
+            for index, shard_tests in enumerate(item_shards):
+                shard_uuid = uuid()
+                shard_file = os.path.join(
+                    'shards', '{}-{}.json'.format(launch_item.id, index))
+                files[shard_file] = [{'suite': suite, 'name': name}
+                                     for suite, name in shard_tests]
+                shard_env = copy.copy(item_env)
+                shard_env['SHARD_INDEX'] = str(index)
+                shard_env['SHARD_COUNT'] = str(len(item_shards))
+                shard_env['SHARD_TESTS'] = os.path.join(
+                    launch_env['WORKSPACE'], shard_file)
+                if index == len(item_shards) - 1:
+                    shard_env['SHARD_SKIP_TESTS'] = os.path.join(
+                        launch_env['WORKSPACE'], skip_file)
+                async_tasks.append(launch_process.subtask(
+                    [launch_item.command, launch_item.type],
+                    {'env': shard_env},
+                    immutable=True,
+                    soft_time_limit=timeout,
+                    options={'task_id': shard_uuid, 'queue': queue}))
+                mapping[shard_uuid] = launch_item.id
+        elif launch_item.type == ASYNC_CALL:
+            async_tasks.append(subtask)
+            mapping[item_uuid] = launch_item.id
+        elif launch_item.type == CONCLUSIVE:
+            conclusive_tasks.append(subtask)
+            mapping[item_uuid] = launch_item.id
+        else:
+            launch.delete()
+            raise LaunchError(
+                ('There is launch item with type {0} which not '
+                 'supported, please fix this.').format(launch_item.type))
+    # update launch
+    launch.set_tasks(mapping)
+    launch.set_parameters({
+        'options': options,
+        'env': {} if env is None else env,
+        'json_file': json_file
+    })
+    launch.save()
+
+    # error handling
+    if init_task is None:
+        launch.delete()
+        raise LaunchError(
+            ('Initial script for test plan "{0}" with id "{1}" '
+             'does not exist or not selected. '
+             'Currently selected items: {2}').format(
+                test_plan.name, test_plan.id, launch_items))
+
+    create_env_task = create_environment.subtask(
+        [launch_env, json_file, files, order], immutable=True,
+        soft_time_limit=1200, queue=queue)
+    # pass sequence, launch is finalized after the last task
+    sequence = [create_env_task, init_task, celery.group(async_tasks)]
+    sequence += conclusive_tasks
+    return launch, celery.chain(sequence)
+
+
+def start_launch(test_plan, launch_items, options, env=None,
+                 json_file=None, tests=None):
+    """
+    Creates launch of test plan and sends its launch items to workers.
+    """
+    try:
+        launch, launch_chain = create_launch(
+            test_plan, launch_items, options, env=env, json_file=json_file,
+            tests=tests)
+    except LaunchError as e:
+        return Response(status=status.HTTP_400_BAD_REQUEST,
+                        data={'message': '{}'.format(e)})
+
+    try:
+        log.info("Chain={}".format(launch_chain()))
+    except Exception as e:
+        return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        data={'message': '{}'.format(e)})
+
+    return Response(data={'launch_id': launch.id},
+                    status=status.HTTP_200_OK)
+
+
+def terminate_launches(launches):
+    """
+    Revokes tasks of launches by one broadcast and finalizes launches
+    as stopped.
+    """
+    if not launches:
+        return
+    task_ids = [task_id for launch in launches
+                for task_id in launch.get_tasks().keys()]
+    # Don't save tasks with status PENDING, due PENDING mean
+    # unknown status too.
+    known = set(TaskMeta.objects.filter(task_id__in=task_ids).
+                exclude(status=celery.states.PENDING).
+                values_list('task_id', flat=True))
+    if task_ids:
+        app.control.revoke(task_ids, terminate=True, signal='SIGTERM')
+    with transaction.atomic():
+        for launch in launches:
+            launch.set_tasks(dict(
+                (task_id, launch_item_id) for task_id, launch_item_id
+                in iter(launch.get_tasks().items()) if task_id in known))
+            launch.save(update_fields=['tasks'])
+    finalize_launches([launch.id for launch in launches], STOPPED)
+
+
 class TestPlanViewSet(GetOrCreateViewSet):
     queryset = TestPlan.objects.all()
     serializer_class = TestPlanSerializer
@@ -179,45 +417,9 @@ class TestPlanViewSet(GetOrCreateViewSet):
     @detail_route(methods=['post'],
                   permission_classes=[IsAuthenticatedOrReadOnly])
     def execute(self, request, pk=None):
-        workspace_path = os.path.join(
-            settings.CDWS_WORKING_DIR,
-            timezone.now().strftime('%Y-%m-%d-%H-%M-%f'))
         post_data = request.data
-        options = request.data['options']
-        json_file = None
-        if 'json_file' in post_data:
-            json_file = post_data['json_file']
-
         test_plan = TestPlan.objects.get(pk=pk)
 
-        # launch create
-        launch = Launch(test_plan=test_plan,
-                        started_by=options['started_by'],
-                        state=INITIALIZED)
-        launch.save()
-
-        build = Build(launch=launch,
-                      version=options.get('version'),
-                      branch=options.get('branch'),
-                      hash=options.get('hash'))
-        build.save()
-
-        # env create
-        env = {'WORKSPACE':
-               os.path.join(settings.CDWS_DEPLOY_DIR, workspace_path),
-               'HOME':
-               os.path.join(settings.CDWS_DEPLOY_DIR, workspace_path)}
-        if 'env' in post_data:
-            for key, value in iter(post_data['env'].items()):
-                env[key] = value
-        env['REPORT_API_URL'] = 'http://{0}/{1}'.format(
-            settings.CDWS_API_HOSTNAME, settings.CDWS_API_PATH)
-        # environment values should be string for exec
-        env['TESTPLAN_ID'] = str(test_plan.id)
-        env['LAUNCH_ID'] = str(launch.id)
-        env['WORKSPACE_URL'] = 'http://{}/{}/'.format(
-            settings.CELERY_HOST, workspace_path)
-
         # queryset create
         if 'launch_items' in post_data:
             try:
@@ -229,74 +431,95 @@ class TestPlanViewSet(GetOrCreateViewSet):
         else:
             launch_items = test_plan.launchitem_set.all().order_by('id')
 
-        mapping = {}
-        init_task = None
-        async_tasks = []
-        conclusive_tasks = []
-
-        create_env_task = create_environment.subtask(
-            [env, json_file], immutable=True, soft_time_limit=1200)
-        final_task = finalize_launch.subtask(
-            [launch.id], {}, soft_time_limit=3600, immutable=True)
-
-        is_init_task_present = False
-        for launch_item in launch_items:
-            item_uuid = uuid()
-            # Write LAUNCH_ITEM_ID to environment of each process
-            item_env = copy.copy(env)
-            item_env['LAUNCH_ITEM_ID'] = str(launch_item.id)
-            subtask = launch_process.subtask(
-                [launch_item.command, launch_item.type], {'env': item_env},
-                immutable=True,
-                soft_time_limit=launch_item.timeout,
-                options={'task_id': item_uuid})
-
-            if launch_item.type == INIT_SCRIPT:
-                if not is_init_task_present:
-                    is_init_task_present = True
-                    init_task = subtask
-                    mapping[item_uuid] = launch_item.id
-            elif launch_item.type == ASYNC_CALL:
-                async_tasks.append(subtask)
-                mapping[item_uuid] = launch_item.id
-            elif launch_item.type == CONCLUSIVE:
-                conclusive_tasks.append(subtask)
-                mapping[item_uuid] = launch_item.id
-            else:
-                msg = ('There is launch item with type {0} which not '
-                       'supported, please fix this.').format(launch_item.type)
-                return Response(status=status.HTTP_400_BAD_REQUEST,
-                                data={'message': msg})
-        # update launch
-        launch.set_tasks(mapping)
-        launch.set_parameters({
-            'options': options,
-            'env': {} if 'env' not in post_data else post_data['env'],
-            'json_file': json_file
-        })
-        launch.save()
-
-        # error handling
-        if init_task is None:
-            msg = ('Initial script for test plan "{0}" with id "{1}" '
-                   'does not exist or not selected. '
-                   'Currently selected items: {2}').format(
-                test_plan.name, test_plan.id, launch_items)
-            launch.delete()
+        return start_launch(test_plan, launch_items, post_data['options'],
+                            env=post_data.get('env'),
+                            json_file=post_data.get('json_file'))
+
+    @list_route(methods=['post'],
+                permission_classes=[IsAuthenticatedOrReadOnly])
+    def bulk_execute(self, request):
+        """
+        Starts launches of several test plans with the same options, env
+        and json_file.
+        """
+        post_data = request.data
+        try:
+            ids = []
+            for test_plan_id in post_data.get('test_plans') or []:
+                if int(test_plan_id) not in ids:
+                    ids.append(int(test_plan_id))
+        except (TypeError, ValueError) as e:
             return Response(status=status.HTTP_400_BAD_REQUEST,
-                            data={'message': msg})
-        # pass sequence
-        sequence = [create_env_task, init_task, celery.group(async_tasks)]
-        sequence += conclusive_tasks
-        sequence.append(final_task)
+                            data={'message': '{}'.format(e)})
+        test_plans = TestPlan.objects.in_bulk(ids)
+        missing = [test_plan_id for test_plan_id in ids
+                   if test_plan_id not in test_plans]
+        if not ids or missing:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'message': 'Test plans {} do not exist'.format(
+                    missing)})
+
+        launch_items = dict((test_plan_id, []) for test_plan_id in ids)
+        for launch_item in LaunchItem.objects.filter(
+                test_plan_id__in=ids).order_by('id'):
+            launch_items[launch_item.test_plan_id].append(launch_item)
 
+        launches = {}
+        chains = []
         try:
-            log.info("Chain={}".format(celery.chain(sequence)()))
+            with transaction.atomic():
+                for test_plan_id in ids:
+                    launch, launch_chain = create_launch(
+                        test_plans[test_plan_id], launch_items[test_plan_id],
+                        post_data['options'], env=post_data.get('env'),
+                        json_file=post_data.get('json_file'))
+                    launches[test_plan_id] = launch.id
+                    chains.append(launch_chain)
+        except LaunchError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'message': '{}'.format(e)})
+
+        # chains are sent after commit, by one connection to broker
+        try:
+            with app.producer_or_acquire() as producer:
+                for launch_chain in chains:
+                    log.info("Chain={}".format(
+                        launch_chain.apply_async(producer=producer)))
         except Exception as e:
             return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             data={'message': '{}'.format(e)})
 
-        return Response(data={'launch_id': launch.id},
+        return Response(data={'launches': launches},
+                        status=status.HTTP_200_OK)
+
+    @detail_route(methods=['get'])
+    def test_order(self, request, pk=None):
+        launch_item_id = request.GET.get('launch_item_id')
+        order = get_test_order(pk, launch_item_id=launch_item_id,
+                               days=request.GET.get('days'))
+        return Response(data=order, status=status.HTTP_200_OK)
+
+    @detail_route(methods=['get'])
+    def trends(self, request, pk=None):
+        rollups = DailyRollup.objects.filter(test_plan_id=pk).order_by('date')
+        if 'launch_item_id' in request.GET \
+                and request.GET['launch_item_id'] != '':
+            rollups = rollups.filter(
+                launch_item_id=request.GET['launch_item_id'])
+        else:
+            rollups = rollups.filter(launch_item_id=None)
+        if 'days' in request.GET:
+            delta = datetime.date.today() - datetime.timedelta(
+                days=int(request.GET['days']))
+            rollups = rollups.filter(date__gt=delta)
+        if 'from' in request.GET:
+            from_date = request.GET['from']
+            to_date = datetime.date.today()
+            if 'to' in request.GET:
+                to_date = request.GET['to']
+            rollups = rollups.filter(date__range=(from_date, to_date))
+        return Response(data=DailyRollupSerializer(rollups, many=True).data,
                         status=status.HTTP_200_OK)
 
 
@@ -312,17 +535,7 @@ class LaunchViewSet(viewsets.ModelViewSet):
                   permission_classes=[IsAuthenticatedOrReadOnly])
     def terminate_tasks(self, request, pk=None):
         try:
-            launch = Launch.objects.get(id=pk)
-            tasks = {}
-            for key, v in iter(launch.get_tasks().items()):
-                # Don't save tasks with status PENDING, due PENDING mean
-                # unknown status too.
-                if app.AsyncResult(key).state != 'PENDING':
-                    tasks[key] = v
-                app.control.revoke(key, terminate=True, signal='SIGTERM')
-            launch.set_tasks(tasks)
-            launch.save()
-            finalize_launch(pk, STOPPED)
+            terminate_launches([Launch.objects.get(id=pk)])
         except Launch.DoesNotExist:
             return Response(
                 data={
@@ -338,6 +551,35 @@ class LaunchViewSet(viewsets.ModelViewSet):
             data={'message': 'Termination done.'},
             status=status.HTTP_200_OK)
 
+    @list_route(methods=['post'],
+                permission_classes=[IsAuthenticatedOrReadOnly])
+    def bulk_terminate(self, request):
+        filters = {}
+        for param, field in [('build_hash', 'build__hash'),
+                             ('test_plan', 'test_plan_id'),
+                             ('started_by', 'started_by')]:
+            if request.data.get(param):
+                filters[field] = request.data[param]
+        if not filters:
+            return Response(
+                data={'message': 'At least one of build_hash, test_plan, '
+                                 'started_by should be set'},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        launches = list(Launch.objects.filter(
+            state__in=[INITIALIZED, IN_PROGRESS], **filters))
+        try:
+            terminate_launches(launches)
+        except Exception as e:
+            return Response(
+                data={'message': 'Unable to terminate launches, '
+                                 'due to {}'.format(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(
+            data={'message': 'Termination done.',
+                  'launches': [launch.id for launch in launches]},
+            status=status.HTTP_200_OK)
+
     @list_route(methods=['get'])
     def custom_list(self, request, *args, **kwargs):
         if 'days' in request.GET:
@@ -400,7 +642,7 @@ class LaunchViewSet(viewsets.ModelViewSet):
                 params = launch.get_parameters()
                 params['metrics'] = request.data['metrics']
                 launch.set_parameters(params)
-                launch.save()
+                launch.save(update_fields=['parameters'])
                 return Response(status=status.HTTP_200_OK,
                                 data=LaunchSerializer(launch).data)
             except Launch.DoesNotExist:
@@ -412,6 +654,78 @@ class LaunchViewSet(viewsets.ModelViewSet):
                         data={'message': 'No metrics in post request: '
                                          '{0}'.format(request.data)})
 
+    @detail_route(methods=['get'])
+    def progress(self, request, pk=None):
+        try:
+            progress = get_launch_progress(pk)
+        except Launch.DoesNotExist:
+            return Response(
+                data={
+                    'message': 'Launch with id={} does not exist'.format(pk)},
+                status=status.HTTP_404_NOT_FOUND)
+        return Response(data=progress, status=status.HTTP_200_OK)
+
+    @detail_route(methods=['get'])
+    def resources(self, request, pk=None):
+        try:
+            launch = Launch.objects.get(id=pk)
+        except Launch.DoesNotExist:
+            return Response(
+                data={
+                    'message': 'Launch with id={} does not exist'.format(pk)},
+                status=status.HTTP_404_NOT_FOUND)
+        resources = launch.get_resources()
+        # resources are saved on finalizing, for running launch
+        # they are collected from finished tasks
+        if launch.state in (INITIALIZED, IN_PROGRESS):
+            tasks = launch.get_tasks()
+            resources = aggregate_resources(
+                tasks, get_task_results(tasks.keys()))
+        return Response(data=resources, status=status.HTTP_200_OK)
+
+    @detail_route(methods=['post'],
+                  permission_classes=[IsAuthenticatedOrReadOnly])
+    def rerun_failed(self, request, pk=None):
+        try:
+            launch = Launch.objects.get(id=pk)
+        except Launch.DoesNotExist:
+            return Response(
+                data={
+                    'message': 'Launch with id={} does not exist'.format(pk)},
+                status=status.HTTP_404_NOT_FOUND)
+        if launch.is_archived():
+            failed = [(result.launch_item_id, result.suite, result.name)
+                      for result in get_archived_results([launch])
+                      if result.state in [FAILED, BLOCKED]
+                      and result.launch_item_id is not None]
+        else:
+            failed = TestResult.objects.filter(
+                launch=launch, state__in=[FAILED, BLOCKED]).\
+                exclude(launch_item_id=None).\
+                values_list('launch_item_id', 'suite', 'name')
+
+        tests = {}
+        for launch_item_id, suite, name in failed:
+            tests.setdefault(launch_item_id, []).append(
+                {'suite': suite, 'name': name})
+        if not tests:
+            return Response(
+                status=status.HTTP_400_BAD_REQUEST,
+                data={'message': 'There are no failed launch items in launch '
+                                 'id={}'.format(pk)})
+
+        launch_items = launch.test_plan.launchitem_set.filter(
+            Q(id__in=tests.keys()) | Q(type=INIT_SCRIPT)).order_by('id')
+        parameters = launch.get_parameters()
+        options = copy.copy(parameters.get('options', {}))
+        options['started_by'] = request.data.get(
+            'started_by', options.get('started_by', launch.started_by))
+        options['rerun_of'] = launch.id
+        return start_launch(
+            launch.test_plan, launch_items, options,
+            env=parameters.get('env'), json_file=parameters.get('json_file'),
+            tests=tests if request.data.get('only_tests') else None)
+
 
 class TestResultViewSet(ListBulkCreateAPIView,
                         viewsets.GenericViewSet,
@@ -424,6 +738,58 @@ class TestResultViewSet(ListBulkCreateAPIView,
     filter_fields = ('id', 'state', 'name', 'launch',
                      'duration', 'launch_item_id')
 
+    def _filter_archived(self, request, results):
+        """
+        Applies filters and search of the request to test results read
+        from archive, as filter backends do it for the queryset.
+        """
+        filters = [(field, [request.GET[field]]) for field in
+                   self.filter_fields if field != 'launch'
+                   and request.GET.get(field, '') != '']
+        if request.GET.get('state__in', '') != '':
+            filters.append(('state', request.GET['state__in'].split(',')))
+        for field, values in filters:
+            values = [TestResult._meta.get_field(field).to_python(value)
+                      for value in values]
+            results = [result for result in results
+                       if getattr(result, field) in values]
+        fields = [field.lstrip('^=@$') for field in self.search_fields]
+        for term in SearchFilter().get_search_terms(request):
+            results = [result for result in results if any(
+                re.search(term, getattr(result, field) or '', re.IGNORECASE)
+                for field in fields)]
+        return results
+
+    def _sort(self, request, results):
+        ordering = OrderingFilter().get_ordering(
+            request, self.get_queryset(), self)
+        for field in reversed(ordering or []):
+            name = TestResult._meta.get_field(field.lstrip('-')).attname
+            results.sort(key=lambda result: (getattr(result, name) is None,
+                                             getattr(result, name)),
+                         reverse=field.startswith('-'))
+        return results
+
+    def list(self, request, *args, **kwargs):
+        # Test results of archived launches are read from archive,
+        # they are not restored to DB
+        launch_ids = []
+        if 'launch' in request.GET and request.GET['launch'] != '':
+            launch_ids.append(request.GET['launch'])
+        if 'launch_id__in' in request.GET \
+                and request.GET['launch_id__in'] != '':
+            launch_ids += request.GET['launch_id__in'].split(',')
+        archived = Launch.objects.filter(id__in=launch_ids,
+                                         archive__isnull=False)
+        if len(launch_ids) != 0 and archived.exists():
+            results = list(self.filter_queryset(self.get_queryset()))
+            results += self._filter_archived(
+                request, get_archived_results(archived))
+            page = self.paginate_queryset(self._sort(request, results))
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return super(TestResultViewSet, self).list(request, *args, **kwargs)
+
     @list_route(methods=['get'])
     def custom_list(self, request, *args, **kwargs):
         days = 100
@@ -451,6 +817,17 @@ class TestResultViewSet(ListBulkCreateAPIView,
                 filter(launch_id__in=ids).\
                 filter(name=result.name, suite=result.suite).\
                 order_by('-launch')
+
+            archived = get_archived_results(
+                launches.filter(archive__isnull=False),
+                name=result.name, suite=result.suite)
+            if len(archived) != 0:
+                results = list(self.filter_queryset(self.queryset))
+                results += archived
+                results.sort(key=lambda r: r.launch_id, reverse=True)
+                page = self.paginate_queryset(results)
+                serializer = self.get_serializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
         return self.list(request, *args, **kwargs)
 
 
@@ -472,11 +849,173 @@ class TaskResultViewSet(viewsets.GenericViewSet, mixins.RetrieveModelMixin):
     queryset = TaskMeta.objects.all()
 
     def retrieve(self, request, *args, **kwargs):
+        """
+        Only fields of the result listed in "fields" are returned, if set.
+        Output can be limited by "head", "tail" or "offset" and "limit"
+        (in bytes).
+        """
         log.info(kwargs)
-        serializer = self.get_serializer(
-            launch_process.AsyncResult(kwargs['pk']))
+        task = launch_process.AsyncResult(kwargs['pk'])
+        result = task.result
+        if isinstance(result, dict):
+            fields = None
+            if request.GET.get('fields'):
+                fields = request.GET['fields'].split(',')
+            # output of large results is loaded from storage
+            if fields is None or set(fields) & set(PAYLOAD_FIELDS):
+                result = load_result(result)
+            if fields is not None:
+                result = dict((field, result[field]) for field in fields
+                              if field in result)
+            try:
+                result = self._slice_output(request, result)
+            except ValueError as e:
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={'message': '{}'.format(e)})
+        serializer = self.get_serializer({'id': task.id,
+                                          'result': result,
+                                          'status': task.status})
         return Response(serializer.data)
 
+    def _slice_output(self, request, result):
+        output = dict(result)
+        for name in ['stdout', 'stderr']:
+            value = output.get(name)
+            if not isinstance(value, (bytes, str)):
+                continue
+            if 'offset' in request.GET or 'limit' in request.GET:
+                offset = int(request.GET.get('offset', 0))
+                limit = int(request.GET.get('limit', len(value)))
+                value = value[offset:offset + limit]
+            if 'head' in request.GET:
+                value = value[:int(request.GET['head'])]
+            if 'tail' in request.GET:
+                tail = int(request.GET['tail'])
+                value = value[len(value) - tail:] if tail > 0 else value[:0]
+            output[name] = value
+        return output
+
+    @list_route(methods=['get'])
+    def queues(self, request):
+        """
+        Number of tasks in launcher queues and time of waiting in queue
+        for tasks finished recently.
+        """
+        stats = {}
+        with app.connection() as connection:
+            for priority, queue in iter(
+                    settings.LAUNCHER_PRIORITY_QUEUES.items()):
+                try:
+                    depth = connection.default_channel.queue_declare(
+                        queue=queue, passive=True).message_count
+                except Exception as e:
+                    log.warning('Unable to get size of queue {}: {}'.format(
+                        queue, e))
+                    depth = None
+                stats[queue] = {'priority': priority, 'depth': depth,
+                                'tasks': 0, 'avg_wait': None,
+                                'max_wait': None}
+
+        tasks = TaskMeta.objects.filter(
+            status__in=celery.states.READY_STATES,
+            date_done__gte=timezone.now() - datetime.timedelta(
+                seconds=int(settings.LAUNCHER_QUEUE_STATS_PERIOD)))
+        waits = dict((queue, []) for queue in stats.keys())
+        for task in tasks.only('result').iterator():
+            result = task.result
+            if isinstance(result, dict) and result.get('queue') in waits \
+                    and result.get('wait') is not None:
+                waits[result['queue']].append(result['wait'])
+        for queue, values in iter(waits.items()):
+            if values:
+                stats[queue].update({'tasks': len(values),
+                                     'avg_wait': sum(values) / len(values),
+                                     'max_wait': max(values)})
+        return Response(data=stats, status=status.HTTP_200_OK)
+
+    def _get_log(self, request, pk):
+        """
+        Returns stream, name of its log and state of the task, meta
+        of the task is loaded once.
+        """
+        stream = request.GET.get('stream', 'stdout')
+        if stream not in ['stdout', 'stderr']:
+            raise ParseError('Unknown stream "{}"'.format(stream))
+        # Result of finished task or meta of running one
+        meta = launch_process.backend.get_task_meta(pk)
+        info = meta['result']
+        if not isinstance(info, dict) or 'logs' not in info \
+                or info['logs'][stream] is None:
+            return stream, None, meta['status']
+        return stream, info['logs'][stream], meta['status']
+
+    def _read_log(self, stream, name, offset, limit):
+        try:
+            data, size = read_log(name, offset, limit)
+        except OSError as e:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND,
+                data={'message': 'Unable to read log: {}'.format(e)})
+        return {'stream': stream,
+                'offset': offset,
+                'next_offset': offset + len(data),
+                'size': size,
+                'data': data.decode('utf-8', errors='replace')}
+
+    def _get_limit(self, request):
+        max_limit = int(settings.LAUNCH_LOG_READ_LIMIT)
+        return min(int(request.GET.get('limit', max_limit)), max_limit)
+
+    @detail_route(methods=['get'])
+    def log(self, request, pk=None):
+        offset = int(request.GET.get('offset', 0))
+        try:
+            stream, name, state = self._get_log(request, pk)
+        except ParseError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'message': e.detail})
+        if name is None:
+            return Response(
+                status=status.HTTP_404_NOT_FOUND,
+                data={'message': 'There is no log for task {}'.format(pk)})
+
+        data = self._read_log(stream, name, offset, self._get_limit(request))
+        if isinstance(data, Response):
+            return data
+        return Response(status=status.HTTP_200_OK, data=data)
+
+    @detail_route(methods=['get'])
+    def tail(self, request, pk=None):
+        """
+        Returns output of the task log after "offset" without waiting for
+        it, client requests the next part from "next_offset" not earlier
+        than in "retry" seconds, until the task is finished.
+        """
+        offset = int(request.GET.get('offset', 0))
+        try:
+            stream, name, state = self._get_log(request, pk)
+        except ParseError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'message': e.detail})
+        data = {'stream': stream, 'offset': offset, 'next_offset': offset,
+                'size': 0, 'data': ''}
+        if name is not None:
+            try:
+                content, size = read_log(name, offset,
+                                         self._get_limit(request))
+                data.update({'next_offset': offset + len(content),
+                             'size': size,
+                             'data': content.decode('utf-8',
+                                                    errors='replace')})
+            except OSError:
+                # log is not created yet
+                pass
+        data['state'] = state
+        data['finished'] = state in celery.states.READY_STATES and \
+            data['next_offset'] >= data['size']
+        data['retry'] = float(settings.LAUNCH_LOG_UPLOAD_INTERVAL)
+        return Response(status=status.HTTP_200_OK, data=data)
+
 
 class CommentViewSet(viewsets.ModelViewSet):
     queryset = Comment.objects.all()
@@ -0,0 +1,156 @@
+from common.storage import put_blob, get_blob, delete_blob
+
+import json
+import math
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 65536
+
+
+def _get_part_name(name, index):
+    return '{}.{}'.format(name, index)
+
+
+class OutputCollector(threading.Thread):
+    """
+    Reads output of the process chunk by chunk and writes it to the log in
+    storage (not more than max_size bytes), so it can be read on any host.
+    Log is stored by parts of part_size bytes, the last part is uploaded
+    every upload_interval seconds, then index of the log with its size.
+    Only head and tail of output are kept in memory.
+    """
+    def __init__(self, stream, blob=None, buffer_size=65536,
+                 max_size=104857600, part_size=1048576, upload_interval=5):
+        super(OutputCollector, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.blob = blob
+        self.buffer_size = buffer_size
+        self.max_size = max_size
+        self.part_size = part_size
+        self.upload_interval = upload_interval
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+        self.part = bytearray()
+        self.part_index = 0
+        self.uploaded = None
+        self.upload_time = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def run(self):
+        try:
+            if self.blob is not None:
+                self._upload()
+            for chunk in iter(lambda: self.stream.read1(CHUNK_SIZE), b''):
+                if self.blob is not None and self.size < self.max_size:
+                    self._write(chunk[:self.max_size - self.size])
+                self.size += len(chunk)
+                self._buffer(chunk)
+        finally:
+            if self.blob is not None:
+                if self.timer is not None:
+                    self.timer.cancel()
+                self._upload()
+            self.stream.close()
+
+    def _write(self, data):
+        with self.lock:
+            self.part += data
+            while len(self.part) >= self.part_size:
+                self._put(_get_part_name(self.blob, self.part_index),
+                          bytes(self.part[:self.part_size]))
+                del self.part[:self.part_size]
+                self.part_index += 1
+        # output is uploaded not later than upload_interval seconds after
+        # it is written, even if process writes nothing after it
+        delay = self.upload_time + self.upload_interval - time.time()
+        if delay <= 0:
+            self._upload()
+        elif self.timer is None or not self.timer.is_alive():
+            self.timer = threading.Timer(delay, self._upload)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _upload(self):
+        with self.lock:
+            size = self.part_index * self.part_size + len(self.part)
+            self.upload_time = time.time()
+            if size == self.uploaded:
+                return
+            # index is updated after the part, so size is never ahead of data
+            if self.part:
+                self._put(_get_part_name(self.blob, self.part_index),
+                          bytes(self.part))
+            self._put(self.blob, json.dumps(
+                {'size': size, 'part_size': self.part_size}).encode('utf-8'))
+            self.uploaded = size
+
+    def _put(self, name, content):
+        try:
+            put_blob(name, content)
+        except Exception as e:
+            # Output still has to be read, otherwise process hangs
+            log.error('Unable to write log "{}": {}'.format(name, e))
+
+    def _buffer(self, chunk):
+        if len(self.head) < self.buffer_size:
+            free = self.buffer_size - len(self.head)
+            self.head += chunk[:free]
+            chunk = chunk[free:]
+        self.tail += chunk
+        if len(self.tail) > self.buffer_size:
+            del self.tail[:len(self.tail) - self.buffer_size]
+
+    def get_output(self):
+        skipped = self.size - len(self.head) - len(self.tail)
+        if skipped == 0:
+            return bytes(self.head + self.tail)
+        return bytes(self.head) + \
+            '\n...skipped {} bytes...\n'.format(skipped).encode('utf-8') + \
+            bytes(self.tail)
+
+
+def read_log(name, offset=0, limit=65536):
+    """
+    Returns part of the log from storage and its current size.
+    """
+    index = get_blob(name)
+    if index is None:
+        raise OSError('Log "{}" does not exist'.format(name))
+    index = json.loads(index.decode('utf-8'))
+    end = min(offset + limit, index['size'])
+    data = bytearray()
+    while offset + len(data) < end:
+        position = offset + len(data)
+        part = get_blob(_get_part_name(
+            name, position // index['part_size'])) or b''
+        start = position % index['part_size']
+        if start >= len(part):
+            break
+        data += part[start:start + end - position]
+    return bytes(data), index['size']
+
+
+def get_log_names(task_id):
+    return dict((stream, 'logs/{}.{}.log'.format(task_id, stream))
+                for stream in ['stdout', 'stderr'])
+
+
+def delete_log(name):
+    """
+    Deletes parts of the log and its index from storage.
+    """
+    index = get_blob(name)
+    if index is None:
+        return
+    index = json.loads(index.decode('utf-8'))
+    for part in range(int(math.ceil(
+            float(index['size']) / index['part_size']))):
+        delete_blob(_get_part_name(name, part))
+    delete_blob(name)
@@ -0,0 +1,94 @@
+import threading
+import time
+import logging
+
+import psutil
+
+log = logging.getLogger(__name__)
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Periodically samples resources used by the process and its children:
+    CPU time, RSS, I/O bytes and number of processes. CPU time and I/O of
+    finished children are counted by their last samples.
+    """
+    def __init__(self, pid, interval=1.0, series=False, max_samples=1000):
+        super(ResourceSampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.series = [] if series else None
+        self.max_samples = max_samples
+        self.processes = {}
+        self.max_rss = 0
+        self.max_processes = 0
+        self.samples = 0
+        self.started = time.time()
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            parent = psutil.Process(self.pid)
+        except psutil.Error:
+            return
+        # sampling is finished when process is stopped
+        while self.sample(parent):
+            if self._stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def sample(self, parent):
+        try:
+            if parent.status() == psutil.STATUS_ZOMBIE:
+                return False
+            processes = [parent] + parent.children(recursive=True)
+        except psutil.Error:
+            return False
+        rss = 0
+        count = 0
+        for process in processes:
+            try:
+                cpu = process.cpu_times()
+                memory = process.memory_info()
+                try:
+                    io = process.io_counters()
+                    read, write = io.read_bytes, io.write_bytes
+                except (psutil.AccessDenied, AttributeError):
+                    read, write = 0, 0
+            except psutil.Error:
+                continue
+            self.processes[process.pid] = (cpu.user + cpu.system, read, write)
+            rss += memory.rss
+            count += 1
+        self.samples += 1
+        self.max_rss = max(self.max_rss, rss)
+        self.max_processes = max(self.max_processes, count)
+        if self.series is not None:
+            if len(self.series) >= self.max_samples:
+                # keep every second sample to fit the limit
+                del self.series[1::2]
+            self.series.append([round(time.time() - self.started, 3),
+                                round(self.get_cpu_time(), 3), rss])
+        return True
+
+    def get_cpu_time(self):
+        return sum(cpu for cpu, read, write in self.processes.values())
+
+    def get_summary(self):
+        summary = {
+            'cpu_time': round(self.get_cpu_time(), 3),
+            'max_rss': self.max_rss,
+            'read_bytes': sum(read for cpu, read, write
+                              in self.processes.values()),
+            'write_bytes': sum(write for cpu, read, write
+                               in self.processes.values()),
+            'max_processes': self.max_processes,
+            'samples': self.samples,
+        }
+        if self.series is not None:
+            summary['series'] = self.series
+        return summary
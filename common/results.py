@@ -0,0 +1,108 @@
+from common.storage import put_blob, get_blob, delete_blob, list_blobs
+
+from django.conf import settings
+
+from djcelery.models import TaskMeta
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+PAYLOAD_FIELDS = ('cmd', 'env', 'stdout', 'stderr')
+BYTES_FIELDS = ('stdout', 'stderr')
+
+
+def get_payload_size(result):
+    size = 0
+    for field in PAYLOAD_FIELDS:
+        value = result.get(field)
+        if isinstance(value, (bytes, str)):
+            size += len(value)
+        elif value is not None:
+            size += len(json.dumps(value))
+    return size
+
+
+def pack_payload(result):
+    payload = {}
+    for field in PAYLOAD_FIELDS:
+        value = result.get(field)
+        if field in BYTES_FIELDS and isinstance(value, bytes):
+            value = {'base64': base64.b64encode(value).decode('ascii')}
+        payload[field] = value
+    content = io.BytesIO()
+    # without modification time the same payloads are compressed equally
+    with gzip.GzipFile(fileobj=content, mode='wb', mtime=0) as archive:
+        archive.write(json.dumps(payload, sort_keys=True).encode('utf-8'))
+    return content.getvalue()
+
+
+def unpack_payload(content):
+    payload = json.loads(gzip.decompress(content).decode('utf-8'))
+    for field in BYTES_FIELDS:
+        if isinstance(payload.get(field), dict):
+            payload[field] = base64.b64decode(payload[field]['base64'])
+    return payload
+
+
+def offload_result(result):
+    """
+    Moves bulky fields of the result (command, environment and output)
+    to storage, if they are larger than LAUNCH_RESULT_INLINE_LIMIT bytes.
+    Name of the blob is hash of its content, so the same payloads
+    are stored once.
+    """
+    if get_payload_size(result) <= int(settings.LAUNCH_RESULT_INLINE_LIMIT):
+        return result
+    content = pack_payload(result)
+    name = 'results/{}.json.gz'.format(hashlib.sha256(content).hexdigest())
+    try:
+        put_blob(name, content)
+    except Exception as e:
+        log.error('Unable to store result payload "{}": {}'.format(name, e))
+        return result
+    output = dict((key, value) for key, value in iter(result.items())
+                  if key not in PAYLOAD_FIELDS)
+    output['payload'] = name
+    return output
+
+
+def load_result(result):
+    """
+    Returns the result with fields loaded from storage, if they are there.
+    """
+    if not isinstance(result, dict) or 'payload' not in result:
+        return result
+    content = get_blob(result['payload'])
+    if content is None:
+        log.error('Result payload "{}" not found in storage'.format(
+            result['payload']))
+        return result
+    output = dict(result)
+    output.update(unpack_payload(content))
+    del output['payload']
+    return output
+
+
+def delete_unused_payloads():
+    """
+    Deletes payloads which are not referenced by results of tasks anymore.
+    Payloads are shared between tasks, so they live while any task points
+    to them. Payloads younger than LAUNCH_RESULT_PAYLOAD_MIN_AGE seconds are kept,
+    because their tasks can be not stored yet.
+    """
+    used = set()
+    for task in TaskMeta.objects.only('result').iterator():
+        if isinstance(task.result, dict) and 'payload' in task.result:
+            used.add(task.result['payload'])
+    deleted = []
+    for name, age in list_blobs('results/'):
+        if name not in used and age >= float(settings.LAUNCH_RESULT_PAYLOAD_MIN_AGE):
+            delete_blob(name)
+            deleted.append(name)
+    return deleted
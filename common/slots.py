@@ -0,0 +1,24 @@
+import fcntl
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def acquire_slot(directory, count):
+    """
+    Locks one of count slot files in directory, so processes of all workers
+    on the host share the same slots. Returns opened file of the slot or None
+    if all slots are busy, slot is released when file is closed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for index in range(count):
+        slot = open(os.path.join(directory, 'slot-{}.lock'.format(index)), 'w')
+        try:
+            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            slot.close()
+            continue
+        log.debug('Slot {} acquired'.format(index))
+        return slot
+    return None
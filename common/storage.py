@@ -1,8 +1,12 @@
 import boto
 import boto.s3.connection
+from boto.utils import parse_ts
 
 from django.conf import settings
 
+import datetime
+import os
+import time
 import logging
 log = logging.getLogger(__name__)
 
@@ -26,3 +30,79 @@ def get_or_create_bucket(s3_connection):
     if bucket is None:
         bucket = s3_connection.create_bucket(settings.S3_BUCKET_NAME)
     return bucket
+
+
+def _get_local_path(name):
+    return os.path.join(settings.LOCAL_STORAGE_DIR, name)
+
+
+def put_blob(name, content):
+    """
+    Saves content to the S3 bucket, or to LOCAL_STORAGE_DIR if connection
+    to storage is not set in settings.
+    """
+    s3_connection = get_s3_connection()
+    if s3_connection is not None:
+        key = get_or_create_bucket(s3_connection).new_key(name)
+        key.set_contents_from_string(content)
+        log.debug('Blob "{}" created in bucket "{}"'.format(
+            name, settings.S3_BUCKET_NAME))
+        return
+
+    path = _get_local_path(name)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    log.debug('Blob "{}" created in "{}"'.format(
+        name, settings.LOCAL_STORAGE_DIR))
+
+
+def get_blob(name):
+    s3_connection = get_s3_connection()
+    if s3_connection is not None:
+        key = get_or_create_bucket(s3_connection).get_key(name)
+        if key is None:
+            return None
+        return key.get_contents_as_string()
+
+    path = _get_local_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def delete_blob(name):
+    s3_connection = get_s3_connection()
+    if s3_connection is not None:
+        get_or_create_bucket(s3_connection).delete_key(name)
+        return
+
+    path = _get_local_path(name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def list_blobs(prefix):
+    """
+    Returns names of blobs starting with prefix and their ages in seconds.
+    """
+    s3_connection = get_s3_connection()
+    if s3_connection is not None:
+        now = datetime.datetime.utcnow()
+        return [(key.name,
+                 (now - parse_ts(key.last_modified)).total_seconds())
+                for key in get_or_create_bucket(s3_connection).list(prefix)]
+
+    output = []
+    directory = _get_local_path(os.path.dirname(prefix))
+    if not os.path.exists(directory):
+        return output
+    now = time.time()
+    for name in os.listdir(directory):
+        name = os.path.join(os.path.dirname(prefix), name)
+        path = _get_local_path(name)
+        if name.startswith(prefix) and os.path.isfile(path):
+            output.append((name, now - os.path.getmtime(path)))
+    return output
@@ -1,16 +1,26 @@
 from __future__ import absolute_import
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.exceptions import Ignore
+from celery.signals import task_postrun, task_revoked, before_task_publish
 from celery import states
 
 from testreport.models import INIT_SCRIPT
-from testreport.tasks import finalize_launch
+from testreport.tasks import finalize_launch, complete_launch_task
+
+from common.output import OutputCollector, get_log_names
+from common.slots import acquire_slot
+from common.resources import ResourceSampler
+from common.results import offload_result
+
+from django.conf import settings
 
 import celery
 import subprocess
 import logging
 import datetime
 import signal
+import socket
+import time
 import psutil
 
 
@@ -29,7 +39,27 @@ def kill_proc_tree(pid, including_parent=True):
 
 
 @celery.task(time_limit=43200, bind=True)
-def launch_process(self, cmd, task_type=None, env={}):
+def launch_process(self, cmd, task_type=None, env={}, queued=None):
+    # Number of processes on the host is limited by slots, which are shared
+    # by workers of all queues
+    slot = None
+    if int(settings.LAUNCHER_SLOTS) > 0:
+        slot = acquire_slot(settings.LAUNCHER_SLOTS_DIR,
+                            int(settings.LAUNCHER_SLOTS))
+        if slot is None:
+            log.info('There are no free slots on {}, retry in {}s'.format(
+                socket.gethostname(), settings.LAUNCHER_SLOT_RETRY_DELAY))
+            raise self.retry(
+                countdown=int(settings.LAUNCHER_SLOT_RETRY_DELAY),
+                max_retries=None)
+    try:
+        return _run_process(self, cmd, task_type, env, queued)
+    finally:
+        if slot is not None:
+            slot.close()
+
+
+def _run_process(self, cmd, task_type, env, queued):
     pid = None
 
     def sigterm_handler(signum, frame):
@@ -49,23 +79,62 @@ def launch_process(self, cmd, task_type=None, env={}):
         'stdout': None,
         'stderr': None,
         'return_code': 0,
+        'logs': {'stdout': None, 'stderr': None},
+        'queue': (self.request.delivery_info or {}).get('routing_key'),
+        'wait': None,
     }
+    # time from sending of task to start of process
+    if queued is not None:
+        result['wait'] = max(time.time() - queued, 0.0)
     cwd = '/tmp/'
     if 'WORKSPACE' in env:
         cwd = env['WORKSPACE']
+    if self.request.id is not None:
+        result['logs'] = get_log_names(self.request.id)
+        # Logs of running task can be read by API from storage
+        self.update_state(state=states.STARTED,
+                          meta={'logs': result['logs'],
+                                'hostname': socket.gethostname()})
+    sampler = None
+    collectors = {}
+    process = None
     try:
-        cmd = subprocess.Popen(['bash', '-c', cmd], stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE, env=env, cwd=cwd,
-                               universal_newlines=False)
-        pid = cmd.pid
-        result['stdout'], result['stderr'] = cmd.communicate()
-        result['return_code'] = cmd.returncode
+        process = subprocess.Popen(['bash', '-c', cmd], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, env=env, cwd=cwd,
+                                   universal_newlines=False)
+        pid = process.pid
+        if float(settings.LAUNCH_RESOURCES_INTERVAL) > 0:
+            sampler = ResourceSampler(
+                pid, interval=float(settings.LAUNCH_RESOURCES_INTERVAL),
+                series=bool(settings.LAUNCH_RESOURCES_SERIES),
+                max_samples=int(settings.LAUNCH_RESOURCES_MAX_SAMPLES))
+            sampler.start()
+        # Output is written to logs in storage, only its head and tail
+        # are kept in result
+        for name in ['stdout', 'stderr']:
+            collectors[name] = OutputCollector(
+                getattr(process, name), result['logs'][name],
+                buffer_size=int(settings.LAUNCH_OUTPUT_BUFFER_SIZE),
+                max_size=int(settings.LAUNCH_LOG_MAX_SIZE),
+                part_size=int(settings.LAUNCH_LOG_PART_SIZE),
+                upload_interval=float(settings.LAUNCH_LOG_UPLOAD_INTERVAL))
+            collectors[name].start()
+        process.wait()
+        if sampler is not None:
+            sampler.stop()
+            result['resources'] = sampler.get_summary()
+        for name, collector in iter(collectors.items()):
+            collector.join()
+            result[name] = collector.get_output()
+            result['{}_size'.format(name)] = collector.size
+        result['return_code'] = process.returncode
         # If INIT_SCRIPT task returns non-zero code we finalize launch
         # and raise Ignore exception to force the worker to ignore
         # current task and all tasks in its callback
         # http://docs.celeryproject.org/en/3.1/userguide/tasks.html#ignore
         if result['return_code'] != 0 and task_type == INIT_SCRIPT:
-            self.update_state(state=states.FAILURE, meta=result)
+            self.update_state(state=states.FAILURE,
+                              meta=offload_result(result))
             finalize_launch(launch_id=env['LAUNCH_ID'])
             raise Ignore()
     except subprocess.CalledProcessError as e:
@@ -77,9 +146,59 @@ def launch_process(self, cmd, task_type=None, env={}):
     except SoftTimeLimitExceeded as e:
         result['stderr'] = 'Soft timeout limit exceeded. {}'.format(e)
         result['return_code'] = 1
+    finally:
+        # process is killed before its slot is released, threads are
+        # stopped after timeouts and errors too
+        if process is not None and process.poll() is None:
+            try:
+                kill_proc_tree(pid)
+            except psutil.NoSuchProcess:
+                pass
+        if sampler is not None:
+            sampler.stop()
+        for collector in collectors.values():
+            collector.join()
     end = datetime.datetime.now()
     result['start'] = start.isoformat()
     result['end'] = end.isoformat()
     result['delta'] = (end - start).total_seconds()
 
-    return result
+    # large output is kept in storage, not in result backend
+    return offload_result(result)
+
+
+def _complete_launch_task(task_kwargs):
+    env = task_kwargs.get('env') or {}
+    if 'LAUNCH_ID' not in env:
+        return
+    try:
+        complete_launch_task(env['LAUNCH_ID'])
+    except Exception as e:
+        log.error('Unable to complete task of launch {}: {}'.format(
+            env['LAUNCH_ID'], e))
+
+
+@before_task_publish.connect
+def launch_process_before_publish(sender=None, body=None, **kw):
+    if sender != launch_process.name or body is None:
+        return
+    # time of the first sending is kept on retries
+    if body.get('kwargs') is None:
+        body['kwargs'] = {}
+    body['kwargs'].setdefault('queued', time.time())
+
+
+@task_postrun.connect
+def launch_process_postrun(sender=None, kwargs=None, state=None, **kw):
+    if sender is None or sender.name != launch_process.name:
+        return
+    if state == states.RETRY:
+        return
+    _complete_launch_task(kwargs or {})
+
+
+@task_revoked.connect
+def launch_process_revoked(sender=None, request=None, **kw):
+    if sender is None or sender.name != launch_process.name:
+        return
+    _complete_launch_task(request.kwargs or {})
@@ -0,0 +1,77 @@
+from common.models import Settings
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+import logging
+log = logging.getLogger(__name__)
+
+HOLIDAYS_KEY = 'holidays'
+WEEKEND = (5, 6)
+
+
+def count_weekend_days(start_date, end_date):
+    """
+    Returns number of weekend days among start_date, start_date + 1 day,
+    ... not later than end_date.
+    """
+    if end_date < start_date:
+        return 0
+    days = (end_date - start_date).days + 1
+    weekday = start_date.weekday()
+    weekends = days // 7 * len(WEEKEND)
+    for day in range(days % 7):
+        if (weekday + day) % 7 in WEEKEND:
+            weekends += 1
+    return weekends
+
+
+def count_holidays(start_date, end_date, holidays):
+    """
+    Same as count_weekend_days for sorted list of holiday dates, holidays
+    at weekend are not counted.
+    """
+    if end_date < start_date or not holidays:
+        return 0
+    days = (end_date - start_date).days
+    first = start_date.date()
+    return (bisect_right(holidays, first + timedelta(days=days)) -
+            bisect_left(holidays, first))
+
+
+def get_business_timedelta(start_date, end_date, holidays=None):
+    excluded = count_weekend_days(start_date, end_date) + \
+        count_holidays(start_date, end_date, holidays)
+    return end_date - start_date - timedelta(days=excluded)
+
+
+def get_business_timedeltas(periods, holidays=None):
+    """
+    Returns business time of each (start_date, end_date) period.
+    """
+    return [get_business_timedelta(start_date, end_date, holidays)
+            for start_date, end_date in periods]
+
+
+def parse_holidays(value):
+    """
+    Holidays are dates like 2015-01-01 separated by commas or spaces.
+    Returns sorted list of dates, which are not at weekend.
+    """
+    holidays = set()
+    for item in value.replace(',', ' ').split():
+        try:
+            date = datetime.strptime(item, '%Y-%m-%d').date()
+        except ValueError:
+            log.warning('Holiday "{}" is not a date, skipped'.format(item))
+            continue
+        if date.weekday() not in WEEKEND:
+            holidays.add(date)
+    return sorted(holidays)
+
+
+def get_project_holidays(project_id):
+    values = Settings.objects.filter(
+        project_id=project_id, key=HOLIDAYS_KEY).values_list('value',
+                                                             flat=True)
+    return parse_holidays(' '.join(values))
@@ -1,3 +1,5 @@
+from metrics.businesstime import get_business_timedeltas
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -9,26 +11,24 @@ HANDLER_CHOICES = (
 )
 
 
-def count(data):
-    return len(data)
+# data of handler is iterator over issues, it can be read only once,
+# holidays are sorted dates excluded from business time with weekends
+def count(data, holidays=None):
+    return sum(1 for issue in data)
 
 
-def cycletime(data):
-    if len(data) == 0:
+def _get_average_seconds(timedeltas):
+    if len(timedeltas) == 0:
         return 0
-
-    avg_cycle_time = 0
-    for issue in data:
-        avg_cycle_time += issue.get_cycle_time().total_seconds()
-    return int(avg_cycle_time / len(data))
+    return int(sum(value.total_seconds() for value in timedeltas) /
+               len(timedeltas))
 
 
-def leadtime(data):
-    if len(data) == 0:
-        return 0
+def cycletime(data, holidays=None):
+    return _get_average_seconds(get_business_timedeltas(
+        [issue.get_cycle_period() for issue in data], holidays))
 
-    avg_lead_time = 0
-    for issue in data:
-        avg_lead_time += issue.get_lead_time().total_seconds()
 
-    return int(avg_lead_time / len(data))
+def leadtime(data, holidays=None):
+    return _get_average_seconds(get_business_timedeltas(
+        [issue.get_lead_period() for issue in data], holidays))
@@ -1,12 +1,17 @@
 import requests
+import hashlib
 import json
 import logging
 
 from django.conf import settings
+from django.core.cache import cache
 
 from rest_framework.exceptions import APIException
 
-from datetime import datetime, timedelta
+from metrics.businesstime import get_business_timedelta
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 log = logging.getLogger(__name__)
 
@@ -14,29 +19,69 @@ log = logging.getLogger(__name__)
 def request_jira_api(query, fields=None,
                      max_results=settings.TRACKING_SYSTEM_MAX_RESULTS,
                      expand=None):
+    """
+    Returns iterator over issues found by query. Issues are requested by
+    pages of max_results, the next page is requested while issues of the
+    current one are handled. Errors of the first page are raised at once.
+    """
+    session = requests.Session()
+    session.auth = (settings.BUG_TRACKING_SYSTEM_LOGIN,
+                    settings.BUG_TRACKING_SYSTEM_PASSWORD)
+    session.headers.update({'Content-Type': 'application/json'})
+
+    def request(start_at):
+        return _request_page(
+            session, query, fields, max_results, expand, start_at)
+    return _iterate_pages(request, request(0))
+
+
+def _get_issues_cache_key(query, fields, expand):
+    return 'jira-issues-{}'.format(hashlib.sha1(json.dumps(
+        [query, fields, expand], sort_keys=True).encode('utf-8')).hexdigest())
+
+
+def get_jira_issues(query, fields=None, expand=None):
+    """
+    Returns list of issues found by query. Issues are cached for
+    JIRA_ISSUES_CACHE_TIMEOUT seconds, so metrics with the same query
+    request tracking system once. Issues with changelog are also used
+    for requests without it.
+    """
+    keys = [_get_issues_cache_key(query, fields, expand)]
+    if expand is None:
+        keys.append(_get_issues_cache_key(query, fields, ['changelog']))
+    cached = cache.get_many(keys)
+    for key in keys:
+        if key in cached:
+            log.info('Issues of query "{}" are taken from cache'.format(
+                query))
+            return cached[key]
+    issues = list(request_jira_api(query, fields=fields, expand=expand))
+    cache.set(keys[0], issues, int(settings.JIRA_ISSUES_CACHE_TIMEOUT))
+    return issues
+
+
+def _request_page(session, query, fields, max_results, expand, start_at):
     url = 'https://{}{}'.format(
         settings.BUG_TRACKING_SYSTEM_HOST,
         settings.TRACKING_SYSTEM_SEARCH_PATH)
     data = json.dumps({'jql': query,
+                       'startAt': start_at,
                        'maxResults': max_results,
                        'fields': fields,
                        'expand': expand})
-    auth = (settings.BUG_TRACKING_SYSTEM_LOGIN,
-            settings.BUG_TRACKING_SYSTEM_PASSWORD)
-    headers = {'Content-Type': 'application/json'}
 
     response = None
 
     try:
         log.info('url="{}", data="{}", headers="{}"'.
-                 format(url, data, headers))
-        response = requests.post(url=url, data=data,
-                                 auth=auth, headers=headers)
+                 format(url, data, session.headers))
+        response = session.post(url=url, data=data)
         result = response.json()
     except Exception as e:
         log.error('Some problems appeared during connection to "{}", '
                   'auth="{}", data="{}", headers="{}", response="{}"'.
-                  format(url, auth, data, headers, response))
+                  format(url, session.auth, data, session.headers, response))
         raise e
 
     log.debug(result)
@@ -49,86 +94,126 @@ def request_jira_api(query, fields=None,
         log.debug(errors)
         raise APIException(
             "Tracking system: '{}'".format('\n'.join(errors)))
-    return build_objects(result)
-
-
-def build_objects(issues_dict):
-    if 'issues' in issues_dict:
-        issues_dict = issues_dict['issues']
-    output = []
-    for issue in issues_dict:
-        output.append(JiraIssue(issue))
-    return output
+    return result
+
+
+def _iterate_pages(request, page):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            issues = page.get('issues', [])
+            start_at = page.get('startAt', 0) + len(issues)
+            next_page = None
+            if len(issues) != 0 and start_at < page.get('total', 0):
+                next_page = executor.submit(request, start_at)
+            for issue in issues:
+                yield JiraIssue(issue)
+            if next_page is None:
+                return
+            page = next_page.result()
+
+
+def _parse_datetime(string_date):
+    """
+    Parses date like 2015-07-01T10:00:00.000+0300 without time zone,
+    it is much faster than strptime.
+    """
+    if not string_date:
+        return None
+    return datetime(int(string_date[0:4]), int(string_date[5:7]),
+                    int(string_date[8:10]), int(string_date[11:13]),
+                    int(string_date[14:16]), int(string_date[17:19]))
+
+
+def _format_datetime(value):
+    if value is None:
+        return None
+    return value.isoformat()
 
 
 class JiraIssue(object):
-    source = None
+    """
+    Dates of issue are taken from its fields and changelog once,
+    when issue is created, the source data of issue is not kept.
+    """
+    __slots__ = ('key', 'created', 'resolution_date',
+                 'cycletime_start_date', 'finish_date')
 
     def __init__(self, issue):
-        self.source = issue
-
-    def _string_to_date(self, string_date):
-        return datetime.strptime(string_date[:19], '%Y-%m-%dT%H:%M:%S')
+        self.key = issue.get('key')
+        fields = issue.get('fields') or {}
+        self.created = _parse_datetime(fields.get('created'))
+        self.resolution_date = _parse_datetime(fields.get('resolutiondate'))
+        self.cycletime_start_date = None
+        self.finish_date = None
+        if 'changelog' in issue:
+            self._handle_changelog(issue['changelog'])
+
+    def dump(self):
+        """
+        Returns dates of issue, which can be saved as JSON.
+        """
+        return [_format_datetime(value) for value in (
+            self.created, self.resolution_date, self.cycletime_start_date,
+            self.finish_date)]
+
+    @classmethod
+    def load(cls, key, dates):
+        issue = cls.__new__(cls)
+        issue.key = key
+        (issue.created, issue.resolution_date, issue.cycletime_start_date,
+         issue.finish_date) = [_parse_datetime(value) for value in dates]
+        return issue
+
+    def _handle_changelog(self, changelog):
+        for history in changelog['histories']:
+            for item in history['items']:
+                if item['field'] == 'status':
+                    created = _parse_datetime(history['created'])
+                    self.finish_date = created
+                    if item['fromString'] == 'Взят в бэклог':
+                        self.cycletime_start_date = created
+                    if item['toString'] == 'Open':
+                        self.cycletime_start_date = created
 
-    def _get_timedelta(self, start_date, end_date, exclude_weekend=False):
+    def _get_timedelta(self, start_date, end_date, exclude_weekend=False,
+                       holidays=None):
         if exclude_weekend:
-            weekends = 0
-            current_date = start_date
-            while current_date <= end_date:
-                if current_date.weekday() in [5, 6]:
-                    weekends += 1
-                current_date += timedelta(days=1)
-            return end_date - start_date - timedelta(days=weekends)
+            return get_business_timedelta(start_date, end_date, holidays)
 
         return end_date - start_date
 
+    def _get_date(self, field, value):
+        if value is None:
+            raise RuntimeError(
+                'Issue {} has no value of {}'.format(self.key, field))
+        return value
+
     def get_datetime(self, field):
         if field == 'finish_date':
-            return self._get_finish_date()
+            return self._get_date(field, self.finish_date)
         elif field == 'created':
-            return self._get_create_date()
+            return self._get_date(field, self.created).replace(
+                hour=0, minute=0, second=0)
         elif field == 'resolutiondate':
-            return self._get_resolution_date()
+            return self._get_date(field, self.resolution_date).replace(
+                hour=0, minute=0, second=0)
         else:
             raise RuntimeError(
                 'Unable to get date field with name {}'.format(field))
 
-    def _get_create_date(self):
-        return datetime.strptime(
-            self.source['fields']['created'][:10], '%Y-%m-%d')
-
-    def _get_resolution_date(self):
-        return datetime.strptime(
-            self.source['fields']['resolutiondate'][:10], '%Y-%m-%d')
-
-    def _get_finish_date(self):
-        return self.handle_changelog('finish_date')
-
-    def get_cycle_time(self):
-        return self._get_timedelta(
-            self.handle_changelog('cycletime_start_date'),
-            self._get_finish_date(),
-            exclude_weekend=True)
+    def get_cycle_period(self):
+        return (self._get_date('cycletime_start_date',
+                               self.cycletime_start_date),
+                self.get_datetime('finish_date'))
 
-    def get_lead_time(self):
-        return self._get_timedelta(
-            self._string_to_date(self.source['fields']['created']),
-            self._get_finish_date(),
-            exclude_weekend=True)
+    def get_lead_period(self):
+        return (self._get_date('created', self.created),
+                self.get_datetime('finish_date'))
 
-    def handle_changelog(self, type):
-        for history in self.source['changelog']['histories']:
-            for item in history['items']:
-                if item['field'] == 'status':
-                    finish_date = self._string_to_date(history['created'])
-                    if item['fromString'] == 'Взят в бэклог':
-                        cycletime_start_date = \
-                            self._string_to_date(history['created'])
-                    if item['toString'] == 'Open':
-                        cycletime_start_date = \
-                            self._string_to_date(history['created'])
+    def get_cycle_time(self, holidays=None):
+        return self._get_timedelta(*self.get_cycle_period(),
+                                   exclude_weekend=True, holidays=holidays)
 
-        if type == 'finish_date':
-            return finish_date
-        if type == 'cycletime_start_date':
-            return cycletime_start_date
+    def get_lead_time(self, holidays=None):
+        return self._get_timedelta(*self.get_lead_period(),
+                                   exclude_weekend=True, holidays=holidays)
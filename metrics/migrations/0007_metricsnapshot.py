@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0006_auto_20150727_1145'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricSnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('query', models.TextField(blank=True, default='')),
+                ('changelog', models.BooleanField(default=False)),
+                ('refreshed', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('issues', models.TextField(default='{}')),
+                ('metric', models.OneToOneField(related_name='snapshot', to='metrics.Metric')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
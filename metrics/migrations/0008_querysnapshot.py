@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_settings'),
+        ('metrics', '0007_metricsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuerySnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('query', models.TextField(blank=True, default='')),
+                ('query_hash', models.CharField(max_length=40)),
+                ('changelog', models.BooleanField(default=False)),
+                ('refreshed', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('issues', models.TextField(default='{}')),
+                ('project', models.ForeignKey(to='common.Project')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RemoveField(
+            model_name='metricsnapshot',
+            name='metric',
+        ),
+        migrations.DeleteModel(
+            name='MetricSnapshot',
+        ),
+        migrations.AlterUniqueTogether(
+            name='querysnapshot',
+            unique_together=set([('project', 'query_hash')]),
+        ),
+    ]
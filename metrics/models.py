@@ -8,6 +8,9 @@ from metrics.handlers import HANDLER_CHOICES
 
 from django.utils import timezone
 
+import hashlib
+import json
+
 
 class Metric(models.Model):
     project = models.ForeignKey(Project)
@@ -42,3 +45,36 @@ class MetricValue(models.Model):
         if self.created is None:
             self.created = timezone.now()
         super().save(force_insert, force_update, using, update_fields)
+
+
+class QuerySnapshot(models.Model):
+    """
+    Issues found by query of project metrics. Snapshot is updated by issues
+    changed since the previous calculation and is fully refreshed every
+    METRIC_SNAPSHOT_MAX_AGE seconds.
+    """
+    project = models.ForeignKey(Project)
+    query = models.TextField(default='', blank=True)
+    query_hash = models.CharField(max_length=40)
+    changelog = models.BooleanField(default=False)
+    refreshed = models.DateTimeField()
+    updated = models.DateTimeField()
+    issues = models.TextField(default='{}')
+
+    class Meta:
+        unique_together = ('project', 'query_hash')
+
+    def get_issues(self):
+        if self.issues == '' or self.issues is None:
+            self.issues = '{}'
+        return json.loads(self.issues)
+
+    def set_issues(self, issues):
+        self.issues = json.dumps(issues)
+
+    def __str__(self):
+        return '{} -> QuerySnapshot: {}'.format(self.project, self.query)
+
+
+def get_query_hash(query):
+    return hashlib.sha1(query.encode('utf-8')).hexdigest()
@@ -0,0 +1,121 @@
+from metrics.models import Metric, QuerySnapshot, get_query_hash
+from metrics.jira import request_jira_api, get_jira_issues, JiraIssue
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+import json
+import logging
+import math
+import re
+log = logging.getLogger(__name__)
+
+# issues missing in snapshot are requested by N keys
+KEYS_BATCH_SIZE = 100
+ORDER_BY = re.compile(r'\s*\bORDER\s+BY\b.*$', re.IGNORECASE | re.DOTALL)
+
+
+def _get_since(date, now):
+    """
+    Returns relative JQL date of the previous update with overlap, like
+    "-15m". Absolute dates are read by Jira in time zone of its user,
+    relative ones do not depend on time zone.
+    """
+    seconds = (now - date).total_seconds() + \
+        int(settings.METRIC_SNAPSHOT_OVERLAP)
+    return '-{}m'.format(int(math.ceil(max(seconds, 0) / 60.0)))
+
+
+def _split_order(query):
+    """
+    Splits query to its condition and trailing ORDER BY clause, so other
+    conditions can be added to it.
+    """
+    match = ORDER_BY.search(query)
+    if match is None:
+        return query, ''
+    return query[:match.start()], query[match.start():]
+
+
+def _is_actual(snapshot, changelog, now):
+    return (snapshot.changelog or not changelog) and \
+        (now - snapshot.refreshed).total_seconds() < \
+        int(settings.METRIC_SNAPSHOT_MAX_AGE)
+
+
+def _dump(issues):
+    return dict((issue.key, issue.dump()) for issue in issues)
+
+
+def _update_issues(snapshot, query, fields, expand, now):
+    """
+    Keys of all issues found by query are requested to remove issues which
+    do not match query any more, and issues changed since the previous
+    update or missing in snapshot are requested with their fields.
+    """
+    issues = snapshot.get_issues()
+    keys = set(issue.key for issue in request_jira_api(query, fields=['key']))
+    condition, order = _split_order(query)
+    updated = _dump(request_jira_api(
+        '({}) AND updated >= "{}"{}'.format(
+            condition, _get_since(snapshot.updated, now), order),
+        fields=fields, expand=expand))
+    missing = sorted(keys.difference(issues, updated))
+    for index in range(0, len(missing), KEYS_BATCH_SIZE):
+        updated.update(_dump(request_jira_api(
+            'key in ({})'.format(
+                ','.join(missing[index:index + KEYS_BATCH_SIZE])),
+            fields=fields, expand=expand)))
+    issues.update(updated)
+    removed = set(issues).difference(keys)
+    for key in removed:
+        del issues[key]
+    log.info('Snapshot of query "{}": {} issues updated, {} removed'.format(
+        query, len(updated), len(removed)))
+    return issues
+
+
+def get_query_issues(project_id, query, fields=None, expand=None):
+    """
+    Returns issues of query, which are kept in snapshot of the query for all
+    metrics of project with this query. All issues are requested, if
+    snapshot is missing, is made without changelog, or is older than
+    METRIC_SNAPSHOT_MAX_AGE seconds.
+    """
+    now = timezone.now()
+    changelog = expand is not None and 'changelog' in expand
+    query_hash = get_query_hash(query)
+    snapshot = QuerySnapshot.objects.filter(
+        project_id=project_id, query_hash=query_hash).first()
+    if snapshot is not None and _is_actual(snapshot, changelog, now):
+        log.info('Updating snapshot of query "{}" since {}'.format(
+            query, snapshot.updated))
+        issues = _update_issues(snapshot, query, fields, expand, now)
+        QuerySnapshot.objects.filter(pk=snapshot.pk).update(
+            issues=json.dumps(issues), updated=now)
+        return [JiraIssue.load(key, dates)
+                for key, dates in iter(issues.items())]
+
+    log.info('Refreshing snapshot of query "{}"'.format(query))
+    data = get_jira_issues(query, fields=fields, expand=expand)
+    snapshot = QuerySnapshot(project_id=project_id, query=query,
+                             query_hash=query_hash, changelog=changelog,
+                             refreshed=now, updated=now)
+    snapshot.set_issues(_dump(data))
+    try:
+        with transaction.atomic():
+            QuerySnapshot.objects.filter(
+                project_id=project_id, query_hash=query_hash).delete()
+            snapshot.save()
+    except IntegrityError:
+        log.info('Snapshot of query "{}" is refreshed by another '
+                 'task'.format(query))
+    return data
+
+
+def delete_unused_snapshots(project_id):
+    queries = set(get_query_hash(query) for query in Metric.objects.filter(
+        project_id=project_id).values_list('query', flat=True))
+    QuerySnapshot.objects.filter(project_id=project_id).exclude(
+        query_hash__in=queries).delete()
@@ -4,16 +4,69 @@ from metrics.models import Metric, MetricValue
 from metrics import handlers
 
 from metrics.jira import request_jira_api
+from metrics.snapshots import get_query_issues, delete_unused_snapshots
+from metrics.businesstime import get_project_holidays
 
 import celery
 from datetime import timedelta
 
 from django.conf import settings
+from django.core.cache import cache
 
 import logging
 log = logging.getLogger(__name__)
 
 
+# handlers, which need changelog of issues
+CHANGELOG_HANDLERS = ('cycletime', 'leadtime')
+ISSUE_FIELDS = ['created', 'resolutiondate']
+
+
+def _get_expand(handler_names):
+    if any(handler in CHANGELOG_HANDLERS for handler in handler_names):
+        return ['changelog']
+    return None
+
+
+def calculate_metric(metric, data, holidays=None):
+    method = getattr(handlers, metric.handler)
+    log.info('Handling selected data started')
+    try:
+        value = method(data, holidays=holidays)  # handler value
+        log.info('Handling selected data finished')
+    except Exception as e:
+        log.error('Selected data of query "{}" can not be handle by '
+                  '{}-handler: {}'.format(metric.query, metric.handler, e))
+        metric.error = e
+        metric.save()
+        raise e
+
+    metric.error = ''
+    metric.save()
+    log.info('Creating metric value for metric {}'.format(metric.name))
+    MetricValue.objects.create(metric=metric, value=value)
+    log.info('Metric created')
+
+
+def _claim_metric(metric_id):
+    """
+    Metric is calculated once by all its tasks started in
+    METRIC_CALCULATION_CLAIM_TIMEOUT seconds.
+    """
+    return cache.add('metric-calculation-{}'.format(metric_id), True,
+                     int(settings.METRIC_CALCULATION_CLAIM_TIMEOUT))
+
+
+def get_metrics_group(metric):
+    """
+    Metrics of project with the same query and schedule are calculated
+    together, so their issues are requested once per schedule tick.
+    """
+    return list(Metric.objects.filter(
+        project_id=metric.project_id, query=metric.query,
+        schedule__crontab_id=metric.schedule.crontab_id).order_by('id'))
+
+
 @celery.task()
 def run_metric_calculation(metric_id):
     log.info('Getting metric {} from DB'.format(metric_id))
@@ -23,53 +76,57 @@ def run_metric_calculation(metric_id):
         log.error('Metric with id {} was not found in DB'.format(metric_id))
         raise ObjectDoesNotExist
 
-    expand = None
-    fields = ['created', 'resolutiondate']
-    if metric.handler in ['cycletime']:
-        expand = ['changelog']
-
-    method = getattr(handlers, metric.handler)
-    if settings.JIRA_INTEGRATION:
-        try:
-            data = request_jira_api(metric.query, fields=fields, expand=expand)
-        except Exception as e:
-            metric.error = e
-            metric.save()
-            raise e
-
-        log.info('Handling selected data started')
-        try:
-            value = method(data)  # handler value
-            log.info('Handling selected data finished')
-        except Exception as e:
-            log.error('Selected data "{}" can not be handle by {}-handler: {}'.
-                      format(data, metric.handler, e))
-            metric.error = e
-            metric.save()
-            raise e
-
-        metric.error = ''
-        metric.save()
-        log.info('Creating metric value for metric {}'.format(metric.name))
-        MetricValue.objects.create(metric=metric, value=value)
-        log.info('Metric created')
-    else:
+    if not settings.JIRA_INTEGRATION:
         log.info('Jira integration is off. '
                  'If you want to use this feature, turn it on.')
+        return
+
+    if not _claim_metric(metric.id):
+        log.info('Metric {} is already calculated with metrics of the same '
+                 'query'.format(metric_id))
+        return
+    # task of metric calculates other metrics of the group, which are not
+    # calculated by their own tasks yet
+    metrics = [metric] + [other for other in get_metrics_group(metric)
+                          if other.id != metric.id and
+                          _claim_metric(other.id)]
+
+    holidays = get_project_holidays(metric.project_id)
+    try:
+        data = get_query_issues(
+            metric.project_id, metric.query, fields=ISSUE_FIELDS,
+            expand=_get_expand(other.handler for other in metrics))
+    except Exception as e:
+        for other in metrics:
+            other.error = e
+            other.save()
+        raise e
+
+    error = None
+    for other in metrics:
+        try:
+            calculate_metric(other, data, holidays)
+        except Exception as e:
+            # error is saved to metric, other metrics are calculated
+            if other.id == metric.id:
+                error = e
+    delete_unused_snapshots(metric.project_id)
+    if error is not None:
+        raise error
 
 
 @celery.task()
 def restore_metric_values(metric_id, query, step, handler, handler_field):
-    expand = None
-    if handler in ['cycletime', 'leadtime']:
-        expand = ['changelog']
+    expand = _get_expand([handler])
 
     if settings.JIRA_INTEGRATION:
         try:
             method = getattr(handlers, handler)
+            holidays = get_project_holidays(
+                Metric.objects.get(pk=metric_id).project_id)
             data = request_jira_api(
                 query=query,
-                fields=['created', 'resolutiondate'],
+                fields=ISSUE_FIELDS,
                 expand=expand)
 
             results = group_issues_by_step(data, int(step), handler_field)
@@ -77,45 +134,49 @@ def restore_metric_values(metric_id, query, step, handler, handler_field):
         except Exception as e:
             raise e
 
+        values = []
         for date, group in results.items():
             log.info('Handling selected data started')
             try:
-                value = method(group)  # handler value
+                value = method(group, holidays=holidays)  # handler value
                 log.info('Handling selected data finished')
             except Exception as e:
                 log.error(
                     'Selected data "{}" can not be handle by {}-handler: {}'.
-                    format(data, handler, e))
+                    format(group, handler, e))
                 raise e
-            MetricValue.objects.create(metric_id=metric_id, value=value,
-                                       created=date)
+            values.append(MetricValue(metric_id=metric_id, value=value,
+                                      created=date))
+        MetricValue.objects.bulk_create(values)
     else:
         log.info('Jira integration is off. '
                  'If you want to use this feature, turn it on.')
 
 
 def group_issues_by_step(issues, step_in_days, field):
-    sorted_issues = sorted(
-        issues, key=lambda item: item.get_datetime(field))
-
-    start_date = sorted_issues[-1].get_datetime(field)
-    current_interval = start_date - timedelta(days=step_in_days)
-
-    group_issues = {}
-    tmp = []
-    while len(sorted_issues) != 0:
-        issue = sorted_issues.pop()
-        if issue.get_datetime(field) >= current_interval:
-            tmp.append(issue)
-        else:
-            group_issues[(current_interval + timedelta(days=step_in_days))
-                         .strftime('%Y-%m-%d')] = tmp
-            current_interval = current_interval - timedelta(days=step_in_days)
-            sorted_issues.append(issue)
-            tmp = []
-
-    if len(tmp) != 0:
-        group_issues[(current_interval + timedelta(days=step_in_days))
-                     .strftime('%Y-%m-%d')] = tmp
-
-    return group_issues
+    """
+    Groups issues by intervals of step_in_days back from the latest date
+    of field: issue of date d is in interval number
+    max(0, ceil((latest - d) / step) - 1). Returns {date: issues}, where
+    date is the end of interval, empty intervals are included.
+    """
+    dates = []
+    items = []
+    for issue in issues:
+        dates.append(issue.get_datetime(field))
+        items.append(issue)
+    if len(items) == 0:
+        return {}
+
+    start_date = max(dates)
+    step = timedelta(days=step_in_days)
+    indexes = []
+    for date in dates:
+        number, rest = divmod(start_date - date, step)
+        indexes.append(max(0, number if rest else number - 1))
+
+    groups = [[] for i in range(max(indexes) + 1)]
+    for index, issue in zip(indexes, items):
+        groups[index].append(issue)
+    return dict(((start_date - step * index).strftime('%Y-%m-%d'), group)
+                for index, group in enumerate(groups))
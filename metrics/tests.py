@@ -0,0 +1,425 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from rest_framework.exceptions import APIException
+
+from common.models import Project, Settings
+
+from djcelery.models import CrontabSchedule, PeriodicTask
+
+from metrics.jira import request_jira_api, get_jira_issues, JiraIssue
+from metrics.businesstime import count_weekend_days, get_business_timedelta
+from metrics.businesstime import get_project_holidays
+from metrics.models import Metric, MetricValue, QuerySnapshot
+from metrics.models import get_query_hash
+from metrics.tasks import group_issues_by_step, restore_metric_values
+from metrics.tasks import run_metric_calculation
+from metrics import handlers
+
+from datetime import datetime, date, timedelta
+
+import random
+import requests_mock
+
+
+def _create_issue(key, created='2015-07-01T10:00:00.000+0300',
+                  resolutiondate='2015-07-10T10:00:00.000+0300',
+                  histories=None):
+    return {'key': key,
+            'fields': {'created': created, 'resolutiondate': resolutiondate},
+            'changelog': {'histories': histories or []}}
+
+
+def _mock_search(m, url, issues):
+    """
+    Fake Jira search, which returns issues by pages of maxResults.
+    """
+    def search(request, context):
+        data = request.json()
+        start_at = data['startAt']
+        return {'startAt': start_at, 'maxResults': data['maxResults'],
+                'total': len(issues),
+                'issues': issues[start_at:start_at + data['maxResults']]}
+    m.post(url, json=search)
+
+
+def _create_metric(project, name, handler, query):
+    return Metric.objects.create(
+        project=project, name=name, query=query, handler=handler,
+        schedule=PeriodicTask.objects.create(
+            name=name, task='metrics.tasks.run_metric_calculation',
+            crontab=CrontabSchedule.objects.get_or_create()[0]))
+
+
+@override_settings(
+    BUG_TRACKING_SYSTEM_HOST='jira.local',
+    TRACKING_SYSTEM_SEARCH_PATH='/rest/api/latest/search')
+class JiraApiTestCase(TestCase):
+    search_request = 'https://jira.local/rest/api/latest/search'
+
+    def _mock_search(self, m, issues):
+        _mock_search(m, self.search_request, issues)
+
+    @requests_mock.Mocker()
+    def test_request_all_pages(self, m):
+        self._mock_search(
+            m, [_create_issue('ISSUE-{}'.format(i)) for i in range(5)])
+
+        issues = request_jira_api('project = ISSUE', max_results=2)
+        self.assertEqual(['ISSUE-{}'.format(i) for i in range(5)],
+                         [issue.key for issue in issues])
+        self.assertEqual(
+            [0, 2, 4],
+            [request.json()['startAt'] for request in m.request_history])
+
+    @requests_mock.Mocker()
+    def test_request_empty(self, m):
+        self._mock_search(m, [])
+        self.assertEqual(0, handlers.count(request_jira_api('project = A')))
+        self.assertEqual(1, m.call_count)
+
+    @requests_mock.Mocker()
+    def test_request_errors(self, m):
+        m.post(self.search_request,
+               json={'errorMessages': ['Field "a" does not exist'],
+                     'errors': {}})
+        with self.assertRaises(APIException):
+            request_jira_api('a = b')
+
+    @requests_mock.Mocker()
+    def test_handlers_read_pages(self, m):
+        self._mock_search(
+            m, [_create_issue('ISSUE-{}'.format(i)) for i in range(3)])
+        self.assertEqual(
+            3, handlers.count(request_jira_api('project = A', max_results=1)))
+        self.assertEqual(3, m.call_count)
+
+
+class BusinessTimeTestCase(TestCase):
+    def _count_weekend_days(self, start_date, end_date):
+        weekends = 0
+        current_date = start_date
+        while current_date <= end_date:
+            if current_date.weekday() in [5, 6]:
+                weekends += 1
+            current_date += timedelta(days=1)
+        return weekends
+
+    def test_count_weekend_days(self):
+        generator = random.Random(0)
+        start = datetime(2015, 1, 1)
+        for i in range(500):
+            start_date = start + timedelta(
+                seconds=generator.randint(0, 100 * 86400))
+            end_date = start_date + timedelta(
+                seconds=generator.randint(-86400, 60 * 86400))
+            self.assertEqual(
+                self._count_weekend_days(start_date, end_date),
+                count_weekend_days(start_date, end_date))
+
+    def test_business_timedelta_with_holidays(self):
+        # from Thursday to next Tuesday, Friday is holiday
+        holidays = [date(2015, 7, 3)]
+        self.assertEqual(
+            timedelta(days=2, hours=1),
+            get_business_timedelta(datetime(2015, 7, 2, 10),
+                                   datetime(2015, 7, 7, 11), holidays))
+
+    def test_project_holidays(self):
+        project = Project.objects.create(name='Project')
+        Settings.objects.create(project=project, key='holidays',
+                                value='2015-01-02, 2015-01-03 2015-13-01')
+        self.assertEqual([date(2015, 1, 2)],
+                         get_project_holidays(project.id))
+
+
+class JiraIssueTestCase(TestCase):
+    def _create_history(self, created, from_string, to_string):
+        return {'created': created,
+                'items': [{'field': 'assignee', 'fromString': None,
+                           'toString': 'user'},
+                          {'field': 'status', 'fromString': from_string,
+                           'toString': to_string}]}
+
+    def test_dates(self):
+        issue = JiraIssue(_create_issue('ISSUE-1', histories=[
+            self._create_history('2015-07-02T09:00:00.000+0300',
+                                 'Взят в бэклог', 'In Progress'),
+            self._create_history('2015-07-03T11:30:00.000+0300',
+                                 'In Progress', 'Resolved')]))
+        self.assertEqual('ISSUE-1', issue.key)
+        self.assertEqual(datetime(2015, 7, 1), issue.get_datetime('created'))
+        self.assertEqual(datetime(2015, 7, 10),
+                         issue.get_datetime('resolutiondate'))
+        self.assertEqual(datetime(2015, 7, 3, 11, 30),
+                         issue.get_datetime('finish_date'))
+        self.assertEqual(timedelta(days=1, hours=2, minutes=30),
+                         issue.get_cycle_time())
+        self.assertEqual(timedelta(days=2, hours=1, minutes=30),
+                         issue.get_lead_time())
+        self.assertFalse(hasattr(issue, '__dict__'))
+
+        loaded = JiraIssue.load(issue.key, issue.dump())
+        self.assertEqual(issue.get_cycle_time(), loaded.get_cycle_time())
+        self.assertEqual(issue.get_lead_time(), loaded.get_lead_time())
+
+    def test_without_changelog(self):
+        issue = JiraIssue({'key': 'ISSUE-1', 'fields': {
+            'created': '2015-07-01T10:00:00.000+0300'}})
+        self.assertEqual(datetime(2015, 7, 1), issue.get_datetime('created'))
+        with self.assertRaises(RuntimeError):
+            issue.get_datetime('finish_date')
+        with self.assertRaises(RuntimeError):
+            issue.get_datetime('resolutiondate')
+
+
+class GroupIssuesTestCase(TestCase):
+    def _group_issues_by_step(self, issues, step_in_days, field):
+        sorted_issues = sorted(
+            issues, key=lambda item: item.get_datetime(field))
+
+        start_date = sorted_issues[-1].get_datetime(field)
+        current_interval = start_date - timedelta(days=step_in_days)
+
+        group_issues = {}
+        tmp = []
+        while len(sorted_issues) != 0:
+            issue = sorted_issues.pop()
+            if issue.get_datetime(field) >= current_interval:
+                tmp.append(issue)
+            else:
+                group_issues[(current_interval +
+                              timedelta(days=step_in_days))
+                             .strftime('%Y-%m-%d')] = tmp
+                current_interval = \
+                    current_interval - timedelta(days=step_in_days)
+                sorted_issues.append(issue)
+                tmp = []
+
+        if len(tmp) != 0:
+            group_issues[(current_interval + timedelta(days=step_in_days))
+                         .strftime('%Y-%m-%d')] = tmp
+
+        return group_issues
+
+    def _get_keys(self, groups):
+        return dict((date, sorted(issue.key for issue in group))
+                    for date, group in iter(groups.items()))
+
+    def test_group_issues_by_step(self):
+        generator = random.Random(0)
+        for step in (1, 3, 7, 30):
+            issues = [JiraIssue(_create_issue(
+                'ISSUE-{}'.format(i),
+                created=(datetime(2015, 1, 1) + timedelta(
+                    days=generator.randint(0, 200))).isoformat()))
+                for i in range(50)]
+            self.assertEqual(
+                self._get_keys(
+                    self._group_issues_by_step(issues, step, 'created')),
+                self._get_keys(group_issues_by_step(issues, step, 'created')))
+
+    def test_group_empty_intervals(self):
+        issues = [
+            JiraIssue(_create_issue(
+                'ISSUE-1', created='2015-07-01T10:00:00.000+0300')),
+            JiraIssue(_create_issue(
+                'ISSUE-2', created='2015-07-10T10:00:00.000+0300'))]
+        groups = group_issues_by_step(iter(issues), 3, 'created')
+        self.assertEqual(
+            {'2015-07-10': ['ISSUE-2'], '2015-07-07': [],
+             '2015-07-04': ['ISSUE-1']}, self._get_keys(groups))
+        self.assertEqual({}, group_issues_by_step([], 3, 'created'))
+
+    @requests_mock.Mocker()
+    @override_settings(
+        JIRA_INTEGRATION=True,
+        BUG_TRACKING_SYSTEM_HOST='jira.local',
+        TRACKING_SYSTEM_SEARCH_PATH='/rest/api/latest/search')
+    def test_restore_metric_values(self, m):
+        _mock_search(m, 'https://jira.local/rest/api/latest/search', [
+            _create_issue('ISSUE-1', created='2015-07-01T10:00:00.000+0300'),
+            _create_issue('ISSUE-2', created='2015-07-01T12:00:00.000+0300'),
+            _create_issue('ISSUE-3', created='2015-07-05T10:00:00.000+0300')])
+        metric = _create_metric(Project.objects.create(name='Project'),
+                                'Metric', 'count', 'project = A')
+
+        restore_metric_values(metric.id, metric.query, 1, 'count', 'created')
+        self.assertEqual(
+            [('2015-07-02', 2), ('2015-07-03', 0), ('2015-07-04', 0),
+             ('2015-07-05', 1)],
+            [(value.created.strftime('%Y-%m-%d'), value.value) for value in
+             MetricValue.objects.filter(metric=metric).order_by('created')])
+
+
+@override_settings(
+    JIRA_INTEGRATION=True,
+    BUG_TRACKING_SYSTEM_HOST='jira.local',
+    TRACKING_SYSTEM_SEARCH_PATH='/rest/api/latest/search')
+class MetricCalculationTestCase(TestCase):
+    search_request = 'https://jira.local/rest/api/latest/search'
+
+    def setUp(self):
+        cache.clear()
+        self.project = Project.objects.create(name='Project')
+        history = {'created': '2015-07-02T10:00:00.000+0300',
+                   'items': [{'field': 'status', 'fromString': 'Open',
+                              'toString': 'Resolved'}]}
+        self.issues = [_create_issue('ISSUE-{}'.format(i),
+                                     histories=[history]) for i in range(3)]
+
+    def _get_values(self, metric):
+        return list(MetricValue.objects.filter(
+            metric=metric).values_list('value', flat=True))
+
+    @requests_mock.Mocker()
+    def test_metrics_by_query(self, m):
+        _mock_search(m, self.search_request, self.issues)
+        count = _create_metric(self.project, 'Count', 'count', 'project = A')
+        leadtime = _create_metric(
+            self.project, 'Lead time', 'leadtime', 'project = A')
+        other = _create_metric(self.project, 'Other', 'count', 'project = B')
+
+        # metrics of the same query are calculated by the first task
+        run_metric_calculation(count.id)
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(['changelog'], m.last_request.json()['expand'])
+        self.assertEqual([3], self._get_values(count))
+        self.assertEqual([86400], self._get_values(leadtime))
+        self.assertEqual([], self._get_values(other))
+
+        run_metric_calculation(leadtime.id)
+        self.assertEqual(1, m.call_count)
+        self.assertEqual([86400], self._get_values(leadtime))
+
+        run_metric_calculation(other.id)
+        self.assertEqual(2, m.call_count)
+        self.assertEqual('project = B', m.last_request.json()['jql'])
+        self.assertEqual([3], self._get_values(other))
+
+    @requests_mock.Mocker()
+    def test_metrics_of_other_schedule(self, m):
+        _mock_search(m, self.search_request, self.issues)
+        count = _create_metric(self.project, 'Count', 'count', 'project = A')
+        hourly = _create_metric(self.project, 'Hourly', 'count', 'project = A')
+        hourly.schedule.crontab = CrontabSchedule.objects.create(minute='0')
+        hourly.schedule.save()
+
+        run_metric_calculation(count.id)
+        self.assertEqual([3], self._get_values(count))
+        self.assertEqual([], self._get_values(hourly))
+
+    @requests_mock.Mocker()
+    def test_issues_cache(self, m):
+        _mock_search(m, self.search_request, self.issues)
+        get_jira_issues('project = A', expand=['changelog'])
+        # issues with changelog are used for request without it
+        issues = get_jira_issues('project = A')
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(3, len(issues))
+        get_jira_issues('project = B')
+        self.assertEqual(2, m.call_count)
+
+    def _mock_jira(self, m, issues, changed):
+        """
+        Fake Jira search by query "project = A", by issues changed since
+        some date and by keys.
+        """
+        def search(request, context):
+            query = request.json()['jql']
+            if query.startswith('key in ('):
+                keys = query[len('key in ('):-1].split(',')
+                found = [issue for issue in issues if issue['key'] in keys]
+            elif ' AND updated >= ' in query:
+                found = [issue for issue in issues
+                         if issue['key'] in changed]
+            else:
+                found = issues
+            return {'startAt': 0, 'maxResults': len(found),
+                    'total': len(found), 'issues': found}
+        m.post(self.search_request, json=search)
+
+    def _get_snapshot(self, query):
+        return QuerySnapshot.objects.get(
+            project=self.project, query_hash=get_query_hash(query))
+
+    @requests_mock.Mocker()
+    def test_incremental_calculation(self, m):
+        self._mock_jira(m, self.issues, [])
+        count = _create_metric(self.project, 'Count', 'count', 'project = A')
+        run_metric_calculation(count.id)
+        self.assertEqual(
+            3, len(self._get_snapshot('project = A').get_issues()))
+        cache.clear()
+
+        # ISSUE-1 does not match query any more, ISSUE-3 is new one,
+        # ISSUE-4 matches query without changes
+        self._mock_jira(m, [self.issues[0], self.issues[2],
+                            _create_issue('ISSUE-3'),
+                            _create_issue('ISSUE-4')],
+                        ['ISSUE-0', 'ISSUE-3'])
+        run_metric_calculation(count.id)
+        queries = [request.json()['jql'] for request in m.request_history]
+        self.assertEqual(4, len(queries))
+        self.assertEqual('project = A', queries[1])
+        # date is relative, so it does not depend on time zone of Jira user
+        self.assertRegex(queries[2],
+                         r'^\(project = A\) AND updated >= "-1[01]m"$')
+        self.assertEqual('key in (ISSUE-4)', queries[3])
+        self.assertEqual([3, 4], self._get_values(count))
+        self.assertEqual(['ISSUE-0', 'ISSUE-2', 'ISSUE-3', 'ISSUE-4'],
+                         sorted(self._get_snapshot(
+                             'project = A').get_issues()))
+        cache.clear()
+
+        # snapshot is refreshed after query is changed
+        count.query = 'project = B'
+        count.save()
+        run_metric_calculation(count.id)
+        self.assertEqual('project = B', m.last_request.json()['jql'])
+        self.assertEqual([3, 4, 4], self._get_values(count))
+        self.assertEqual(['project = B'], list(QuerySnapshot.objects.filter(
+            project=self.project).values_list('query', flat=True)))
+
+    @requests_mock.Mocker()
+    def test_incremental_query_with_order(self, m):
+        query = 'project = A ORDER BY created DESC'
+        self._mock_jira(m, self.issues, [])
+        count = _create_metric(self.project, 'Count', 'count', query)
+        run_metric_calculation(count.id)
+        cache.clear()
+        run_metric_calculation(count.id)
+        queries = [request.json()['jql'] for request in m.request_history]
+        self.assertRegex(queries[-1], r'^\(project = A\) AND updated >= '
+                                      r'"-\d+m" ORDER BY created DESC$')
+        self.assertEqual([3, 3], self._get_values(count))
+
+    @requests_mock.Mocker()
+    @override_settings(METRIC_SNAPSHOT_MAX_AGE=0)
+    def test_snapshot_refreshed(self, m):
+        _mock_search(m, self.search_request, self.issues)
+        leadtime = _create_metric(
+            self.project, 'Lead time', 'leadtime', 'project = A')
+        run_metric_calculation(leadtime.id)
+        cache.clear()
+        _mock_search(m, self.search_request, self.issues[:1])
+        run_metric_calculation(leadtime.id)
+        self.assertEqual('project = A', m.last_request.json()['jql'])
+        self.assertEqual(['ISSUE-0'], list(self._get_snapshot(
+            'project = A').get_issues().keys()))
+        self.assertEqual([86400, 86400], self._get_values(leadtime))
+
+    @requests_mock.Mocker()
+    def test_metrics_errors(self, m):
+        _mock_search(m, self.search_request, self.issues)
+        count = _create_metric(self.project, 'Count', 'count', 'project = A')
+        # issues were never opened, so cycle time can not be calculated
+        cycletime = _create_metric(
+            self.project, 'Cycle time', 'cycletime', 'project = A')
+
+        with self.assertRaises(RuntimeError):
+            run_metric_calculation(cycletime.id)
+        self.assertEqual([3], self._get_values(count))
+        self.assertEqual([], self._get_values(cycletime))
+        self.assertNotEqual('', Metric.objects.get(pk=cycletime.id).error)
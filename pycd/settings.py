@@ -179,6 +179,18 @@ LOGGING = {
     }
 }
 
+# cache must be shared by api and all celery workers: it keeps fetched
+# issues of tracking system and locks of their updates, so local memory
+# cache can not be used. Database cache table is created by
+# "manage.py createcachetable", memcached or redis can be used instead.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'cdws_cache'),
+    }
+}
+
 CELERY_HOST = os.environ.get('CELERY_HOST', '')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
@@ -198,7 +210,10 @@ CELERY_DEFAULT_EXCHANGE_TYPE = 'direct'
 CELERY_DEFAULT_ROUTING_KEY = 'default'
 CELERY_QUEUES = (
     Queue('default', Exchange('default'), routing_key='default'),
-    Queue('launcher', Exchange('launcher'), routing_key='launcher')
+    Queue('launcher', Exchange('launcher'), routing_key='launcher'),
+    Queue('launcher.high', Exchange('launcher'),
+          routing_key='launcher.high'),
+    Queue('launcher.low', Exchange('launcher'), routing_key='launcher.low'),
 )
 
 CELERY_ROUTES = {
@@ -220,11 +235,63 @@ CELERY_ROUTES = {
     },
 }
 
+# tasks of launches are sent to queue by priority of launch
+# (0 - low, 1 - normal, 2 - high)
+LAUNCHER_PRIORITY_QUEUES = {
+    0: 'launcher.low',
+    1: 'launcher',
+    2: 'launcher.high',
+}
+# max number of launch_process tasks running on one host at the same time,
+# 0 - unlimited
+LAUNCHER_SLOTS = os.environ.get('LAUNCHER_SLOTS', 0)
+LAUNCHER_SLOTS_DIR = os.environ.get('LAUNCHER_SLOTS_DIR',
+                                    '/tmp/launcher-slots')
+LAUNCHER_SLOT_RETRY_DELAY = os.environ.get('LAUNCHER_SLOT_RETRY_DELAY', 10)
+# wait time statistics of queues is calculated for last N seconds
+LAUNCHER_QUEUE_STATS_PERIOD = os.environ.get(
+    'LAUNCHER_QUEUE_STATS_PERIOD', 3600)
+
+# launch_process output is written to logs in storage (S3 or
+# LOCAL_STORAGE_DIR), result keeps only first and last
+# LAUNCH_OUTPUT_BUFFER_SIZE bytes of it. Logs are stored by parts of
+# LAUNCH_LOG_PART_SIZE bytes, output of running process is uploaded
+# every LAUNCH_LOG_UPLOAD_INTERVAL seconds
+LAUNCH_LOG_MAX_SIZE = os.environ.get('LAUNCH_LOG_MAX_SIZE', 104857600)
+LAUNCH_LOG_PART_SIZE = os.environ.get('LAUNCH_LOG_PART_SIZE', 1048576)
+LAUNCH_LOG_UPLOAD_INTERVAL = os.environ.get('LAUNCH_LOG_UPLOAD_INTERVAL', 5)
+LAUNCH_OUTPUT_BUFFER_SIZE = os.environ.get('LAUNCH_OUTPUT_BUFFER_SIZE', 65536)
+LAUNCH_LOG_READ_LIMIT = os.environ.get('LAUNCH_LOG_READ_LIMIT', 1048576)
+# if command, env and output of launch_process are larger than N bytes,
+# they are moved from result to storage
+LAUNCH_RESULT_INLINE_LIMIT = os.environ.get(
+    'LAUNCH_RESULT_INLINE_LIMIT', 16384)
+# stored payloads not referenced by tasks are deleted by cleanup_database
+# if they are older than N seconds
+LAUNCH_RESULT_PAYLOAD_MIN_AGE = os.environ.get(
+    'LAUNCH_RESULT_PAYLOAD_MIN_AGE', 3600)
+
+# progress of launch is cached for N seconds
+LAUNCH_PROGRESS_CACHE_TIMEOUT = os.environ.get(
+    'LAUNCH_PROGRESS_CACHE_TIMEOUT', 5)
+# weight of the last launch in moving average of launch item durations
+DURATION_BASELINE_ALPHA = os.environ.get('DURATION_BASELINE_ALPHA', 0.3)
+
+# resources used by launch_process are sampled every N seconds, 0 - disabled
+LAUNCH_RESOURCES_INTERVAL = os.environ.get('LAUNCH_RESOURCES_INTERVAL', 1)
+# if LAUNCH_RESOURCES_SERIES = True, all samples are kept in result
+LAUNCH_RESOURCES_SERIES = os.environ.get('LAUNCH_RESOURCES_SERIES', False)
+LAUNCH_RESOURCES_MAX_SAMPLES = os.environ.get(
+    'LAUNCH_RESOURCES_MAX_SAMPLES', 1000)
+
 JIRA_INTEGRATION = os.environ.get('JIRA_INTEGRATION', False)
 # if JIRA_INTEGRATION = True, please fill constants below
 TIME_BEFORE_UPDATE_BUG_INFO = os.environ.get(
     'TIME_BEFORE_UPDATE_BUG_INFO', 10800)
 BUG_TIME_EXPIRED = os.environ.get('BUG_TIME_EXPIRED', 1209600)
+# fields of issue are cached for TIME_BEFORE_UPDATE_BUG_INFO seconds,
+# then they are returned for N seconds more while being refreshed
+BUG_INFO_STALE_TIMEOUT = os.environ.get('BUG_INFO_STALE_TIMEOUT', 86400)
 BUG_STATE_EXPIRED = os.environ.get('BUG_STATE_EXPIRED')
 BUG_TRACKING_SYSTEM_HOST = os.environ.get('BUG_TRACKING_SYSTEM_HOST')
 BUG_TRACKING_SYSTEM_LOGIN = os.environ.get('BUG_TRACKING_SYSTEM_LOGIN')
@@ -233,6 +300,25 @@ BUG_TRACKING_SYSTEM_BUG_PATH = os.environ.get('BUG_TRACKING_SYSTEM_BUG_PATH')
 TRACKING_SYSTEM_SEARCH_PATH = os.environ.get('TRACKING_SYSTEM_SEARCH_PATH')
 TRACKING_SYSTEM_MAX_RESULTS = os.environ.get(
     'TRACKING_SYSTEM_MAX_RESULTS', 1000)
+# issues found by query of metrics are cached for N seconds
+JIRA_ISSUES_CACHE_TIMEOUT = os.environ.get('JIRA_ISSUES_CACHE_TIMEOUT', 60)
+# metrics with the same query and schedule are calculated by the first of
+# their tasks, other tasks started in N seconds are skipped
+METRIC_CALCULATION_CLAIM_TIMEOUT = os.environ.get(
+    'METRIC_CALCULATION_CLAIM_TIMEOUT', 50)
+# metrics are calculated by issues updated since the previous calculation,
+# all issues are requested again every N seconds
+METRIC_SNAPSHOT_MAX_AGE = os.environ.get('METRIC_SNAPSHOT_MAX_AGE', 86400)
+# issues updated N seconds before the previous calculation are requested
+# again, because of clock skew and minute precision of JQL dates
+METRIC_SNAPSHOT_OVERLAP = os.environ.get('METRIC_SNAPSHOT_OVERLAP', 600)
+# timeout of requests to tracking system, in seconds
+BUG_TRACKING_SYSTEM_TIMEOUT = os.environ.get('BUG_TRACKING_SYSTEM_TIMEOUT', 30)
+# bugs are updated by search requests of N issues in M threads
+BUG_TRACKING_SYSTEM_BATCH_SIZE = os.environ.get(
+    'BUG_TRACKING_SYSTEM_BATCH_SIZE', 50)
+BUG_TRACKING_SYSTEM_CONCURRENCY = os.environ.get(
+    'BUG_TRACKING_SYSTEM_CONCURRENCY', 4)
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
@@ -241,6 +327,23 @@ if not DEBUG:
     SESSION_COOKIE_DOMAIN = COOKIE_DOMAIN
 
 STORE_TESTRESULTS_IN_DAYS = os.environ.get('STORE_TESTRESULTS_IN_DAYS', 30)
+# if ARCHIVE_TESTRESULTS = True, expired test results are moved to storage
+# instead of deleting
+ARCHIVE_TESTRESULTS = os.environ.get('ARCHIVE_TESTRESULTS', False)
+# durations and failures of tests from launches of last N days are used
+# for sharding and ordering of tests
+TEST_HISTORY_DAYS = os.environ.get('TEST_HISTORY_DAYS', 14)
+# durations of tests are not less than this value (in seconds) for ordering
+TEST_ORDER_MIN_DURATION = os.environ.get('TEST_ORDER_MIN_DURATION', 0.1)
+# timeout of launch item with adaptive_timeout is percentile of durations
+# of its tasks in last launches multiplied by factor, in seconds
+ADAPTIVE_TIMEOUT_LAUNCHES = os.environ.get('ADAPTIVE_TIMEOUT_LAUNCHES', 20)
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = os.environ.get(
+    'ADAPTIVE_TIMEOUT_MIN_SAMPLES', 5)
+ADAPTIVE_TIMEOUT_PERCENTILE = os.environ.get('ADAPTIVE_TIMEOUT_PERCENTILE', 95)
+ADAPTIVE_TIMEOUT_FACTOR = os.environ.get('ADAPTIVE_TIMEOUT_FACTOR', 1.5)
+ADAPTIVE_TIMEOUT_MIN = os.environ.get('ADAPTIVE_TIMEOUT_MIN', 60)
+ADAPTIVE_TIMEOUT_MAX = os.environ.get('ADAPTIVE_TIMEOUT_MAX', 14400)
 RUNDECK_URL = os.environ.get('RUNDECK_URL', '')
 
 STATIC_URL = os.environ.get('STATIC_URL', '/static/')
@@ -255,5 +358,7 @@ S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME', 'xml-reports')
 S3_SECURE_CONNECTION = os.environ.get('S3_SECURE_CONNECTION', False)
 S3_MAX_RETRIES = os.environ.get('S3_MAX_RETRIES', 2)
 S3_COUNTDOWN = os.environ.get('S3_COUNTDOWN', 900)  # in seconds
+# used instead of S3 bucket, if connection to S3 is not set
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR', '/tmp/storage')
 
 LAST_COMMITS_SIZE = os.environ.get('LAST_COMMITS_SIZE', 100)
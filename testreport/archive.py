@@ -0,0 +1,72 @@
+from testreport.models import TestResult
+
+from common.storage import put_blob, get_blob
+
+import gzip
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = ('id', 'name', 'suite', 'state', 'failure_reason',
+                   'duration', 'launch_item_id')
+
+
+def get_archive_name(launch_id):
+    return 'archive/launch-{}.json.gz'.format(launch_id)
+
+
+def pack_results(results):
+    """
+    Serializes test results to one compressed blob, values of each field
+    are stored together (column by column).
+    """
+    rows = results.values_list(*ARCHIVE_COLUMNS)
+    columns = dict([(column, []) for column in ARCHIVE_COLUMNS])
+    for row in rows:
+        for column, value in zip(ARCHIVE_COLUMNS, row):
+            columns[column].append(value)
+    return gzip.compress(json.dumps(columns).encode('utf-8'))
+
+
+def unpack_results(launch_id, content):
+    columns = json.loads(gzip.decompress(content).decode('utf-8'))
+    output = []
+    for row in zip(*[columns[column] for column in ARCHIVE_COLUMNS]):
+        data = dict(zip(ARCHIVE_COLUMNS, row))
+        output.append(TestResult(launch_id=launch_id, **data))
+    return output
+
+
+def archive_launch(launch):
+    results = launch.testresult_set.all()
+    if not results.exists():
+        return
+    # counts can not be calculated after test results deleting
+    launch.calculate_counts()
+
+    name = get_archive_name(launch.id)
+    log.info('Archiving test results of launch {} to "{}"'.format(
+        launch.id, name))
+    put_blob(name, pack_results(results))
+    launch.archive = name
+    launch.save(update_fields=['archive'])
+    results.delete()
+
+
+def get_archived_results(launches, **filters):
+    """
+    Reads test results of archived launches without restoring them to DB.
+    """
+    output = []
+    for launch in launches:
+        content = get_blob(launch.archive)
+        if content is None:
+            log.error('Archive "{}" not found in storage'.format(
+                launch.archive))
+            continue
+        for result in unpack_results(launch.id, content):
+            if all(getattr(result, key) == value
+                   for key, value in iter(filters.items())):
+                output.append(result)
+    return output
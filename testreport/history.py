@@ -0,0 +1,179 @@
+from testreport.models import Launch, LaunchItem, TestResult, FAILED
+
+from djcelery.models import TaskMeta
+from celery import states
+
+from django.conf import settings
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from datetime import timedelta
+
+import heapq
+import json
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+
+def get_test_durations(test_plan_id, launch_item_ids, days=None):
+    """
+    Returns average durations of tests from recent launches of test plan:
+    {launch_item_id: {(suite, name): duration}}.
+    """
+    if days is None:
+        days = settings.TEST_HISTORY_DAYS
+    results = TestResult.objects.filter(
+        launch__test_plan_id=test_plan_id,
+        launch_item_id__in=launch_item_ids,
+        launch__created__gte=timezone.now() - timedelta(days=int(days)))
+    durations = dict((item_id, {}) for item_id in launch_item_ids)
+    for row in results.values('launch_item_id', 'suite', 'name').\
+            annotate(duration=Avg('duration')):
+        durations[row['launch_item_id']][(row['suite'], row['name'])] = \
+            row['duration'] or 0.0
+    return durations
+
+
+def get_test_order(test_plan_id, launch_item_id=None, days=None):
+    """
+    Returns tests of test plan ordered by probability of failure per second
+    of duration, so tests which often fail and run fast are the first ones.
+    Probability is smoothed to not put tests with few launches on top.
+    """
+    if days is None:
+        days = settings.TEST_HISTORY_DAYS
+    results = TestResult.objects.filter(
+        launch__test_plan_id=test_plan_id,
+        launch__created__gte=timezone.now() - timedelta(days=int(days)))
+    if launch_item_id is not None:
+        results = results.filter(launch_item_id=launch_item_id)
+    fields = ('launch_item_id', 'suite', 'name')
+
+    failures = {}
+    for row in results.filter(state=FAILED).values(*fields).\
+            annotate(count=Count('id')):
+        failures[tuple(row[field] for field in fields)] = row['count']
+
+    output = []
+    for row in results.values(*fields).annotate(count=Count('id'),
+                                                duration=Avg('duration')):
+        key = tuple(row[field] for field in fields)
+        failure_rate = (failures.get(key, 0) + 1.0) / (row['count'] + 2.0)
+        duration = row['duration'] or 0.0
+        output.append({
+            'launch_item_id': row['launch_item_id'],
+            'suite': row['suite'],
+            'name': row['name'],
+            'failure_rate': failure_rate,
+            'duration': duration,
+            'score': failure_rate / max(
+                duration, float(settings.TEST_ORDER_MIN_DURATION)),
+        })
+    output.sort(key=lambda test: (-test['score'], test['suite'], test['name']))
+    return output
+
+
+def split_to_shards(durations, count):
+    """
+    Splits tests to shards with close total durations, longest tests are
+    placed first, each one to the least loaded shard. There are no
+    empty shards, if tests are fewer than count.
+    """
+    count = min(count, len(durations))
+    shards = [[] for i in range(count)]
+    heap = [(0.0, index) for index in range(count)]
+    for test, duration in sorted(iter(durations.items()),
+                                 key=lambda item: (-item[1], item[0])):
+        load, index = heapq.heappop(heap)
+        shards[index].append(test)
+        heapq.heappush(heap, (load + duration, index))
+    return shards
+
+
+def get_percentile(values, percent):
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+def is_partial_launch(parameters):
+    """
+    Launch runs only part of tests, if it is rerun of failed tests or its
+    launch items are split to shards.
+    """
+    options = parameters.get('options') or {}
+    try:
+        shards = int(options.get('shards') or 1)
+    except (TypeError, ValueError):
+        shards = 1
+    return options.get('rerun_of') is not None or shards > 1
+
+
+def get_adaptive_timeouts(test_plan_id, launch_item_ids):
+    """
+    Calculates timeouts of launch items by durations of their successful
+    tasks in last launches of test plan. Items with not enough launches
+    are skipped. Failed and timed out runs are not counted, otherwise
+    timeout would be pulled to itself, shards and reruns are not counted,
+    because they run only part of tests.
+    """
+    if not launch_item_ids:
+        return {}
+    items = {}
+    count = 0
+    launches = Launch.objects.filter(test_plan_id=test_plan_id).\
+        order_by('-created').values_list('tasks', 'parameters')
+    for tasks, parameters in launches.iterator():
+        if count >= int(settings.ADAPTIVE_TIMEOUT_LAUNCHES):
+            break
+        if is_partial_launch(json.loads(parameters or '{}')):
+            continue
+        count += 1
+        for task_id, launch_item_id in iter(json.loads(tasks or '{}').items()):
+            if launch_item_id in launch_item_ids:
+                items[task_id] = launch_item_id
+
+    deltas = dict((launch_item_id, []) for launch_item_id in launch_item_ids)
+    for task in TaskMeta.objects.filter(task_id__in=items.keys(),
+                                        status=states.SUCCESS):
+        if isinstance(task.result, dict) and 'delta' in task.result \
+                and task.result.get('return_code') == 0:
+            deltas[items[task.task_id]].append(task.result['delta'])
+
+    timeouts = {}
+    for launch_item_id, values in iter(deltas.items()):
+        if len(values) < int(settings.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+            log.debug('Not enough launches of item {} for adaptive '
+                      'timeout: {}'.format(launch_item_id, len(values)))
+            continue
+        timeout = get_percentile(
+            values, float(settings.ADAPTIVE_TIMEOUT_PERCENTILE)) * \
+            float(settings.ADAPTIVE_TIMEOUT_FACTOR)
+        timeouts[launch_item_id] = int(min(
+            max(timeout, int(settings.ADAPTIVE_TIMEOUT_MIN)),
+            int(settings.ADAPTIVE_TIMEOUT_MAX)))
+    return timeouts
+
+
+def update_duration_baselines(tasks, results):
+    """
+    Updates moving averages of durations of launch items by durations of
+    their tasks in finished launch.
+    """
+    durations = {}
+    for task_id, launch_item_id in iter(tasks.items()):
+        result = results.get(task_id)
+        if isinstance(result, dict) and result.get('delta') is not None:
+            durations.setdefault(launch_item_id, []).append(result['delta'])
+
+    alpha = float(settings.DURATION_BASELINE_ALPHA)
+    for launch_item in LaunchItem.objects.filter(id__in=durations.keys()):
+        values = durations[launch_item.id]
+        duration = sum(values) / len(values)
+        if launch_item.duration_baseline is not None:
+            duration = alpha * duration + \
+                (1 - alpha) * launch_item.duration_baseline
+        LaunchItem.objects.filter(id=launch_item.id).update(
+            duration_baseline=duration)
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0043_auto_20160413_1040'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='launch',
+            name='archive',
+            field=models.CharField(verbose_name='Archive', max_length=255, blank=True, null=True, default=None),
+            preserve_default=True,
+        ),
+    ]
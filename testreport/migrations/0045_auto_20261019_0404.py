@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0044_launch_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('launch_item_id', models.IntegerField(blank=True, null=True, default=None)),
+                ('date', models.DateField(verbose_name='Date', db_index=True)),
+                ('launches', models.IntegerField(verbose_name='Launches', default=0)),
+                ('passed', models.IntegerField(verbose_name='Passed', default=0)),
+                ('failed', models.IntegerField(verbose_name='Failed', default=0)),
+                ('skipped', models.IntegerField(verbose_name='Skipped', default=0)),
+                ('blocked', models.IntegerField(verbose_name='Blocked', default=0)),
+                ('total', models.IntegerField(verbose_name='Total', default=0)),
+                ('duration', models.FloatField(verbose_name='Duration time', default=0.0)),
+                ('test_plan', models.ForeignKey(to='testreport.TestPlan')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyrollup',
+            unique_together=set([('test_plan', 'launch_item_id', 'date')]),
+        ),
+    ]
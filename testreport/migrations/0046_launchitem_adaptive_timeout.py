@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0045_auto_20261019_0404'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='launchitem',
+            name='adaptive_timeout',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+    ]
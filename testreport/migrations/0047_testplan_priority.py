@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0046_launchitem_adaptive_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testplan',
+            name='priority',
+            field=models.IntegerField(verbose_name='Launch priority', default=1),
+            preserve_default=True,
+        ),
+    ]
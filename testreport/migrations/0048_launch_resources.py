@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0047_testplan_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='launch',
+            name='resources',
+            field=models.TextField(verbose_name='Resources', default='{}'),
+            preserve_default=True,
+        ),
+    ]
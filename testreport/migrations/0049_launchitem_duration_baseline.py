@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0048_launch_resources'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='launchitem',
+            name='duration_baseline',
+            field=models.FloatField(blank=True, null=True, default=None),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testreport', '0049_launchitem_duration_baseline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='launch',
+            name='logs_deleted',
+            field=models.BooleanField(verbose_name='Logs deleted', default=False),
+            preserve_default=True,
+        ),
+    ]
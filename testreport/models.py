@@ -4,19 +4,26 @@ from django.contrib.auth.models import User
 
 from common.models import Project
 
+from pycd.celery import app
+
 from celery import states
 
 import logging
 import json
 
 from django.conf import settings
+from django.core.cache import cache
+from concurrent.futures import ThreadPoolExecutor
+import time
 import requests
+import requests.adapters
 
 log = logging.getLogger(__name__)
 
 TEST_STATES = (PASSED, FAILED, SKIPPED, BLOCKED) = (0, 1, 2, 3)
 LAUNCH_STATES = (INITIALIZED, IN_PROGRESS, FINISHED, STOPPED) = (0, 1, 2, 3)
 LAUNCH_TYPES = (ASYNC_CALL, INIT_SCRIPT, CONCLUSIVE) = (0, 1, 2)
+LAUNCH_PRIORITIES = (LOW_PRIORITY, NORMAL_PRIORITY, HIGH_PRIORITY) = (0, 1, 2)
 CELERY_FINISHED_STATES = (states.SUCCESS, states.FAILURE)
 
 RESULT_PREVIEW_CHOICES = (
@@ -70,6 +77,8 @@ class TestPlan(models.Model):
     show_in_twodays = models.BooleanField(
         _('Consider in statistic for last two days'),
         blank=True, null=False, default=False)
+    priority = models.IntegerField(_('Launch priority'),
+                                   default=NORMAL_PRIORITY)
 
     def __str__(self):
         return '{0} -> TestPlan: {1}'.format(self.project, self.name)
@@ -87,10 +96,17 @@ class Launch(models.Model):
     tasks = models.TextField(_('Tasks'), default='')
     parameters = models.TextField(_('Parameters'), default='{}')
     duration = models.FloatField(_('Duration time'), null=True, default=None)
+    archive = models.CharField(_('Archive'), max_length=255, blank=True,
+                               null=True, default=None)
+    resources = models.TextField(_('Resources'), default='{}')
+    logs_deleted = models.BooleanField(_('Logs deleted'), default=False)
 
     def is_finished(self):
         return self.state == FINISHED
 
+    def is_archived(self):
+        return self.archive is not None
+
     @property
     def counts(self):
         if self.counts_cache is None or self.state == INITIALIZED:
@@ -109,7 +125,8 @@ class Launch(models.Model):
             if name != 'total':
                 data['total'] += count
         self.counts_cache = json.dumps(data)
-        self.save()
+        # Save only counts, not to overwrite state changed by another process
+        self.save(update_fields=['counts_cache'])
 
     @property
     def failed(self):
@@ -143,6 +160,14 @@ class Launch(models.Model):
     def set_parameters(self, parameters):
         self.parameters = json.dumps(parameters)
 
+    def get_resources(self):
+        if self.resources == '' or self.resources is None:
+            self.resources = '{}'
+        return json.loads(self.resources)
+
+    def set_resources(self, resources):
+        self.resources = json.dumps(resources)
+
     def __str__(self):
         return '{0} -> Launch: {1}'.format(self.test_plan, self.pk)
 
@@ -195,12 +220,36 @@ class LaunchItem(models.Model):
         max_length=128, default=None, null=True, blank=True)
     command = models.TextField()
     timeout = models.IntegerField(default=300)
+    # timeout is calculated from durations of previous launches
+    adaptive_timeout = models.BooleanField(default=False)
+    # moving average of durations of tasks, updated on launch finalizing
+    duration_baseline = models.FloatField(null=True, blank=True, default=None)
     type = models.IntegerField(default=ASYNC_CALL)
 
     def __str__(self):
         return '{0} -> {1}'.format(self.test_plan.name, self.name)
 
 
+class DailyRollup(models.Model):
+    test_plan = models.ForeignKey(TestPlan)
+    launch_item_id = models.IntegerField(blank=True, default=None, null=True)
+    date = models.DateField(_('Date'), db_index=True)
+    launches = models.IntegerField(_('Launches'), default=0)
+    passed = models.IntegerField(_('Passed'), default=0)
+    failed = models.IntegerField(_('Failed'), default=0)
+    skipped = models.IntegerField(_('Skipped'), default=0)
+    blocked = models.IntegerField(_('Blocked'), default=0)
+    total = models.IntegerField(_('Total'), default=0)
+    duration = models.FloatField(_('Duration time'), default=0.0)
+
+    class Meta:
+        unique_together = ('test_plan', 'launch_item_id', 'date')
+
+    def __str__(self):
+        return '{0} -> DailyRollup: {1}/{2}'.format(
+            self.test_plan, self.date, self.launch_item_id)
+
+
 class Bug(models.Model):
     externalId = models.CharField(max_length=255, blank=False)
     name = models.CharField(max_length=255, default='', blank=True)
@@ -215,22 +264,166 @@ class Bug(models.Model):
         return ':'.join((self.externalId, self.name))
 
 
-def get_issue_fields_from_bts(externalId):
+def _get_fields_cache_key(externalId):
+    return 'bug-fields-{}'.format(externalId)
+
+
+def _get_cached_fields(keys):
+    """
+    Returns cached fields of issues: {key: (fields, is_fresh)}. Fields are
+    fresh for TIME_BEFORE_UPDATE_BUG_INFO seconds, after that they are
+    stale for BUG_INFO_STALE_TIMEOUT seconds more.
+    """
+    entries = cache.get_many([_get_fields_cache_key(key) for key in keys])
+    now = time.time()
+    output = {}
+    for key in keys:
+        entry = entries.get(_get_fields_cache_key(key))
+        if entry is not None:
+            output[key] = (entry['fields'], now - entry['fetched'] <=
+                           float(settings.TIME_BEFORE_UPDATE_BUG_INFO))
+    return output
+
+
+def _set_cached_fields(fields):
+    timeout = int(settings.TIME_BEFORE_UPDATE_BUG_INFO) + \
+        int(settings.BUG_INFO_STALE_TIMEOUT)
+    now = time.time()
+    cache.set_many(
+        dict((_get_fields_cache_key(key), {'fields': value, 'fetched': now})
+             for key, value in iter(fields.items())), timeout)
+
+
+def _fetch_issue_fields(externalId):
     log.debug('Get fields for bug {}'.format(externalId))
     res = _get_bug(externalId)
     if 'fields' in res:
+        _set_cached_fields({externalId: res['fields']})
         return res['fields']
     return res
 
 
+def _get_fields_lock_key(externalId):
+    return 'bug-fields-lock-{}'.format(externalId)
+
+
+def refresh_cached_issue_fields(externalId):
+    """
+    Requests fields of stale issue to cache and releases lock of its
+    refresh, it is called by celery task.
+    """
+    try:
+        _fetch_issue_fields(externalId)
+    except Exception as e:
+        log.error('Unable to refresh bug {}: {}'.format(externalId, e))
+    finally:
+        cache.delete(_get_fields_lock_key(externalId))
+
+
+def _revalidate_issue_fields(externalId):
+    # only one refresh of the issue at a time, lock is shared by api and
+    # workers, so cache should not be local memory one
+    lock = _get_fields_lock_key(externalId)
+    if not cache.add(lock, True, int(settings.BUG_TRACKING_SYSTEM_TIMEOUT)):
+        return
+    # refresh is not bound to the web worker, which serves request
+    try:
+        app.send_task('testreport.tasks.refresh_issue_fields',
+                      args=[externalId])
+    except Exception as e:
+        log.error('Unable to start refresh of bug {}: {}'.format(
+            externalId, e))
+        cache.delete(lock)
+
+
+def get_issue_fields_from_bts(externalId):
+    """
+    Cached fields of issue are returned without request to bug tracking
+    system, stale ones are refreshed in background.
+    """
+    cached = _get_cached_fields([externalId]).get(externalId)
+    if cached is None:
+        return _fetch_issue_fields(externalId)
+    fields, is_fresh = cached
+    if not is_fresh:
+        _revalidate_issue_fields(externalId)
+    return fields
+
+
+def get_issues_fields_from_bts(keys):
+    """
+    Returns fields of issues found by keys: {key: fields}. Issues which
+    are not fresh in cache are requested by batches of
+    BUG_TRACKING_SYSTEM_BATCH_SIZE keys in BUG_TRACKING_SYSTEM_CONCURRENCY
+    threads, issues which are not found are skipped.
+    """
+    output = dict((key, fields) for key, (fields, is_fresh) in
+                  iter(_get_cached_fields(keys).items()) if is_fresh)
+    keys = [key for key in keys if key not in output]
+    size = int(settings.BUG_TRACKING_SYSTEM_BATCH_SIZE)
+    batches = [keys[i:i + size] for i in range(0, len(keys), size)]
+    if not batches:
+        return output
+    with ThreadPoolExecutor(max_workers=int(
+            settings.BUG_TRACKING_SYSTEM_CONCURRENCY)) as executor:
+        for batch, future in [(batch, executor.submit(_search_bugs, batch))
+                              for batch in batches]:
+            try:
+                fields = future.result()
+            except Exception as e:
+                log.error('Unable to get issues {}: {}'.format(batch, e))
+                continue
+            _set_cached_fields(fields)
+            output.update(fields)
+    return output
+
+
+_session = None
+
+
+def _get_session():
+    """
+    HTTP connections to bug tracking system are kept alive and shared
+    by all requests.
+    """
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.auth = (settings.BUG_TRACKING_SYSTEM_LOGIN,
+                        settings.BUG_TRACKING_SYSTEM_PASSWORD)
+        session.headers.update({'Content-Type': 'application/json'})
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=int(settings.BUG_TRACKING_SYSTEM_CONCURRENCY))
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def _search_bugs(keys):
+    response = _get_session().post(
+        'https://{}{}'.format(settings.BUG_TRACKING_SYSTEM_HOST,
+                              settings.TRACKING_SYSTEM_SEARCH_PATH),
+        data=json.dumps({'jql': 'key in ({})'.format(','.join(keys)),
+                         'fields': ['status', 'summary'],
+                         'maxResults': len(keys),
+                         # not existent keys are skipped instead of error
+                         'validateQuery': False}),
+        timeout=float(settings.BUG_TRACKING_SYSTEM_TIMEOUT))
+    data = response.json()
+    log.debug(data)
+    if data.get('errorMessages') or data.get('errors'):
+        raise RuntimeError('{} {}'.format(data.get('errorMessages'),
+                                          data.get('errors')))
+    return dict((issue['key'], issue['fields'])
+                for issue in data.get('issues', []))
+
+
 def _get_bug(bug_id):
-    response = requests.get(
+    response = _get_session().get(
         'https://{}{}'.format(
             settings.BUG_TRACKING_SYSTEM_HOST,
             settings.BUG_TRACKING_SYSTEM_BUG_PATH.format(issue_id=bug_id)),
-        auth=(settings.BUG_TRACKING_SYSTEM_LOGIN,
-              settings.BUG_TRACKING_SYSTEM_PASSWORD),
-        headers={'Content-Type': 'application/json'})
+        timeout=float(settings.BUG_TRACKING_SYSTEM_TIMEOUT))
     data = response.json()
     log.debug(data)
     return data
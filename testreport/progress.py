@@ -0,0 +1,104 @@
+from testreport.models import Launch, LaunchItem, INITIALIZED, IN_PROGRESS
+from testreport.models import ASYNC_CALL, INIT_SCRIPT
+
+from djcelery.models import TaskMeta
+from celery import states
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from datetime import timedelta
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def get_progress_cache_key(launch_id):
+    return 'launch-progress-{}'.format(launch_id)
+
+
+def _get_remaining(expected, started, now):
+    if started is None:
+        return expected
+    return max(expected - (now - started).total_seconds(), 0.0)
+
+
+def calculate_progress(launch):
+    """
+    Estimates progress of launch by states of its tasks and duration
+    baselines of launch items. Init script, async calls and conclusive
+    items are run one after another, async calls are run in parallel.
+    """
+    tasks = launch.get_tasks()
+    output = {'launch_id': launch.id, 'state': launch.state,
+              'tasks': {'total': len(tasks), 'finished': 0, 'running': 0,
+                        'pending': 0},
+              'percent': 100.0, 'remaining': 0.0, 'estimated_finish': None}
+    if launch.state not in (INITIALIZED, IN_PROGRESS) or not tasks:
+        return output
+
+    items = dict((launch_item_id, (item_type, baseline))
+                 for launch_item_id, item_type, baseline in
+                 LaunchItem.objects.filter(id__in=set(tasks.values())).
+                 values_list('id', 'type', 'duration_baseline'))
+    known = [baseline for item_type, baseline in items.values()
+             if baseline is not None]
+    default = sum(known) / len(known) if known else 1.0
+    # date_done of running task is time of its start
+    task_states = dict(
+        (task_id, (status, date_done)) for task_id, status, date_done in
+        TaskMeta.objects.filter(task_id__in=list(tasks.keys())).
+        values_list('task_id', 'status', 'date_done'))
+
+    now = timezone.now()
+    total = 0.0
+    done = 0.0
+    is_estimated = True
+    remaining = {INIT_SCRIPT: 0.0, ASYNC_CALL: 0.0, 'sequence': 0.0}
+    for task_id, launch_item_id in iter(tasks.items()):
+        item_type, baseline = items.get(launch_item_id, (ASYNC_CALL, None))
+        expected = baseline if baseline is not None else default
+        total += expected
+        status, date_done = task_states.get(task_id, (states.PENDING, None))
+        if status in states.READY_STATES:
+            output['tasks']['finished'] += 1
+            done += expected
+            continue
+        if baseline is None:
+            is_estimated = False
+        if status == states.STARTED:
+            output['tasks']['running'] += 1
+            left = _get_remaining(expected, date_done, now)
+            done += expected - left
+        else:
+            output['tasks']['pending'] += 1
+            left = expected
+        if item_type == INIT_SCRIPT:
+            remaining[INIT_SCRIPT] = max(remaining[INIT_SCRIPT], left)
+        elif item_type == ASYNC_CALL:
+            remaining[ASYNC_CALL] = max(remaining[ASYNC_CALL], left)
+        else:
+            remaining['sequence'] += left
+
+    output['percent'] = round(done / total * 100, 1) if total else 0.0
+    if is_estimated:
+        output['remaining'] = sum(remaining.values())
+        output['estimated_finish'] = now + timedelta(
+            seconds=output['remaining'])
+    else:
+        output['remaining'] = None
+    return output
+
+
+def get_launch_progress(launch_id):
+    """
+    Progress is cached for a few seconds, as it is polled by dashboards.
+    """
+    key = get_progress_cache_key(launch_id)
+    output = cache.get(key)
+    if output is None:
+        output = calculate_progress(Launch.objects.get(pk=launch_id))
+        cache.set(key, output, int(settings.LAUNCH_PROGRESS_CACHE_TIMEOUT))
+    return output
@@ -0,0 +1,88 @@
+from testreport.models import TestPlan, Launch, TestResult, DailyRollup
+from testreport.models import PASSED, FAILED, SKIPPED, BLOCKED
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from datetime import datetime, timedelta, time
+
+import logging
+
+log = logging.getLogger(__name__)
+
+STATE_FIELDS = {
+    PASSED: 'passed',
+    FAILED: 'failed',
+    SKIPPED: 'skipped',
+    BLOCKED: 'blocked',
+}
+
+
+def get_launch_date(launch):
+    return timezone.localtime(launch.created).date()
+
+
+def get_day_range(date):
+    start = timezone.make_aware(datetime.combine(date, time.min),
+                                timezone.get_current_timezone())
+    return start, start + timedelta(days=1)
+
+
+def calculate_rollups(test_plan_id, date):
+    """
+    Returns daily aggregates of test plan and its launch items, which are
+    not saved, or None, if there are no test results of this day in DB.
+    """
+    start, end = get_day_range(date)
+    launches = Launch.objects.filter(test_plan_id=test_plan_id,
+                                     created__gte=start, created__lt=end)
+    results = TestResult.objects.filter(launch__in=launches)
+    counts = results.values('launch_item_id', 'state').\
+        annotate(count=Count('id'), duration=Sum('duration'))
+    if len(counts) == 0:
+        return None
+
+    rollups = {None: DailyRollup(test_plan_id=test_plan_id, date=date,
+                                 launches=launches.count())}
+    items = results.exclude(launch_item_id=None).values('launch_item_id').\
+        annotate(launches=Count('launch', distinct=True))
+    for item in items:
+        rollups[item['launch_item_id']] = DailyRollup(
+            test_plan_id=test_plan_id, date=date,
+            launch_item_id=item['launch_item_id'],
+            launches=item['launches'])
+
+    for row in counts:
+        keys = [None]
+        if row['launch_item_id'] is not None:
+            keys.append(row['launch_item_id'])
+        for key in keys:
+            rollup = rollups[key]
+            field = STATE_FIELDS[row['state']]
+            setattr(rollup, field, getattr(rollup, field) + row['count'])
+            rollup.total += row['count']
+            rollup.duration += row['duration'] or 0.0
+
+    return list(rollups.values())
+
+
+def update_rollups(test_plan_id, date):
+    """
+    Recalculates daily aggregates of test plan and its launch items.
+    Aggregates are kept as is, if test results of this day are already
+    removed from DB.
+    """
+    with transaction.atomic():
+        # Test plan is locked, otherwise concurrent finalizations of its
+        # launches both delete aggregates and then both insert them
+        list(TestPlan.objects.select_for_update().filter(
+            pk=test_plan_id).values_list('id', flat=True))
+        rollups = calculate_rollups(test_plan_id, date)
+        if rollups is None:
+            log.debug('There are no test results for test plan {} on '
+                      '{}'.format(test_plan_id, date))
+            return
+        DailyRollup.objects.filter(test_plan_id=test_plan_id,
+                                   date=date).delete()
+        DailyRollup.objects.bulk_create(rollups)
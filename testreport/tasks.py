@@ -1,57 +1,104 @@
 from __future__ import absolute_import
 
-from testreport.models import Launch, FINISHED, STOPPED, CELERY_FINISHED_STATES
+from testreport.models import Launch, FINISHED, CELERY_FINISHED_STATES
+from testreport.models import INITIALIZED, IN_PROGRESS
+from testreport.models import TestResult, PASSED, FAILED, SKIPPED, BLOCKED
 from testreport.models import Bug
-from testreport.models import get_issue_fields_from_bts
+from testreport.models import get_issues_fields_from_bts
+from testreport.models import refresh_cached_issue_fields
+from testreport.archive import archive_launch
+from testreport.rollups import update_rollups, get_launch_date
+from testreport.history import update_duration_baselines, get_test_order
+from testreport.history import is_partial_launch
 
 from cdws_api.xml_parser import xml_parser_func
 
 from common.storage import get_s3_connection, get_or_create_bucket
+from common.output import delete_log, get_log_names
+from common.results import delete_unused_payloads
 from comments.models import Comment
 
+from djcelery.models import TaskMeta
+
 import celery
+from celery import states
 
 import os
 import stat
 import json
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
 from django.conf import settings
 from datetime import timedelta, datetime
-from time import sleep
 
 
 import logging
 log = logging.getLogger(__name__)
 
+ORDER_FILE = 'order.json'
+
+
+def get_task_results(task_ids):
+    return dict((task.task_id, task.result) for task in
+                TaskMeta.objects.filter(task_id__in=list(task_ids)))
+
+
+def aggregate_resources(tasks, results):
+    """
+    Sums up resources used by tasks of each launch item:
+    {launch_item_id: {'tasks': ..., 'cpu_time': ..., 'max_rss': ...}}
+    """
+    output = {}
+    for task_id, launch_item_id in iter(tasks.items()):
+        result = results.get(task_id)
+        if not isinstance(result, dict) or 'resources' not in result:
+            continue
+        item = output.setdefault(str(launch_item_id), {
+            'tasks': 0, 'duration': 0.0, 'cpu_time': 0.0, 'max_rss': 0,
+            'read_bytes': 0, 'write_bytes': 0, 'max_processes': 0})
+        item['tasks'] += 1
+        item['duration'] += result.get('delta') or 0.0
+        for key in ['cpu_time', 'read_bytes', 'write_bytes']:
+            item[key] += result['resources'].get(key, 0)
+        for key in ['max_rss', 'max_processes']:
+            item[key] = max(item[key], result['resources'].get(key, 0))
+    return output
+
 
 @celery.task()
-def finalize_launch(launch_id, state=FINISHED, timeout=30, tries=5):
-    log.info("Finalize launch {}".format(launch_id))
+def finalize_launch(launch_id, state=FINISHED):
+    finalize_launches([launch_id], state)
+
+
+def complete_launch_task(launch_id):
+    """
+    Called when one of launch tasks is finished or revoked, finalizes launch
+    after the last one.
+    """
     launch = Launch.objects.get(pk=launch_id)
-    log.info("Current launch: {}".format(launch.__dict__))
-    launch.finished = datetime.now()
-    launch.calculate_counts()
-    launch.state = state
-    log.info("Launch for update: {}".format(launch.__dict__))
-    launch.save(force_update=True)
-    if state != STOPPED:
-        for i in range(0, tries):
-            log.info("Waiting for {} seconds, before next try".format(timeout))
-            sleep(timeout)
-            launch = Launch.objects.get(pk=launch_id)
-            if launch.state == state:
-                break
-            log.info("Launch state not finished, try to save again.")
-            launch.finished = datetime.now()
-            launch.state = state
-            launch.save()
-    log.info(
-        "Updated launch: {}".format(Launch.objects.get(pk=launch_id).__dict__))
+    if launch.state not in (INITIALIZED, IN_PROGRESS):
+        return
+    tasks = launch.get_tasks()
+    ready = TaskMeta.objects.filter(task_id__in=list(tasks.keys()),
+                                    status__in=states.READY_STATES).count()
+    if ready < len(tasks):
+        log.debug("Launch {}: {} of {} tasks are finished".format(
+            launch_id, ready, len(tasks)))
+        return
+    # Tasks can be finished simultaneously, but only one of them
+    # is able to finalize launch
+    finalize_launches([launch_id])
 
 
 @celery.task()
-def create_environment(environment_vars, json_file):
+def create_environment(environment_vars, json_file, files=None, order=False):
+    """
+    Creates workspace of launch with its environment and json files.
+    If order is set, order of tests of test plan is written to ORDER_FILE,
+    it is calculated here not to pass it in message of the task.
+    """
     workspace_path = environment_vars['WORKSPACE']
     # Create workspace directory
     if not os.path.exists(workspace_path):
@@ -72,25 +119,105 @@ def create_environment(environment_vars, json_file):
     with open(env_file_path, 'w+') as f:
         f.write(output)
 
+    if order:
+        files = dict(files or {})
+        files[ORDER_FILE] = [
+            {'launch_item_id': test['launch_item_id'],
+             'suite': test['suite'], 'name': test['name']}
+            for test in get_test_order(int(environment_vars['TESTPLAN_ID']))]
+
+    # Write additional json files, e.g. lists of tests of shards
+    if files is not None:
+        for name, content in iter(files.items()):
+            file_path = os.path.join(workspace_path, name)
+            if not os.path.exists(os.path.dirname(file_path)):
+                os.makedirs(os.path.dirname(file_path))
+            with open(file_path, 'w+') as f:
+                f.write(json.dumps(content))
+
+
+def finalize_launches(launch_ids, state=FINISHED):
+    """
+    Finalizes several launches at once, counts are calculated
+    by one query for all of them. Launch is finalized only by the call,
+    which changes its state from initialized or in progress, so counts,
+    resources, duration baselines and rollups are updated once.
+    Returns ids of finalized launches.
+    """
+    log.info("Finalize launches {}".format(launch_ids))
+    # Launch can be finalized by its last task, by termination and by
+    # finalize_broken_launches at the same time
+    finished = datetime.now()
+    launch_ids = [launch_id for launch_id in map(int, launch_ids)
+                  if Launch.objects.filter(
+                      pk=launch_id, state__in=[INITIALIZED, IN_PROGRESS]).
+                  update(state=state, finished=finished) != 0]
+    if len(launch_ids) == 0:
+        return launch_ids
+
+    counts = dict((launch_id, {'passed': 0, 'failed': 0, 'skipped': 0,
+                               'blocked': 0, 'total': 0})
+                  for launch_id in launch_ids)
+    names = {PASSED: 'passed', FAILED: 'failed',
+             SKIPPED: 'skipped', BLOCKED: 'blocked'}
+    rows = TestResult.objects.filter(launch_id__in=launch_ids).\
+        values('launch_id', 'state').annotate(count=Count('id'))
+    for row in rows:
+        counts[row['launch_id']][names[row['state']]] += row['count']
+        counts[row['launch_id']]['total'] += row['count']
+
+    tasks = {}
+    partial = set()
+    for launch_id, value, parameters in Launch.objects.filter(
+            pk__in=launch_ids).values_list('id', 'tasks', 'parameters'):
+        tasks[launch_id] = json.loads(value or '{}')
+        if is_partial_launch(json.loads(parameters or '{}')):
+            partial.add(launch_id)
+    results = get_task_results(
+        [task_id for ids in tasks.values() for task_id in ids])
+
+    with transaction.atomic():
+        for launch_id, data in iter(counts.items()):
+            Launch.objects.filter(pk=launch_id).update(
+                counts_cache=json.dumps(data),
+                resources=json.dumps(aggregate_resources(
+                    tasks.get(launch_id, {}), results)))
+    # durations of shards and reruns are not durations of whole launch items
+    for launch_id, launch_tasks in iter(tasks.items()):
+        if launch_id not in partial:
+            update_duration_baselines(launch_tasks, results)
+
+    days = set()
+    for launch in Launch.objects.filter(pk__in=launch_ids):
+        days.add((launch.test_plan_id, get_launch_date(launch)))
+    for test_plan_id, date in days:
+        update_rollups(test_plan_id, date)
+    return launch_ids
+
 
 @celery.task()
 def finalize_broken_launches():
     log.debug("Finalize broke launches...")
+    launches = dict(Launch.objects.filter(state__exact=INITIALIZED).
+                    values_list('id', 'tasks'))
+    tasks = dict((launch_id, list(json.loads(value or '{}').keys()))
+                 for launch_id, value in iter(launches.items()))
+    task_ids = [task_id for ids in tasks.values() for task_id in ids]
+
+    finished_tasks = set(TaskMeta.objects.filter(
+        task_id__in=task_ids, status__in=CELERY_FINISHED_STATES).
+        values_list('task_id', flat=True))
+    finished = [launch_id for launch_id, ids in iter(tasks.items())
+                if all(task_id in finished_tasks for task_id in ids)]
+    log.debug("Launches {} are finished".format(finished))
+    if len(finished) != 0:
+        finished = finalize_launches(finished)
+    return finished
 
-    def is_finished(launch):
-        log.debug("Check {} is finished".format(launch))
-        for k, v in iter(launch.get_tasks().items()):
-            res = celery.result.AsyncResult(k)
-            if res.state not in CELERY_FINISHED_STATES:
-                return False
-        return True
-
-    def process(launch):
-        if is_finished(launch):
-            finalize_launch(launch.id)
-        return launch
 
-    return list(map(process, Launch.objects.filter(state__exact=0)))
+@celery.task()
+def refresh_issue_fields(externalId):
+    refresh_cached_issue_fields(externalId)
 
 
 @celery.task()
@@ -98,6 +225,24 @@ def cleanup_database():
     days = timezone.now().date() - timedelta(
         days=settings.STORE_TESTRESULTS_IN_DAYS)
 
+    # logs of tasks of expired launches are deleted from storage once
+    for launch in Launch.objects.filter(finished__lte=days,
+                                        logs_deleted=False):
+        for task_id in launch.get_tasks().keys():
+            list(map(delete_log, get_log_names(task_id).values()))
+        Launch.objects.filter(pk=launch.pk).update(logs_deleted=True)
+
+    # payloads of results of expired tasks
+    delete_unused_payloads()
+
+    if settings.ARCHIVE_TESTRESULTS:
+        # launches without test results are not selected again every run
+        list(map(archive_launch,
+                 Launch.objects.filter(finished__lte=days,
+                                       archive__isnull=True,
+                                       testresult__isnull=False).distinct()))
+        return
+
     list(map(lambda launch: launch.testresult_set.all().delete(),
          Launch.objects.filter(finished__lte=days)))
 
@@ -105,54 +250,73 @@ def cleanup_database():
 @celery.task()
 def update_bugs():
     if settings.JIRA_INTEGRATION:
-        for bug in Bug.objects.all():
-            try:
-                update_state(bug)
-            except Exception as e:
-                log.error('Unable to update bug {}: {}'.
-                          format(bug.externalId, e))
+        now = timezone.now()
+        bugs = [bug for bug in Bug.objects.all() if is_bug_outdated(bug, now)]
+        if not bugs:
+            return
+        fields = get_issues_fields_from_bts(
+            list(set(bug.externalId for bug in bugs)))
+
+        expired = []
+        states = {}
+        for bug in bugs:
+            if bug.externalId not in fields:
+                log.error('Unable to update bug {}: issue not found'.format(
+                    bug.externalId))
+                continue
+            new_state = fields[bug.externalId]['status']['name']
+            action = get_bug_action(bug, new_state, now)
+            if action == 'delete':
+                expired.append(bug.id)
+            elif action == 'update':
+                states.setdefault(new_state, []).append(bug.id)
+
+        with transaction.atomic():
+            if expired:
+                log.debug('Bugs {} expired, deleting them from DB'.format(
+                    expired))
+                Bug.objects.filter(id__in=expired).delete()
+            for state, ids in iter(states.items()):
+                log.debug('Saving bugs {} with state "{}"'.format(ids, state))
+                Bug.objects.filter(id__in=ids).update(state=state, updated=now)
     else:
         log.info('Jira integration is off. '
                  'If you want to use this feature, turn it on.')
 
 
-def update_state(bug):
-    log.debug('Starting bug "{}" update'.format(bug.externalId))
-    now = datetime.utcnow()
-    td = now - datetime.replace(bug.updated, tzinfo=None)
-    diff = (td.microseconds +
-            (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
-
-    if bug.state in settings.BUG_STATE_EXPIRED:
-        old_state = bug.state
-        new_state = \
-            get_issue_fields_from_bts(bug.externalId)['status']['name']
-        log.debug('Comparing bug state,'
-                  '"{0}" and "{1}"'.format(old_state, new_state))
-        if old_state == new_state and diff > float(settings.BUG_TIME_EXPIRED):
-            log.debug(
-                'Bug "{}" expired, deleting it from DB'.format(bug.externalId))
-            bug.delete()
-        elif old_state == new_state \
-                and diff < float(settings.BUG_TIME_EXPIRED):
+def _get_bug_age(bug, now):
+    return (now - bug.updated).total_seconds()
+
+
+def is_bug_outdated(bug, now):
+    """
+    Bugs in expired states are checked every time, others only after
+    TIME_BEFORE_UPDATE_BUG_INFO seconds since last update.
+    """
+    return bug.state in settings.BUG_STATE_EXPIRED or \
+        _get_bug_age(bug, now) > float(settings.TIME_BEFORE_UPDATE_BUG_INFO)
+
+
+def get_bug_action(bug, new_state, now):
+    """
+    Returns "delete" for bug which is in the same expired state for more
+    than BUG_TIME_EXPIRED seconds, "update" if state of bug should be
+    saved, or None.
+    """
+    diff = _get_bug_age(bug, now)
+    if bug.state in settings.BUG_STATE_EXPIRED and bug.state == new_state:
+        if diff > float(settings.BUG_TIME_EXPIRED):
+            return 'delete'
+        if diff < float(settings.BUG_TIME_EXPIRED):
             log.debug(
                 'Bug "{}" not updated, '
                 'because {} seconds not expired'.format(
                     bug.externalId, settings.BUG_TIME_EXPIRED))
-        else:
-            bug.state = new_state
-            bug.updated = now
-            log.debug('Saving bug "{}"'.format(bug.externalId))
-            bug.save()
-    if bug.state not in settings.BUG_STATE_EXPIRED \
-            and diff > float(settings.TIME_BEFORE_UPDATE_BUG_INFO):
-        log.debug("%s > %s time to update bug state.", diff,
-                  settings.TIME_BEFORE_UPDATE_BUG_INFO)
-        bug.updated = now
-        bug.state = \
-            get_issue_fields_from_bts(bug.externalId)['status']['name']
-        log.debug('Saving bug "{}"'.format(bug.externalId))
-        bug.save()
+            return None
+    if bug.state in settings.BUG_STATE_EXPIRED \
+            or diff > float(settings.TIME_BEFORE_UPDATE_BUG_INFO):
+        return 'update'
+    return None
 
 
 @celery.task(bind=True)
@@ -195,12 +359,14 @@ def parse_xml(self, xunit_format, launch_id, params, s3_conn=False,
         add_comment_to_launch(launch_id, comment)
 
     if s3_conn:
-        finalize_launch(launch_id=launch_id, tries=0)
+        finalize_launch(launch_id=launch_id)
         delete_file_from_storage(s3_connection, s3_key_name)
         log.debug('Xml file "{}" deleted'.format(s3_key_name))
-    else:
-        launch = Launch.objects.get(pk=launch_id)
-        launch.calculate_counts()
+    # Launch can be already finalized by its last task before xml is
+    # parsed, so counts and rollups are recalculated anyway
+    launch = Launch.objects.get(pk=launch_id)
+    launch.calculate_counts()
+    update_rollups(launch.test_plan_id, get_launch_date(launch))
 
 
 def delete_file_from_storage(s3_connection, file_name):
@@ -1,13 +1,44 @@
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.conf import settings
 
 from common.models import Project
 from common.tasks import launch_process
+from common.slots import acquire_slot
+from common.results import load_result, offload_result
+from common.storage import put_blob, get_blob
+from common.output import OutputCollector, read_log
+
+from testreport.tasks import finalize_broken_launches
+from testreport.tasks import cleanup_database
+from testreport.tasks import create_environment
+from testreport.history import split_to_shards, get_adaptive_timeouts
+from testreport.history import update_duration_baselines
+from testreport.progress import calculate_progress
+
+from djcelery.models import TaskMeta
+
+from celery import states
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_postrun
+from celery.utils import uuid
+
+import os
+import json
+import psutil
+import signal
+import tempfile
+import time
+from datetime import timedelta
 
 from testreport.models import TestPlan
 from testreport.models import Launch
 from testreport.models import TestResult
 from testreport.models import FAILED
 from testreport.models import PASSED
+from testreport.models import INITIALIZED, FINISHED, STOPPED
+from testreport.models import LaunchItem, ASYNC_CALL, INIT_SCRIPT, CONCLUSIVE
 
 
 class ProjectTests(TestCase):
@@ -114,6 +145,135 @@ class TestLaunchProcessFunction(TestCase):
         self.assertEqual(output['stderr'], b'Error\n')
         self.assertEqual(output['return_code'], 1)
 
+    @override_settings(LAUNCH_OUTPUT_BUFFER_SIZE=4, LAUNCH_LOG_PART_SIZE=5,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_output_to_log(self):
+        output = launch_process.apply(
+            ['echo "Hello world"; echo "Error" 1>&2'],
+            {'env': {'WORKSPACE': tempfile.mkdtemp()}}, task_id='task').result
+        self.assertEqual(output['stdout'],
+                         b'Hell\n...skipped 4 bytes...\nrld\n')
+        self.assertEqual(output['stdout_size'], 12)
+        self.assertEqual(output['stderr'], b'Error\n')
+        self.assertEqual(output['logs']['stdout'], 'logs/task.stdout.log')
+        self.assertEqual((b'Hello world\n', 12),
+                         read_log(output['logs']['stdout']))
+        self.assertEqual((b'o wor', 12),
+                         read_log(output['logs']['stdout'], 4, 5))
+
+    @override_settings(LAUNCHER_SLOTS=1, LAUNCHER_SLOTS_DIR=tempfile.mkdtemp())
+    def test_soft_time_limit(self):
+        def soft_time_limit(signum, frame):
+            raise SoftTimeLimitExceeded()
+        handler = signal.signal(signal.SIGALRM, soft_time_limit)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.5)
+            output = launch_process('sleep 30')
+        finally:
+            signal.signal(signal.SIGALRM, handler)
+        self.assertEqual(1, output['return_code'])
+        self.assertLess(output['delta'], 10)
+        # process is killed and its slot is released
+        self.assertEqual([], [child for child in psutil.Process().children()
+                              if 'sleep' in ' '.join(child.cmdline())])
+        slot = acquire_slot(settings.LAUNCHER_SLOTS_DIR, 1)
+        self.assertIsNotNone(slot)
+        slot.close()
+
+    @override_settings(LAUNCH_RESOURCES_INTERVAL=0.1,
+                       LAUNCH_RESOURCES_SERIES=True)
+    def test_resources(self):
+        output = launch_process('sleep 0.5; echo "Hello world"')
+        resources = output['resources']
+        self.assertGreater(resources['samples'], 0)
+        self.assertGreater(resources['max_rss'], 0)
+        self.assertGreaterEqual(resources['max_processes'], 1)
+        self.assertEqual(resources['samples'], len(resources['series']))
+
+    @override_settings(LAUNCH_RESOURCES_INTERVAL=0)
+    def test_resources_disabled(self):
+        output = launch_process('echo "Hello world"')
+        self.assertNotIn('resources', output)
+
+    @override_settings(LAUNCH_RESULT_INLINE_LIMIT=10,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_large_result_offloaded(self):
+        output = launch_process('echo "Hello world"')
+        self.assertNotIn('stdout', output)
+        self.assertNotIn('env', output)
+        self.assertEqual(0, output['return_code'])
+        self.assertEqual(12, output['stdout_size'])
+        self.assertEqual(output['payload'],
+                         launch_process('echo "Hello world"')['payload'])
+
+        result = load_result(output)
+        self.assertEqual(b'Hello world\n', result['stdout'])
+        self.assertEqual(b'', result['stderr'])
+        self.assertEqual('echo "Hello world"', result['cmd'])
+        self.assertNotIn('payload', result)
+
+    @override_settings(LAUNCH_RESULT_INLINE_LIMIT=10,
+                       LAUNCH_RESULT_PAYLOAD_MIN_AGE=0,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_unused_payloads_deleted(self):
+        result = offload_result({'cmd': 'echo "Hello world"', 'env': {},
+                                 'stdout': b'Hello world\n', 'stderr': b''})
+        TaskMeta.objects.create(task_id=uuid(), status=states.SUCCESS,
+                                result=result)
+        put_blob('results/unused.json.gz', b'')
+        cleanup_database()
+        self.assertIsNotNone(get_blob(result['payload']))
+        self.assertIsNone(get_blob('results/unused.json.gz'))
+
+    def test_wait_in_queue(self):
+        output = launch_process.apply(
+            ['echo "Hello world"'], {'queued': time.time() - 5}).result
+        self.assertGreaterEqual(output['wait'], 5)
+
+    def test_slots(self):
+        directory = tempfile.mkdtemp()
+        slots = [acquire_slot(directory, 2), acquire_slot(directory, 2)]
+        self.assertIsNotNone(slots[0])
+        self.assertIsNotNone(slots[1])
+        self.assertIsNone(acquire_slot(directory, 2))
+        slots[0].close()
+        slot = acquire_slot(directory, 2)
+        self.assertIsNotNone(slot)
+        slot.close()
+        slots[1].close()
+
+    def test_logs_of_running_task(self):
+        task_id = uuid()
+        output = launch_process.apply(
+            ['echo "Hello world"'],
+            {'env': {'WORKSPACE': tempfile.mkdtemp()}},
+            task_id=task_id).result
+        meta = TaskMeta.objects.get(task_id=task_id)
+        self.assertEqual(meta.status, 'STARTED')
+        self.assertEqual(meta.result['logs'], output['logs'])
+
+    @override_settings(LAUNCH_LOG_MAX_SIZE=5,
+                       LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_log_max_size(self):
+        output = launch_process.apply(
+            ['echo "Hello world"'],
+            {'env': {'WORKSPACE': tempfile.mkdtemp()}}).result
+        self.assertEqual(output['stdout'], b'Hello world\n')
+        self.assertEqual((b'Hello', 5), read_log(output['logs']['stdout']))
+
+    @override_settings(LOCAL_STORAGE_DIR=tempfile.mkdtemp())
+    def test_log_of_running_process_uploaded(self):
+        read_fd, write_fd = os.pipe()
+        collector = OutputCollector(os.fdopen(read_fd, 'rb'), 'logs/running',
+                                    upload_interval=0.2)
+        collector.start()
+        os.write(write_fd, b'Hello')
+        time.sleep(0.5)
+        # output is uploaded, while process is still running
+        self.assertEqual((b'Hello', 5), read_log('logs/running'))
+        os.close(write_fd)
+        collector.join()
+
     def test_env(self):
         test_dict = {
             'HOME': '/tmp/',
@@ -124,3 +284,244 @@ class TestLaunchProcessFunction(TestCase):
                                 env=test_dict)
         self.assertDictEqual(output['env'], test_dict)
         self.assertEqual(output['stdout'], b'/tmp/;VALUE;0\n')
+
+
+class TestSharding(TestCase):
+    def test_split_to_shards(self):
+        durations = {('suite', 'a'): 5, ('suite', 'b'): 4,
+                     ('suite', 'c'): 3, ('suite', 'd'): 3}
+        self.assertEqual(
+            [[('suite', 'a'), ('suite', 'd')],
+             [('suite', 'b'), ('suite', 'c')]],
+            split_to_shards(durations, 2))
+        self.assertEqual(1, len(split_to_shards({('suite', 'a'): 1}, 2)))
+
+    @override_settings(ADAPTIVE_TIMEOUT_MIN_SAMPLES=3,
+                       ADAPTIVE_TIMEOUT_PERCENTILE=50,
+                       ADAPTIVE_TIMEOUT_FACTOR=2,
+                       ADAPTIVE_TIMEOUT_MIN=60,
+                       ADAPTIVE_TIMEOUT_MAX=1000)
+    def test_adaptive_timeouts(self):
+        project = Project.objects.create(name='Test Project 1')
+        test_plan = TestPlan.objects.create(name='Test Plan 1',
+                                            project=project)
+        samples = {1: [100, 200, 300], 2: [10, 20, 30], 3: [600, 700, 800],
+                   4: [100, 100]}
+        for index in range(3):
+            tasks = {}
+            for launch_item_id, deltas in iter(samples.items()):
+                if index < len(deltas):
+                    task_id = uuid()
+                    tasks[task_id] = launch_item_id
+                    TaskMeta.objects.create(
+                        task_id=task_id, status=states.SUCCESS,
+                        result={'delta': deltas[index], 'return_code': 0})
+            # failed and timed out tasks are not counted
+            for status, return_code in [(states.FAILURE, 0),
+                                        (states.SUCCESS, 1),
+                                        (states.SUCCESS, -15)]:
+                task_id = uuid()
+                tasks[task_id] = 1
+                TaskMeta.objects.create(
+                    task_id=task_id, status=status,
+                    result={'delta': 10000, 'return_code': return_code})
+            launch = Launch(test_plan=test_plan)
+            launch.set_tasks(tasks)
+            launch.save()
+        # shards and reruns are not counted
+        for options in [{'shards': '2'}, {'rerun_of': launch.id}]:
+            task_id = uuid()
+            TaskMeta.objects.create(
+                task_id=task_id, status=states.SUCCESS,
+                result={'delta': 5, 'return_code': 0})
+            partial = Launch(test_plan=test_plan)
+            partial.set_tasks({task_id: 4})
+            partial.set_parameters({'options': options})
+            partial.save()
+
+        self.assertEqual({1: 400, 2: 60, 3: 1000},
+                         get_adaptive_timeouts(test_plan.id, [1, 2, 3, 4]))
+        self.assertEqual({}, get_adaptive_timeouts(test_plan.id, []))
+
+    def test_shard_files(self):
+        workspace = tempfile.mkdtemp()
+        tests = [{'suite': 'suite', 'name': 'a'}]
+        create_environment({'WORKSPACE': workspace}, None,
+                           {'shards/1-0.json': tests})
+        with open(os.path.join(workspace, 'shards', '1-0.json')) as f:
+            self.assertEqual(tests, json.load(f))
+
+    def test_order_file(self):
+        project = Project.objects.create(name='Test Project')
+        test_plan = TestPlan.objects.create(name='Test Plan',
+                                            project=project)
+        launch = Launch.objects.create(test_plan=test_plan)
+        for name, state in [('a', PASSED), ('b', FAILED)]:
+            TestResult.objects.create(launch=launch, suite='suite', name=name,
+                                      state=state, duration=1,
+                                      launch_item_id=1)
+        workspace = tempfile.mkdtemp()
+        create_environment({'WORKSPACE': workspace,
+                            'TESTPLAN_ID': str(test_plan.id)}, None,
+                           order=True)
+        with open(os.path.join(workspace, 'order.json')) as f:
+            self.assertEqual(['b', 'a'],
+                             [test['name'] for test in json.load(f)])
+
+
+class TestLaunchProgress(TestCase):
+    def test_calculate_progress(self):
+        project = Project.objects.create(name='Test Project 1')
+        test_plan = TestPlan.objects.create(name='Test Plan 1',
+                                            project=project)
+        tasks = {}
+        for item_type, baseline, status, started in [
+                (INIT_SCRIPT, 20, states.SUCCESS, None),
+                (ASYNC_CALL, 100, states.STARTED, 40),
+                (ASYNC_CALL, 50, None, None),
+                (CONCLUSIVE, 10, None, None)]:
+            item = LaunchItem.objects.create(
+                test_plan=test_plan, command='', type=item_type,
+                duration_baseline=baseline)
+            task_id = uuid()
+            tasks[task_id] = item.id
+            if status is not None:
+                task = TaskMeta.objects.create(task_id=task_id, status=status)
+                if started is not None:
+                    TaskMeta.objects.filter(id=task.id).update(
+                        date_done=timezone.now() - timedelta(
+                            seconds=started))
+        launch = Launch(test_plan=test_plan, state=INITIALIZED)
+        launch.set_tasks(tasks)
+        launch.save()
+
+        progress = calculate_progress(launch)
+        self.assertEqual({'total': 4, 'finished': 1, 'running': 1,
+                          'pending': 2}, progress['tasks'])
+        self.assertAlmostEqual(33.3, progress['percent'], places=0)
+        self.assertAlmostEqual(70, progress['remaining'], places=0)
+
+        launch.state = FINISHED
+        self.assertEqual(100, calculate_progress(launch)['percent'])
+
+
+class TestLaunchFinalization(TestCase):
+    def setUp(self):
+        project = Project.objects.create(name='Test Project 1')
+        test_plan = TestPlan.objects.create(name='Test Plan 1',
+                                            project=project)
+        self.tasks = [uuid(), uuid()]
+        self.launch = Launch(test_plan=test_plan, state=INITIALIZED)
+        self.launch.set_tasks(dict((task_id, 1) for task_id in self.tasks))
+        self.launch.save()
+
+    def _finish_task(self, task_id, state=states.SUCCESS, result=None):
+        TaskMeta.objects.create(task_id=task_id, status=state, result=result)
+        task_postrun.send(sender=launch_process, task_id=task_id,
+                          task=launch_process, args=[],
+                          kwargs={'env': {'LAUNCH_ID': str(self.launch.id)}},
+                          retval=None, state=state)
+        return Launch.objects.get(id=self.launch.id)
+
+    def test_finalize_after_last_task(self):
+        launch = self._finish_task(self.tasks[0])
+        self.assertEqual(INITIALIZED, launch.state)
+        self.assertIsNone(launch.finished)
+
+        launch = self._finish_task(self.tasks[1], states.REVOKED)
+        self.assertEqual(FINISHED, launch.state)
+        self.assertIsNotNone(launch.finished)
+        self.assertEqual(0, launch.counts['total'])
+
+    def test_resources_on_finalize(self):
+        for task_id, rss in zip(self.tasks, [100, 200]):
+            launch = self._finish_task(task_id, result={
+                'delta': 2.0,
+                'resources': {'cpu_time': 1.5, 'max_rss': rss,
+                              'read_bytes': 10, 'write_bytes': 20,
+                              'max_processes': 3, 'samples': 2}})
+        self.assertEqual({'1': {'tasks': 2, 'duration': 4.0,
+                                'cpu_time': 3.0, 'max_rss': 200,
+                                'read_bytes': 20, 'write_bytes': 40,
+                                'max_processes': 3}},
+                         launch.get_resources())
+
+    @override_settings(DURATION_BASELINE_ALPHA=0.5)
+    def test_duration_baselines(self):
+        item = LaunchItem.objects.create(test_plan=self.launch.test_plan,
+                                         command='', type=ASYNC_CALL)
+        self.launch.set_tasks(dict((task_id, item.id)
+                                   for task_id in self.tasks))
+        self.launch.save()
+        self._finish_task(self.tasks[0], result={'delta': 10.0})
+        self._finish_task(self.tasks[1], result={'delta': 20.0})
+        self.assertEqual(15.0,
+                         LaunchItem.objects.get(id=item.id).duration_baseline)
+
+        update_duration_baselines({'task': item.id}, {'task': {'delta': 5.0}})
+        self.assertEqual(10.0,
+                         LaunchItem.objects.get(id=item.id).duration_baseline)
+
+    def test_stopped_launch_not_finalized(self):
+        Launch.objects.filter(id=self.launch.id).update(state=STOPPED)
+        self._finish_task(self.tasks[0], states.REVOKED)
+        launch = self._finish_task(self.tasks[1], states.REVOKED)
+        self.assertEqual(STOPPED, launch.state)
+
+    def test_counts_do_not_overwrite_state(self):
+        launch = Launch.objects.get(id=self.launch.id)
+        Launch.objects.filter(id=self.launch.id).update(state=FINISHED)
+        launch.calculate_counts()
+        self.assertEqual(FINISHED,
+                         Launch.objects.get(id=self.launch.id).state)
+
+    def test_finalize_broken_launches(self):
+        launch = Launch(test_plan=self.launch.test_plan, state=INITIALIZED)
+        launch.set_tasks({uuid(): 1})
+        launch.save()
+        TestResult.objects.create(launch=launch, name='Test', suite='Suite',
+                                  state=FAILED)
+        for task_id in launch.get_tasks().keys():
+            TaskMeta.objects.create(task_id=task_id, status=states.FAILURE)
+        TaskMeta.objects.create(task_id=self.tasks[0], status=states.SUCCESS)
+
+        self.assertEqual([launch.id], finalize_broken_launches())
+        launch = Launch.objects.get(id=launch.id)
+        self.assertEqual(FINISHED, launch.state)
+        self.assertEqual(1, launch.counts['failed'])
+        self.assertEqual(1, launch.counts['total'])
+        self.assertEqual(INITIALIZED,
+                         Launch.objects.get(id=self.launch.id).state)
+        # launch is finalized once
+        self.assertEqual([], finalize_broken_launches())
+
+    def test_broken_launch_updates_baselines(self):
+        item = LaunchItem.objects.create(test_plan=self.launch.test_plan,
+                                         command='', type=ASYNC_CALL)
+        task_id = uuid()
+        launch = Launch(test_plan=self.launch.test_plan, state=INITIALIZED)
+        launch.set_tasks({task_id: item.id})
+        launch.save()
+        TaskMeta.objects.create(task_id=task_id, status=states.SUCCESS,
+                                result={'delta': 10.0})
+
+        self.assertEqual([launch.id], finalize_broken_launches())
+        self.assertEqual(10.0,
+                         LaunchItem.objects.get(id=item.id).duration_baseline)
+
+    def test_partial_launch_does_not_update_baselines(self):
+        item = LaunchItem.objects.create(test_plan=self.launch.test_plan,
+                                         command='', type=ASYNC_CALL)
+        for options in [{'shards': 2}, {'rerun_of': self.launch.id}]:
+            task_id = uuid()
+            launch = Launch(test_plan=self.launch.test_plan,
+                            state=INITIALIZED)
+            launch.set_tasks({task_id: item.id})
+            launch.set_parameters({'options': options})
+            launch.save()
+            TaskMeta.objects.create(task_id=task_id, status=states.SUCCESS,
+                                    result={'delta': 10.0})
+
+            self.assertEqual([launch.id], finalize_broken_launches())
+            self.assertIsNone(
+                LaunchItem.objects.get(id=item.id).duration_baseline)